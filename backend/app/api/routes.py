@@ -2,32 +2,50 @@
 API routes for StoryLens
 """
 import os
+import time
 import uuid
-from typing import List, Optional
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form
-from fastapi.responses import FileResponse
-from sqlalchemy.orm import Session
+import asyncio
+from datetime import datetime, timedelta
+from typing import AsyncIterator, List, Optional, Tuple
+import anyio
+import orjson
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, Request
+from fastapi.responses import JSONResponse, ORJSONResponse, StreamingResponse
+from sqlalchemy import String, and_, cast, func, literal, tuple_, select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
 
-from ..core.database import get_db
+from ..core.database import get_db, get_session_factory, AsyncSessionLocal
 from ..models.story import Story
+from ..models.job import Job, JOB_COMPLETED, JOB_FAILED
 from ..services.story_generator import StoryGeneratorService
 from ..services.audio_service import AudioService
+from ..services.story_pipeline import StoryPipeline
+from ..services.job_queue import JobQueue
+from ..services.progress import progress_broker, format_sse, EVENT_COMPLETE, EVENT_ERROR
+from ..services.transcoder import AUDIO_FORMATS, audio_format_for, audio_media_type
+from ..services.image_processing import IMAGE_FORMATS, image_processor, snap_width
 from ..core.config import settings
+from ..core.storage import storage
+from ..core.admission import admission
+from ..core.metrics import STAGE_SECONDS
+from ..core.search import search_story_ids, SearchUnsupported
+from ..utils.uploads import spool_upload, UploadTooLargeError
+from ..utils.pagination import encode_cursor, decode_cursor
 
 router = APIRouter()
 
 # Initialize services
 story_service = StoryGeneratorService()
 audio_service = AudioService()
+# The result cache is attached at startup, so importing the app doesn't open it
+pipeline = StoryPipeline(story_service, audio_service)
+job_queue = JobQueue(pipeline, AsyncSessionLocal)
 
-@router.post("/upload")
-async def upload_and_generate_story(
-    file: UploadFile = File(...),
-    story_type: str = Form("story"),
-    db: Session = Depends(get_db)
-):
-    """Upload an image and generate a story with audio narration"""
-    
+UPLOAD_MODES = ("sync", "job")
+AUDIO_MODES = ("inline", "stream")
+
+async def _save_upload(file: UploadFile):
+    """Validate an uploaded image and save it under a new story id"""
     # Validate file
     if not file.content_type or not file.content_type.startswith('image/'):
         raise HTTPException(status_code=400, detail="File must be an image")
@@ -40,108 +58,586 @@ async def upload_and_generate_story(
             detail=f"File extension not allowed. Allowed: {', '.join(settings.allowed_extensions_list)}"
         )
     
-    # Check file size
-    file_content = await file.read()
-    if len(file_content) > settings.MAX_FILE_SIZE:
+    # Copy the parsed upload to disk, rejecting files over the per-file size cap
+    try:
+        with STAGE_SECONDS.labels("upload_read").time():
+            upload = await spool_upload(
+                file,
+                storage.root,
+                settings.MAX_FILE_SIZE,
+                settings.UPLOAD_CHUNK_SIZE
+            )
+    except UploadTooLargeError:
         raise HTTPException(
             status_code=400, 
             detail=f"File too large. Maximum size: {settings.MAX_FILE_SIZE / 1024 / 1024:.1f}MB"
         )
     
-    try:
-        # Generate story
-        story_text = await story_service.generate_story(file_content, story_type)
-        
-        # Create story record
-        story_id = str(uuid.uuid4())
-        image_filename = f"{story_id}_{file.filename}"
-        
-        # Save image file
-        image_path = os.path.join(settings.AUDIO_OUTPUT_DIR, image_filename)
-        os.makedirs(settings.AUDIO_OUTPUT_DIR, exist_ok=True)
-        with open(image_path, "wb") as f:
-            f.write(file_content)
-        
-        # Generate audio
-        audio_filename = await audio_service.generate_audio(story_text, story_id)
-        
-        # Save to database
-        db_story = Story(
-            id=story_id,
-            story_text=story_text,
+    # Create story record
+    story_id = str(uuid.uuid4())
+    image_filename = f"{story_id}_{file.filename}"
+    
+    # Move the spooled file into place (same filesystem, so this is an atomic rename)
+    image_path = await storage.save(upload.path, image_filename)
+    
+    return story_id, image_filename, image_path, upload
+
+@router.post("/upload")
+async def upload_and_generate_story(
+    file: UploadFile = File(...),
+    story_type: str = Form("story"),
+    mode: str = Form("sync"),
+    audio: str = Form("inline"),
+    db: AsyncSession = Depends(get_db)
+):
+    """Upload an image and generate a story with audio narration
+    
+    In "job" mode the request returns 202 with a job that can be polled at
+    /api/jobs/{job_id} while background workers generate the story. With
+    audio="stream" the narration is not synthesized up front; the client
+    plays it progressively from the story's audio_stream_url instead.
+    """
+    
+    if mode not in UPLOAD_MODES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid mode. Allowed: {', '.join(UPLOAD_MODES)}"
+        )
+    
+    if audio not in AUDIO_MODES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid audio mode. Allowed: {', '.join(AUDIO_MODES)}"
+        )
+    
+    story_id, image_filename, image_path, upload = await _save_upload(file)
+    
+    if mode == "job":
+        # Persist the job and hand it to the background workers
+        job = Job(
+            story_id=story_id,
             story_type=story_type,
             image_filename=image_filename,
-            audio_filename=audio_filename
+            content_hash=upload.sha256
         )
-        db.add(db_story)
-        db.commit()
-        db.refresh(db_story)
+        job_queue.lease_job(job)
+        db.add(job)
+        await db.commit()
+        await db.refresh(job)
+        job_queue.submit(job.id)
         
+        return JSONResponse(
+            status_code=202,
+            content=job.to_dict(),
+            headers={"Location": f"/api/jobs/{job.id}"}
+        )
+    
+    try:
+        db_story = await pipeline.run(
+            db,
+            story_id,
+            image_path,
+            story_type,
+            image_filename,
+            content_hash=upload.sha256,
+            synthesize_audio=audio == "inline"
+        )
         return db_story.to_dict()
         
     except Exception as e:
+        await storage.delete(image_filename)
         raise HTTPException(status_code=500, detail=f"Error processing request: {str(e)}")
 
+@router.post("/upload/batch")
+async def upload_batch(
+    files: List[UploadFile] = File(...),
+    story_type: str = Form("story"),
+    audio: str = Form("inline"),
+    session_factory: async_sessionmaker = Depends(get_session_factory)
+):
+    """Upload several images and stream each finished story back as NDJSON
+    
+    Items are generated concurrently and written in completion order, one
+    JSON object per line: {"index", "filename", "story"} on success or
+    {"index", "filename", "error"} on failure. A failed item never aborts
+    the rest of the batch.
+    """
+    if audio not in AUDIO_MODES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid audio mode. Allowed: {', '.join(AUDIO_MODES)}"
+        )
+    
+    if len(files) > settings.BATCH_MAX_FILES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Too many files. Maximum per batch: {settings.BATCH_MAX_FILES}"
+        )
+    
+    # Spool every file before streaming starts, since uploads are closed once the handler returns
+    items = []
+    for index, file in enumerate(files):
+        try:
+            items.append((index, file.filename, await _save_upload(file), None))
+        except HTTPException as e:
+            items.append((index, file.filename, None, e.detail))
+    
+    return StreamingResponse(
+        _generate_batch(items, story_type, audio, session_factory),
+        media_type="application/x-ndjson"
+    )
+
+async def _generate_batch(items, story_type: str, audio: str, session_factory) -> AsyncIterator[bytes]:
+    """Run batch items through the pipeline concurrently, yielding NDJSON lines as they finish"""
+    # Items overlap so preprocessing runs in parallel and TTS requests share worker batches
+    semaphore = asyncio.Semaphore(max(1, settings.BATCH_CONCURRENCY))
+    
+    async def generate(index: int, filename: Optional[str], saved, error: Optional[str]) -> dict:
+        result = {"index": index, "filename": filename}
+        if error is not None:
+            return {**result, "error": error}
+        
+        story_id, image_filename, image_path, upload = saved
+        try:
+            async with semaphore:
+                async with session_factory() as db:
+                    db_story = await pipeline.run(
+                        db,
+                        story_id,
+                        image_path,
+                        story_type,
+                        image_filename,
+                        content_hash=upload.sha256,
+                        synthesize_audio=audio == "inline"
+                    )
+                    return {**result, "story": db_story.to_dict()}
+        except Exception as e:
+            await storage.delete(image_filename)
+            return {**result, "error": f"Error processing request: {str(e)}"}
+    
+    tasks = [asyncio.create_task(generate(*item)) for item in items]
+    streamed = False
+    try:
+        for next_result in asyncio.as_completed(tasks):
+            yield orjson.dumps(await next_result) + b"\n"
+        streamed = True
+    finally:
+        # Shielded, as the response cancels its scope when the client disconnects
+        with anyio.CancelScope(shield=True):
+            # The client went away; don't keep generating stories nobody will read
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            if not streamed:
+                await _discard_unsaved_uploads(items, session_factory)
+
+async def _discard_unsaved_uploads(items, session_factory):
+    """Delete the images of batch items that were cut short before their story was saved"""
+    saved = [item[2] for item in items if item[2] is not None]
+    if not saved:
+        return
+    async with session_factory() as db:
+        kept = set(await db.scalars(select(Story.id).where(Story.id.in_([story_id for story_id, *_ in saved]))))
+    for story_id, image_filename, _, _ in saved:
+        if story_id not in kept:
+            await storage.delete(image_filename)
+
+@router.get("/jobs/{job_id}")
+async def get_job(job_id: str, db: AsyncSession = Depends(get_db)):
+    """Get the state of a story generation job"""
+    job = await db.get(Job, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    
+    result = job.to_dict()
+    result["story"] = None
+    if job.status == JOB_COMPLETED:
+        story = await db.get(Story, job.story_id)
+        result["story"] = story.to_dict() if story else None
+    
+    return result
+
+async def _final_event(db: AsyncSession, job: Job) -> Optional[Tuple[str, dict]]:
+    """The complete or error event of a finished job, as recorded in the database"""
+    if job.status == JOB_COMPLETED:
+        story = await db.get(Story, job.story_id)
+        return EVENT_COMPLETE, {"story": story.to_dict() if story else None}
+    if job.status == JOB_FAILED:
+        return EVENT_ERROR, {"stage": job.stage, "error": job.error}
+    return None
+
+@router.get("/jobs/{job_id}/events")
+async def get_job_events(
+    job_id: str,
+    request: Request,
+    session_factory: async_sessionmaker = Depends(get_session_factory)
+):
+    """Stream a job's progress as Server-Sent Events
+    
+    Emits stage_start/stage_end with timings, story as soon as the text
+    exists, and finally complete (with the story) or error. Reconnecting
+    clients resume after the Last-Event-ID they send.
+    """
+    # Use a short-lived session rather than holding a pooled connection for the whole stream
+    async with session_factory() as db:
+        job = await db.get(Job, job_id)
+        if not job:
+            raise HTTPException(status_code=404, detail="Job not found")
+        
+        final = None
+        if not progress_broker.has(job_id):
+            # Finished before this process started, its events have expired,
+            # or another server process ran it
+            final = await _final_event(db, job)
+    
+    last_event_id = request.headers.get("last-event-id", "")
+    after = int(last_event_id) if last_event_id.isdigit() else -1
+    
+    async def poll() -> Optional[Tuple[str, dict]]:
+        async with session_factory() as db:
+            job = await db.get(Job, job_id)
+            return await _final_event(db, job) if job else None
+    
+    async def events() -> AsyncIterator[bytes]:
+        if final is not None:
+            yield format_sse(0, *final)
+            return
+        # Events only reach this process's broker if the job runs here, so
+        # check the job row on every idle interval until they start arriving
+        idle = min(settings.SSE_JOB_POLL, progress_broker.keepalive)
+        last_sent = time.monotonic()
+        async for message in progress_broker.subscribe(job_id, after, idle):
+            if message is not None:
+                yield format_sse(*message)
+                last_sent = time.monotonic()
+                continue
+            if not progress_broker.has(job_id):
+                outcome = await poll()
+                if outcome is not None:
+                    yield format_sse(0, *outcome)
+                    return
+            if time.monotonic() - last_sent >= progress_broker.keepalive:
+                # An SSE comment keeps proxies from closing an idle stream
+                yield b": keep-alive\n\n"
+                last_sent = time.monotonic()
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.get("/cache/stats")
+async def get_cache_stats():
+    """Get result cache hit/miss counters"""
+    result_cache = pipeline.result_cache
+    if result_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **result_cache.stats()}
+
+@router.get("/admission/stats")
+async def get_admission_stats():
+    """Get generation request queue and per-stage concurrency figures"""
+    return admission.stats()
+
+@router.get("/inference/breaker")
+async def get_inference_breaker():
+    """Get the state of the circuit breaker in front of the inference service"""
+    breaker = getattr(story_service.backend, "breaker", None)
+    if breaker is None:
+        return {"enabled": False, "backend": story_service.backend.name}
+    return {"enabled": True, "backend": story_service.backend.name, **breaker.snapshot()}
+
+@router.get("/tts/health")
+async def get_tts_health():
+    """Get the state of the TTS worker processes"""
+    if audio_service.pool is None:
+        return {"mode": "in-process", "available": audio_service.available, "workers": []}
+    return {"mode": "workers", "available": audio_service.available, **audio_service.pool.health()}
+
+def _parse_fields(fields: Optional[str]) -> Optional[List[str]]:
+    """Parse and validate a fields= projection parameter"""
+    if not fields:
+        return None
+    
+    field_list = [field.strip() for field in fields.split(",") if field.strip()]
+    unknown = [field for field in field_list if field not in Story.field_names()]
+    if unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown fields: {', '.join(unknown)}. Allowed: {', '.join(Story.field_names())}"
+        )
+    return field_list
+
+def _before_deleted_cursor(db: AsyncSession, created_at: Optional[datetime], story_id: str):
+    """Stories sorting after a cursor whose row no longer exists"""
+    bound = literal(created_at, Story.created_at.type)
+    if db.bind.dialect.name != "sqlite":
+        return tuple_(Story.created_at, Story.id) < tuple_(bound, story_id)
+    
+    # SQLite keeps timestamps as text: whole seconds when the database filled in the
+    # default, microseconds when SQLAlchemy wrote them (as it renders the bound value).
+    # Pad the stored text to microseconds so equal times compare equal, and keep a
+    # plain comparison a second later so the created_at index still narrows the scan
+    stored = func.substr(cast(Story.created_at, String).concat(".000000"), 1, 26)
+    if created_at is None:
+        return tuple_(stored, Story.id) < tuple_(bound, story_id)
+    return and_(
+        Story.created_at < literal(created_at + timedelta(seconds=1), Story.created_at.type),
+        tuple_(stored, Story.id) < tuple_(bound, story_id)
+    )
+
 @router.get("/stories")
 async def get_stories(
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db)
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    db: AsyncSession = Depends(get_db)
 ):
-    """Get all stories with pagination"""
-    stories = db.query(Story).offset(skip).limit(limit).all()
-    return [story.to_dict() for story in stories]
+    """Get stories newest first with keyset pagination
+    
+    Pass the X-Next-Cursor header of one page as ?cursor= to fetch the next;
+    skip is still honoured for offset pagination. fields= limits each story
+    to a comma separated list of keys, e.g. fields=id,audio_url,created_at.
+    """
+    field_list = _parse_fields(fields)
+    
+    # Plain rows of just the needed columns; the sort key is always selected for the next cursor
+    query = select(*Story.columns_for((field_list or Story.field_names()) + ["created_at"]))
+    
+    if cursor:
+        try:
+            created_at, story_id = decode_cursor(cursor)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        
+        # Compare against the stored key of the cursor row so the database's own
+        # timestamp representation is used; fall back to the encoded value if it's gone
+        if await db.scalar(select(Story.id).where(Story.id == story_id)):
+            anchor = (
+                select(Story.created_at, Story.id)
+                .where(Story.id == story_id)
+                .correlate(None)
+                .scalar_subquery()
+            )
+            query = query.where(tuple_(Story.created_at, Story.id) < anchor)
+        else:
+            query = query.where(_before_deleted_cursor(db, created_at, story_id))
+    elif skip:
+        query = query.offset(skip)
+    
+    rows = (await db.execute(query.order_by(Story.created_at.desc(), Story.id.desc()).limit(limit))).all()
+    
+    # Returned directly so the list skips FastAPI's generic encoder
+    response = ORJSONResponse([Story.serialize(row, field_list) for row in rows])
+    if rows and len(rows) == limit:
+        response.headers["X-Next-Cursor"] = encode_cursor(rows[-1].created_at, rows[-1].id)
+    return response
+
+@router.get("/stories/search")
+async def search_stories(
+    q: str,
+    limit: int = 20,
+    offset: int = 0,
+    fields: Optional[str] = None,
+    db: AsyncSession = Depends(get_db)
+):
+    """Full-text search over story text, best match first"""
+    field_list = _parse_fields(fields)
+    limit = max(1, min(limit, 100))
+    
+    try:
+        matches = await db.run_sync(search_story_ids, q, limit, max(0, offset))
+    except SearchUnsupported:
+        raise HTTPException(status_code=501, detail="Search is not supported on this database")
+    stories = {}
+    if matches:
+        query = (
+            select(*Story.columns_for(field_list or Story.field_names()))
+            .where(Story.id.in_([story_id for story_id, _ in matches]))
+        )
+        stories = {row.id: row for row in (await db.execute(query)).all()}
+    
+    results = []
+    for story_id, score in matches:
+        if story_id in stories:
+            results.append({**Story.serialize(stories[story_id], field_list), "score": score})
+    
+    return ORJSONResponse({"query": q, "limit": limit, "offset": max(0, offset), "results": results})
+
+@router.get("/stories/export")
+async def export_stories(
+    fields: Optional[str] = None,
+    session_factory: async_sessionmaker = Depends(get_session_factory)
+):
+    """Stream every story, oldest first, as NDJSON
+    
+    Rows are read through a server-side cursor EXPORT_CHUNK_ROWS at a time
+    and written a chunk at a time, so memory use doesn't grow with the
+    archive. fields= works as for /api/stories.
+    """
+    field_list = _parse_fields(fields)
+    return StreamingResponse(_export_stories(field_list, session_factory), media_type="application/x-ndjson")
+
+async def _export_stories(
+    field_list: Optional[List[str]],
+    session_factory: async_sessionmaker
+) -> AsyncIterator[bytes]:
+    """Yield the stories table as NDJSON, one chunk of lines per fetched batch of rows"""
+    query = (
+        select(*Story.columns_for(field_list or Story.field_names()))
+        .order_by(Story.created_at, Story.id)
+        .execution_options(yield_per=max(1, settings.EXPORT_CHUNK_ROWS))
+    )
+    # The session lives as long as the stream rather than the request
+    async with session_factory() as db:
+        result = await db.stream(query)
+        async for rows in result.partitions():
+            yield b"".join(orjson.dumps(Story.serialize(row, field_list)) + b"\n" for row in rows)
 
 @router.get("/stories/{story_id}")
-async def get_story(story_id: str, db: Session = Depends(get_db)):
+async def get_story(story_id: str, db: AsyncSession = Depends(get_db)):
     """Get a specific story by ID"""
-    story = db.query(Story).filter(Story.id == story_id).first()
+    story = await db.get(Story, story_id)
     if not story:
         raise HTTPException(status_code=404, detail="Story not found")
     return story.to_dict()
 
+async def _save_audio_filename(session_factory: async_sessionmaker, story_id: str, audio_filename: Optional[str]):
+    async with session_factory() as db:
+        story = await db.get(Story, story_id)
+        if story is not None:
+            story.audio_filename = audio_filename
+            await db.commit()
+
+@router.get("/stories/{story_id}/audio/stream")
+async def stream_story_audio(
+    story_id: str,
+    session_factory: async_sessionmaker = Depends(get_session_factory)
+):
+    """Stream a story's narration, synthesizing it sentence by sentence if needed"""
+    # Short-lived sessions, so no connection sits idle in a transaction during synthesis
+    async with session_factory() as db:
+        story = await db.get(Story, story_id)
+    if not story:
+        raise HTTPException(status_code=404, detail="Story not found")
+    
+    # Already synthesized: serve the finished file
+    if story.audio_filename:
+        file_path = await storage.fetch(story.audio_filename)
+        if file_path is not None:
+            return storage.response(file_path, media_type=audio_media_type(file_path))
+    
+    # The same text was narrated before, e.g. a fallback story: link it instead of streaming
+    audio_filename = await audio_service.reuse_narration(story.story_text, story.id)
+    if audio_filename is not None:
+        await _save_audio_filename(session_factory, story.id, audio_filename)
+        file_path = await storage.fetch(audio_filename)
+        return storage.response(file_path, media_type=audio_media_type(file_path))
+    
+    if not audio_service.available:
+        raise HTTPException(status_code=503, detail="Audio generation is not available")
+    
+    async def on_complete(audio_filename: Optional[str]):
+        await _save_audio_filename(session_factory, story.id, audio_filename)
+    
+    return StreamingResponse(
+        audio_service.stream_audio(story.story_text, story.id, on_complete=on_complete),
+        media_type="audio/wav"
+    )
+
 @router.delete("/stories/{story_id}")
-async def delete_story(story_id: str, db: Session = Depends(get_db)):
+async def delete_story(story_id: str, db: AsyncSession = Depends(get_db)):
     """Delete a story and its associated files"""
-    story = db.query(Story).filter(Story.id == story_id).first()
+    story = await db.get(Story, story_id)
     if not story:
         raise HTTPException(status_code=404, detail="Story not found")
     
     # Delete associated files
     if story.audio_filename:
-        audio_service.delete_audio_file(story.audio_filename)
+        await audio_service.delete_audio_file(story.audio_filename, story.story_text)
     
     if story.image_filename:
-        image_path = os.path.join(settings.AUDIO_OUTPUT_DIR, story.image_filename)
-        if os.path.exists(image_path):
-            os.remove(image_path)
+        await storage.delete(story.image_filename)
+        await image_processor.delete_derivatives(story.image_filename)
     
     # Delete from database
-    db.delete(story)
-    db.commit()
+    await db.delete(story)
+    await db.commit()
     
     return {"message": "Story deleted successfully"}
 
 @router.get("/audio/{filename}")
-async def get_audio_file(filename: str):
-    """Stream audio file"""
-    file_path = os.path.join(settings.AUDIO_OUTPUT_DIR, filename)
+async def get_audio_file(filename: str, format: Optional[str] = None):
+    """Stream audio file, optionally transcoded to another format"""
+    file_path = await storage.fetch(filename)
     
-    if not os.path.exists(file_path):
+    if file_path is None:
         raise HTTPException(status_code=404, detail="Audio file not found")
     
-    return FileResponse(
+    if format and format != audio_format_for(filename):
+        if format not in AUDIO_FORMATS:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Unsupported audio format. Allowed: {', '.join(AUDIO_FORMATS)}"
+            )
+        if not audio_service.transcoder.available:
+            raise HTTPException(status_code=503, detail="Audio transcoding is not available")
+        
+        try:
+            file_path = await audio_service.transcoder.get_derivative(file_path, format)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Error transcoding audio: {str(e)}")
+    
+    return storage.response(
         file_path,
-        media_type="audio/wav",
-        filename=filename
+        immutable=True,
+        media_type=audio_media_type(file_path),
+        filename=os.path.basename(file_path)
     )
 
 @router.get("/images/{filename}")
-async def get_image_file(filename: str):
-    """Get uploaded image file"""
-    file_path = os.path.join(settings.AUDIO_OUTPUT_DIR, filename)
+async def get_image_file(
+    request: Request,
+    filename: str,
+    w: Optional[int] = None,
+    format: Optional[str] = None
+):
+    """Get uploaded image file, or a resized copy of it with ?w=
+    
+    w is rounded up to the nearest configured width. Without format= the
+    copy is WebP for clients that accept it and JPEG otherwise.
+    """
+    file_path = await storage.fetch(filename)
     
-    if not os.path.exists(file_path):
+    if file_path is None:
         raise HTTPException(status_code=404, detail="Image file not found")
     
-    return FileResponse(file_path) 
\ No newline at end of file
+    if w is None:
+        return storage.response(file_path, immutable=True)
+    
+    if w <= 0:
+        raise HTTPException(status_code=400, detail="Width must be positive")
+    
+    headers = {}
+    if format is None:
+        format = "webp" if "image/webp" in request.headers.get("accept", "") else "jpeg"
+        headers["Vary"] = "Accept"
+    elif format not in IMAGE_FORMATS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unsupported image format. Allowed: {', '.join(IMAGE_FORMATS)}"
+        )
+    
+    try:
+        derivative_path = await image_processor.get_derivative(file_path, snap_width(w), format)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error resizing image: {str(e)}")
+    
+    return storage.response(
+        derivative_path,
+        immutable=True,
+        media_type=IMAGE_FORMATS[format][1],
+        headers=headers
+    ) 
\ No newline at end of file
@@ -0,0 +1,176 @@
+"""
+Admission control for story generation: a bounded request queue and per-stage concurrency limits
+"""
+import math
+import time
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Iterable, Optional
+
+from fastapi.responses import JSONResponse
+
+from .config import settings
+from .metrics import ADMISSION_REJECTED
+
+# Generation stages with their own concurrency limit
+LIMIT_PREPROCESS = "preprocess"
+LIMIT_INFERENCE = "inference"
+LIMIT_TTS = "tts"
+
+# Weight of the latest hold time in the running average used for Retry-After
+AVERAGE_WEIGHT = 0.2
+
+class AdmissionRejected(Exception):
+    """The wait queue is full; retry_after is the estimated wait in seconds"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Queue full, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+class ConcurrencyLimit:
+    """At most limit holders at a time (0 for no limit), with FIFO waiters
+
+    With max_waiting set, acquiring while that many are already waiting
+    raises AdmissionRejected instead of queueing.
+    """
+
+    def __init__(self, limit: int, max_waiting: Optional[int] = None):
+        self.limit = max(0, limit)
+        self.max_waiting = max_waiting
+        self.active = 0
+        self.waiting = 0
+        self.completed = 0
+        self.rejected = 0
+        self.average_seconds: Optional[float] = None
+        self._semaphore = asyncio.Semaphore(self.limit) if self.limit else None
+
+    @property
+    def full(self) -> bool:
+        """Whether a new acquire would be rejected"""
+        return (
+            self.max_waiting is not None
+            and self._semaphore is not None
+            and self._semaphore.locked()
+            and self.waiting >= self.max_waiting
+        )
+
+    def retry_after(self) -> int:
+        """Seconds until the queue has likely drained enough to take one more"""
+        average = self.average_seconds if self.average_seconds is not None else 1.0
+        estimate = math.ceil(average * (self.waiting + 1) / max(1, self.limit))
+        return max(1, min(estimate, settings.ADMISSION_RETRY_AFTER_MAX))
+
+    @asynccontextmanager
+    async def acquire(self) -> AsyncIterator[None]:
+        """Hold a slot for the duration of the block"""
+        if self.full:
+            self.rejected += 1
+            raise AdmissionRejected(self.retry_after())
+
+        self.waiting += 1
+        try:
+            if self._semaphore is not None:
+                await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+
+        self.active += 1
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.active -= 1
+            if self._semaphore is not None:
+                self._semaphore.release()
+            self._observe(time.perf_counter() - started)
+
+    def _observe(self, seconds: float):
+        self.completed += 1
+        if self.average_seconds is None:
+            self.average_seconds = seconds
+        else:
+            self.average_seconds += AVERAGE_WEIGHT * (seconds - self.average_seconds)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "limit": self.limit,
+            "active": self.active,
+            "waiting": self.waiting,
+            "max_waiting": self.max_waiting,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "average_seconds": round(self.average_seconds, 3) if self.average_seconds is not None else None,
+        }
+
+class AdmissionController:
+    """Admits generation requests into a bounded queue and limits each stage's concurrency"""
+
+    def __init__(
+        self,
+        max_active: Optional[int] = None,
+        max_queue: Optional[int] = None,
+        stage_limits: Optional[Dict[str, int]] = None
+    ):
+        self.requests = ConcurrencyLimit(
+            max_active if max_active is not None else settings.ADMISSION_MAX_ACTIVE,
+            max(0, max_queue if max_queue is not None else settings.ADMISSION_MAX_QUEUE)
+        )
+        if stage_limits is None:
+            stage_limits = {
+                LIMIT_PREPROCESS: settings.STAGE_LIMIT_PREPROCESS,
+                LIMIT_INFERENCE: settings.STAGE_LIMIT_INFERENCE,
+                LIMIT_TTS: settings.STAGE_LIMIT_TTS,
+            }
+        self.stages = {name: ConcurrencyLimit(limit) for name, limit in stage_limits.items()}
+
+    def admit(self):
+        """Hold a request slot, waiting in the queue or raising AdmissionRejected when it's full"""
+        return self.requests.acquire()
+
+    def stage(self, name: str):
+        """Hold a slot of one stage, waiting as long as it takes"""
+        return self.stages[name].acquire()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests.stats(),
+            "stages": {name: limit.stats() for name, limit in self.stages.items()},
+        }
+
+class AdmissionMiddleware:
+    """ASGI middleware queueing generation requests before their bodies are read
+
+    Requests to the given POST paths wait for a slot of the controller, so
+    a spike can't buffer every upload at once; when the wait queue is full
+    they get 429 with a Retry-After estimate straight away. Other requests
+    pass through untouched.
+    """
+
+    def __init__(self, app, controller: Optional[AdmissionController] = None, paths: Iterable[str] = ()):
+        self.app = app
+        self.controller = controller
+        self.paths = set(paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        controller = self.controller or admission
+        if controller.requests.full:
+            controller.requests.rejected += 1
+            ADMISSION_REJECTED.inc()
+            retry_after = controller.requests.retry_after()
+            response = JSONResponse(
+                status_code=429,
+                content={"detail": "Too many story generation requests, try again later"},
+                headers={"Retry-After": str(retry_after)}
+            )
+            await response(scope, receive, send)
+            return
+
+        async with controller.admit():
+            await self.app(scope, receive, send)
+
+# Shared controller instance
+admission = AdmissionController()
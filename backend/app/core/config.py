@@ -14,6 +14,24 @@ class Settings(BaseSettings):
     
     # Hugging Face API
     HUGGINGFACE_API_KEY: str = ""
+    INFERENCE_API_URL: str = ""  # overrides the hosted model URL, e.g. for a local stand-in
+    INFERENCE_TIMEOUT: float = 30.0
+    INFERENCE_MAX_CONNECTIONS: int = 16
+    INFERENCE_MAX_IN_FLIGHT: int = 8
+    INFERENCE_MAX_RETRIES: int = 3
+    INFERENCE_BACKOFF_BASE: float = 1.0
+    INFERENCE_BACKOFF_MAX: float = 20.0
+    INFERENCE_TIMEOUT_MIN: float = 2.0  # floor of the adaptive per-call timeout
+    INFERENCE_TIMEOUT_PERCENTILE: float = 99  # latency percentile the adaptive timeout is based on
+    INFERENCE_TIMEOUT_MULTIPLIER: float = 2.0
+    BREAKER_ENABLED: bool = True  # circuit breaker in front of the remote generator
+    BREAKER_WINDOW: int = 20  # recent calls the failure and slow-call rates cover
+    BREAKER_MIN_CALLS: int = 5
+    BREAKER_FAILURE_RATE: float = 0.5
+    BREAKER_SLOW_CALL_SECONDS: float = 15.0
+    BREAKER_SLOW_CALL_RATE: float = 0.8
+    BREAKER_OPEN_SECONDS: float = 30.0  # time fallbacks are served before probing again
+    BREAKER_HALF_OPEN_CALLS: int = 1
     
     # Database Configuration
     DB_HOST: str = ""
@@ -22,14 +40,47 @@ class Settings(BaseSettings):
     DB_PASSWORD: str = ""
     DB_DATABASE: str = ""
     DATABASE_URL: str = ""
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 20
+    DB_POOL_TIMEOUT: float = 30.0
+    DB_CREATE_SCHEMA: bool = True  # create missing tables at startup; serve.py does it once in the master
+    EXPORT_CHUNK_ROWS: int = 500  # rows fetched and written per chunk by /api/stories/export
     
     # Audio Settings
     AUDIO_OUTPUT_DIR: str = "./audio_files"
     MAX_AUDIO_DURATION: int = 300
+    AUDIO_FORMAT: str = "opus"  # storage format for new narrations: "opus", "mp3" or "wav"
+    AUDIO_BITRATE: str = "32k"
+    FFMPEG_PATH: str = "ffmpeg"
+    
+    # Media Storage Settings (images and audio live under AUDIO_OUTPUT_DIR)
+    STORAGE_BACKEND: str = "local"  # "local" or "s3"; s3 keeps AUDIO_OUTPUT_DIR as a local cache
+    STORAGE_SHARD_DEPTH: int = 2  # levels of hash-named subdirectories
+    MEDIA_ACCEL_REDIRECT: str = ""  # nginx internal location mapped to AUDIO_OUTPUT_DIR, e.g. "/_media"
+    MEDIA_CACHE_MAX_AGE: int = 31536000  # seconds clients keep media URLs, which never change
+    S3_BUCKET: str = ""
+    S3_PREFIX: str = ""
+    S3_ENDPOINT_URL: str = ""  # for MinIO and other S3-compatible services
+    S3_REGION: str = ""
     
     # File Upload Settings
     MAX_FILE_SIZE: int = 10485760  # 10MB
+    UPLOAD_CHUNK_SIZE: int = 1048576  # 1MB
+    IMAGE_WORKERS: int = 2  # image preprocessing processes, 0 uses a thread instead
+    BATCH_MAX_FILES: int = 50  # images accepted by one /api/upload/batch request
+    BATCH_CONCURRENCY: int = 4  # batch items generated at the same time
     ALLOWED_EXTENSIONS: str = "jpg,jpeg,png,webp"
+    IMAGE_DERIVATIVE_WIDTHS: str = "256,512,1024"  # resized copies served by /api/images?w=
+    IMAGE_DERIVATIVES_ON_UPLOAD: bool = True  # render WebP copies once the upload is prepared
+    
+    # Production Server Settings (serve.py)
+    SERVER_HOST: str = "0.0.0.0"
+    SERVER_PORT: int = 8000
+    SERVER_WORKERS: int = 2  # worker processes forked from the master after models are loaded
+    SERVER_MAX_REQUESTS: int = 0  # requests before a worker is gracefully replaced, 0 never
+    SERVER_MAX_REQUESTS_JITTER: int = 0  # random extra requests, so workers don't recycle together
+    SERVER_GRACEFUL_TIMEOUT: float = 30.0  # seconds a stopping worker gets to finish its requests
+    SERVER_PRELOAD: bool = True  # load models in the master so workers share them copy-on-write
     
     # Development Settings
     DEBUG: bool = True
@@ -37,7 +88,41 @@ class Settings(BaseSettings):
     
     # Model Settings
     KOSMOS_MODEL_ID: str = "microsoft/kosmos-2-patch14-224"
+    GENERATOR_BACKEND: str = "remote"  # "remote" (inference API) or "local" (transformers in-process)
+    GENERATOR_BATCH_SIZE: int = 4  # local backend: requests generated together
+    GENERATOR_BATCH_WINDOW_MS: int = 50  # local backend: wait for more requests before a batch
+    GENERATOR_QUANTIZE: bool = False  # local backend: int8 dynamic quantization of Linear layers
+    GENERATOR_TORCH_THREADS: int = 0  # local backend: torch intra-op threads, 0 keeps the default
     TTS_MODEL_NAME: str = "tts_models/multilingual/multi-dataset/xtts_v2"
+    TTS_MODEL_FACTORY: str = ""  # "module:function" returning a TTS-compatible model; empty uses Coqui
+    TTS_WORKERS: int = 1  # worker processes, each with its own model; 0 loads it in-process
+    TTS_BATCH_MAX_CHARS: int = 400
+    TTS_BATCH_WINDOW_MS: int = 20
+    TTS_TASK_TIMEOUT: int = 300  # seconds before a busy worker is considered stuck
+    TTS_HEALTH_INTERVAL: float = 2.0
+    TTS_PRERENDER_FALLBACKS: bool = True  # narrate the fallback stories at startup
+    
+    # Admission Control (generation requests beyond ADMISSION_MAX_ACTIVE wait, up to
+    # ADMISSION_MAX_QUEUE of them, then get 429; stage limits of 0 mean unlimited)
+    ADMISSION_MAX_ACTIVE: int = 8
+    ADMISSION_MAX_QUEUE: int = 32
+    ADMISSION_RETRY_AFTER_MAX: int = 120  # seconds, cap on the computed Retry-After
+    STAGE_LIMIT_PREPROCESS: int = 4
+    STAGE_LIMIT_INFERENCE: int = 4
+    STAGE_LIMIT_TTS: int = 2
+    
+    # Job Queue Settings
+    JOB_WORKERS: int = 2
+    JOB_LEASE: float = 60.0  # seconds an unfinished job stays with a process that stopped renewing it
+    PROGRESS_RETENTION: int = 300  # seconds a finished job's events stay available
+    SSE_KEEPALIVE: float = 15.0  # seconds between keep-alive comments on idle event streams
+    SSE_JOB_POLL: float = 2.0  # seconds between database checks for jobs run by another process
+    
+    # Result Cache Settings
+    RESULT_CACHE_BACKEND: str = "memory"  # "memory", "sqlite" or "none"
+    RESULT_CACHE_DIR: str = "./result_cache"
+    RESULT_CACHE_MAX_ENTRIES: int = 1000
+    RESULT_CACHE_TTL: int = 604800  # seconds, 0 disables expiry
     
     class Config:
         env_file = ".env"
@@ -57,6 +142,11 @@ class Settings(BaseSettings):
             return [ext.strip() for ext in self.ALLOWED_EXTENSIONS.split(",")]
         return self.ALLOWED_EXTENSIONS if isinstance(self.ALLOWED_EXTENSIONS, list) else []
 
+    @property
+    def image_derivative_widths_list(self) -> List[int]:
+        """Parse IMAGE_DERIVATIVE_WIDTHS string into a sorted list"""
+        return sorted(int(width) for width in self.IMAGE_DERIVATIVE_WIDTHS.split(",") if width.strip())
+
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         
@@ -1,34 +1,152 @@
 """
 Database configuration and setup
 """
-from sqlalchemy import create_engine
+import time
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, StaticPool
 
 from .config import settings
+from .metrics import STAGE_SECONDS
+from .search import ensure_search_index, setup_search
+
+# Async drivers for each sync dialect
+ASYNC_DRIVERS = {
+    "sqlite": "aiosqlite",
+    "postgresql": "asyncpg",
+    "mysql": "aiomysql",
+}
+
+def async_database_url(url: str) -> str:
+    """Rewrite a database URL to use the dialect's async driver
+
+    A URL naming its own driver for a dialect not listed above, e.g.
+    oracle+oracledb_async://, is used as it is.
+    """
+    parsed = make_url(url)
+    backend = parsed.get_backend_name()
+    driver = ASYNC_DRIVERS.get(backend)
+    if driver is None:
+        if parsed.drivername != backend:
+            return url
+        raise ValueError(
+            f"DATABASE_URL uses {backend}, which has no known async driver; "
+            f"name one in the URL, as in {backend}+<async driver>://..."
+        )
+    return parsed.set(drivername=f"{backend}+{driver}").render_as_string(hide_password=False)
+
+def _is_sqlite(url: str) -> bool:
+    return make_url(url).get_backend_name() == "sqlite"
+
+def is_memory_database(url: str) -> bool:
+    """Whether the URL is an in-memory SQLite database, which exists only per connection"""
+    parsed = make_url(url)
+    return _is_sqlite(url) and (
+        parsed.database in (None, "", ":memory:") or parsed.query.get("mode") == "memory"
+    )
+
+def _pool_options(url: str) -> dict:
+    """Connection pool settings shared by the sync and async engines
+
+    The sizing only applies to a QueuePool. In-memory SQLite keeps a single
+    connection, since every new one would open a new, empty database, and
+    that connection is never recycled for the same reason.
+    """
+    if is_memory_database(url):
+        return {}
+    return {
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_timeout": settings.DB_POOL_TIMEOUT,
+        "pool_pre_ping": True,
+        "pool_recycle": 300,
+    }
+
+def _enable_sqlite_wal(dbapi_connection, connection_record):
+    """Let readers proceed while a writer commits, and wait out short write locks"""
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA busy_timeout=5000")
+    cursor.close()
+
+def configure_sqlite(engine):
+    """Apply the SQLite connection pragmas to every new connection of an engine"""
+    sync_engine = getattr(engine, "sync_engine", engine)
+    if sync_engine.dialect.name == "sqlite":
+        event.listen(sync_engine, "connect", _enable_sqlite_wal)
 
-# Create SQLAlchemy engine
+# Create SQLAlchemy engine (used for schema setup and scripts)
 engine = create_engine(
     settings.DATABASE_URL,
-    connect_args={"check_same_thread": False} if "sqlite" in settings.DATABASE_URL else {},
-    pool_pre_ping=True,
-    pool_recycle=300
+    connect_args={"check_same_thread": False} if _is_sqlite(settings.DATABASE_URL) else {},
+    **_pool_options(settings.DATABASE_URL)
 )
+configure_sqlite(engine)
+
+# Async engine used by the API and background workers
+async_engine = create_async_engine(
+    async_database_url(settings.DATABASE_URL),
+    poolclass=StaticPool if is_memory_database(settings.DATABASE_URL) else AsyncAdaptedQueuePool,
+    **_pool_options(settings.DATABASE_URL)
+)
+configure_sqlite(async_engine)
+
+@event.listens_for(Session, "before_commit")
+def _commit_started(session):
+    session.info["commit_started"] = time.perf_counter()
+
+@event.listens_for(Session, "after_commit")
+def _commit_finished(session):
+    # Covers the flush and the COMMIT, for sync and async sessions alike
+    started = session.info.pop("commit_started", None)
+    if started is not None:
+        STAGE_SECONDS.labels("db_commit").observe(time.perf_counter() - started)
+
+@event.listens_for(Session, "after_rollback")
+def _commit_abandoned(session):
+    session.info.pop("commit_started", None)
 
 # Create SessionLocal class
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Objects stay usable after commit, since lazy refreshes aren't possible under asyncio
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
 # Create Base class
 Base = declarative_base()
 
-def get_db():
+async def get_db():
     """Dependency to get database session"""
-    db = SessionLocal()
-    try:
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
+
+def get_session_factory():
+    """Dependency for work that needs several concurrent sessions"""
+    return AsyncSessionLocal
+
+def _create_schema(connection):
+    Base.metadata.create_all(bind=connection)
+
+    # create_all skips tables that already exist, so add indexes introduced later
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=connection, checkfirst=True)
 
 def create_tables():
     """Create all database tables"""
-    Base.metadata.create_all(bind=engine) 
\ No newline at end of file
+    with engine.begin() as connection:
+        _create_schema(connection)
+    ensure_search_index(engine)
+
+async def create_async_tables():
+    """Create the tables seen by the async engine when it has its own in-memory database"""
+    if is_memory_database(settings.DATABASE_URL):
+        async with async_engine.begin() as connection:
+            await connection.run_sync(_create_schema)
+        async with async_engine.begin() as connection:
+            await connection.run_sync(setup_search)
@@ -0,0 +1,144 @@
+"""
+Prometheus metrics: counters, gauges and histograms served at /metrics
+
+With PROMETHEUS_MULTIPROC_DIR set (serve.py sets one up for its workers),
+prometheus_client keeps each process's values in files there and /metrics
+adds up those of every worker, whichever worker answers the scrape.
+"""
+import os
+import math
+import asyncio
+from typing import Callable, List, Tuple
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+)
+
+CONTENT_TYPE = CONTENT_TYPE_LATEST
+
+# Seconds; covers fast file and DB work up to slow inference and synthesis
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+# Read once, like prometheus_client itself does when it is imported
+MULTIPROCESS = bool(os.environ.get("PROMETHEUS_MULTIPROC_DIR"))
+
+# How often a worker writes its callback gauges to the shared files in multiprocess mode
+GAUGE_REFRESH_SECONDS = 1.0
+
+# Metrics of this process, and the ones served when not in multiprocess mode
+REGISTRY = CollectorRegistry()
+
+# (gauge, function) pairs sampled on a timer in multiprocess mode
+_gauge_functions: List[Tuple[Gauge, Callable[[], float]]] = []
+
+def _read(function: Callable[[], float]) -> float:
+    try:
+        return float(function())
+    except Exception:
+        return math.nan
+
+def set_gauge_function(gauge: Gauge, function: Callable[[], float]):
+    """Read a gauge's value from function when metrics are collected
+
+    A scrape can't call into other workers, so in multiprocess mode each
+    worker samples its functions every GAUGE_REFRESH_SECONDS instead.
+    """
+    if MULTIPROCESS:
+        _gauge_functions.append((gauge, function))
+    else:
+        gauge.set_function(lambda: _read(function))
+
+def sample_gauge_functions():
+    for gauge, function in _gauge_functions:
+        gauge.set(_read(function))
+
+async def refresh_gauges():
+    """Keep this worker's callback gauges current in multiprocess mode, until cancelled"""
+    while _gauge_functions:
+        sample_gauge_functions()
+        await asyncio.sleep(GAUGE_REFRESH_SECONDS)
+
+def render() -> bytes:
+    """Every metric in Prometheus text exposition format"""
+    if not MULTIPROCESS:
+        return generate_latest(REGISTRY)
+    sample_gauge_functions()
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry)
+
+def mark_worker_dead(pid: int):
+    """Drop the live gauges of a worker process that has exited"""
+    if MULTIPROCESS:
+        multiprocess.mark_process_dead(pid)
+
+# Application metrics
+STAGE_SECONDS = Histogram(
+    "storylens_stage_duration_seconds",
+    "Time spent in each step of story generation",
+    ["stage"],
+    buckets=DEFAULT_BUCKETS,
+    registry=REGISTRY
+)
+FALLBACK_STORIES = Counter(
+    "storylens_fallback_stories",
+    "Canned fallback stories returned instead of a generated one",
+    ["reason"],
+    registry=REGISTRY
+)
+INFERENCE_RESPONSES = Counter(
+    "storylens_inference_responses",
+    "Responses from the Hugging Face inference API by status code, including retried 503s",
+    ["status"],
+    registry=REGISTRY
+)
+TTS_FAILURES = Counter(
+    "storylens_tts_failures",
+    "Failed narrations and TTS worker crashes",
+    ["reason"],
+    registry=REGISTRY
+)
+NARRATION_CACHE = Counter(
+    "storylens_narration_cache",
+    "Narration lookups by text, model and voice, by result",
+    ["result"],
+    registry=REGISTRY
+)
+ADMISSION_REJECTED = Counter(
+    "storylens_admission_rejected",
+    "Generation requests turned away with 429 because the wait queue was full",
+    registry=REGISTRY
+)
+INFERENCE_BREAKER_STATE = Gauge(
+    "storylens_inference_breaker_state",
+    "1 for the inference circuit breaker's current state, 0 for the others (summed over workers)",
+    ["state"],
+    multiprocess_mode="livesum",
+    registry=REGISTRY
+)
+HTTP_IN_FLIGHT = Gauge(
+    "storylens_http_requests_in_flight",
+    "HTTP requests currently being handled",
+    multiprocess_mode="livesum",
+    registry=REGISTRY
+)
+QUEUE_DEPTH = Gauge(
+    "storylens_queue_depth",
+    "Work waiting for or running in each executor",
+    ["executor"],
+    multiprocess_mode="livesum",
+    registry=REGISTRY
+)
+
+class InFlightMiddleware:
+    """ASGI middleware counting HTTP requests in flight, streaming bodies included"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        with HTTP_IN_FLIGHT.track_inprogress():
+            await self.app(scope, receive, send)
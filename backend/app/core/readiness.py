@@ -0,0 +1,68 @@
+"""
+Readiness tracking for components that load in the background
+"""
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+# Component states
+PENDING = "pending"
+LOADING = "loading"
+READY = "ready"
+DISABLED = "disabled"
+FAILED = "failed"
+
+class ReadinessRegistry:
+    """Records the load state and timing of each warm-up component"""
+
+    def __init__(self):
+        self._components: Dict[str, Dict[str, Any]] = {}
+
+    def register(self, name: str, required: bool = True):
+        """Declare a component that must finish loading before the app is ready"""
+        self._components.setdefault(name, {
+            "state": PENDING,
+            "required": required,
+            "load_seconds": None,
+            "detail": None,
+        })
+
+    def set_state(self, name: str, state: str, detail: Optional[str] = None):
+        """Update a component's state"""
+        self.register(name)
+        self._components[name]["state"] = state
+        self._components[name]["detail"] = detail
+
+    @contextmanager
+    def track(self, name: str):
+        """Mark a component as loading for the duration of the block and time it"""
+        self.set_state(name, LOADING)
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            self.set_state(name, FAILED, str(e))
+            raise
+        finally:
+            self._components[name]["load_seconds"] = round(time.perf_counter() - start, 3)
+        if self._components[name]["state"] == LOADING:
+            self.set_state(name, READY)
+
+    @property
+    def is_ready(self) -> bool:
+        """Whether every required component is ready (or intentionally disabled)"""
+        return all(
+            component["state"] in (READY, DISABLED)
+            for component in self._components.values()
+            if component["required"]
+        )
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Return the state of every component"""
+        return {
+            "ready": self.is_ready,
+            "components": {name: dict(component) for name, component in self._components.items()},
+        }
+
+# Shared registry instance
+readiness = ReadinessRegistry()
@@ -0,0 +1,146 @@
+"""
+Database-native full-text search over story text
+
+SQLite uses an FTS5 table kept in sync by triggers; PostgreSQL uses a GIN
+index on to_tsvector('english', story_text), which it maintains itself.
+"""
+import re
+from typing import List, Tuple
+
+from sqlalchemy import event, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+# Text search configuration for PostgreSQL
+PG_TS_CONFIG = "english"
+
+SQLITE_SETUP = [
+    # Maps story ids to stable FTS rowids (the stories rowid can change on VACUUM)
+    "CREATE TABLE IF NOT EXISTS stories_fts_map ("
+    "rowid INTEGER PRIMARY KEY, story_id TEXT NOT NULL UNIQUE)",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS stories_fts USING fts5("
+    "story_text, tokenize = 'porter unicode61')",
+    "CREATE TRIGGER IF NOT EXISTS stories_fts_insert AFTER INSERT ON stories BEGIN "
+    "INSERT INTO stories_fts_map (story_id) VALUES (new.id); "
+    "INSERT INTO stories_fts (rowid, story_text) VALUES "
+    "((SELECT rowid FROM stories_fts_map WHERE story_id = new.id), new.story_text); "
+    "END",
+    "CREATE TRIGGER IF NOT EXISTS stories_fts_delete AFTER DELETE ON stories BEGIN "
+    "DELETE FROM stories_fts WHERE rowid = "
+    "(SELECT rowid FROM stories_fts_map WHERE story_id = old.id); "
+    "DELETE FROM stories_fts_map WHERE story_id = old.id; "
+    "END",
+    "CREATE TRIGGER IF NOT EXISTS stories_fts_update AFTER UPDATE OF story_text ON stories BEGIN "
+    "UPDATE stories_fts SET story_text = new.story_text WHERE rowid = "
+    "(SELECT rowid FROM stories_fts_map WHERE story_id = new.id); "
+    "END",
+]
+
+SQLITE_BACKFILL = [
+    "INSERT INTO stories_fts_map (story_id) SELECT id FROM stories "
+    "WHERE id NOT IN (SELECT story_id FROM stories_fts_map)",
+    "INSERT INTO stories_fts (rowid, story_text) SELECT m.rowid, s.story_text "
+    "FROM stories s JOIN stories_fts_map m ON m.story_id = s.id "
+    "WHERE m.rowid NOT IN (SELECT rowid FROM stories_fts)",
+]
+
+SQLITE_TEARDOWN = [
+    "DROP TRIGGER IF EXISTS stories_fts_insert",
+    "DROP TRIGGER IF EXISTS stories_fts_delete",
+    "DROP TRIGGER IF EXISTS stories_fts_update",
+    "DROP TABLE IF EXISTS stories_fts",
+    "DROP TABLE IF EXISTS stories_fts_map",
+]
+
+POSTGRES_SETUP = [
+    f"CREATE INDEX IF NOT EXISTS ix_stories_story_text_fts ON stories "
+    f"USING GIN (to_tsvector('{PG_TS_CONFIG}', story_text))",
+]
+
+class SearchUnsupported(ValueError):
+    """Raised when full-text search is used on a database dialect without it"""
+
+    def __init__(self, dialect_name: str):
+        super().__init__(f"Full-text search is not supported on {dialect_name}")
+        self.dialect_name = dialect_name
+
+def search_supported(dialect_name: str) -> bool:
+    """Whether full-text search is available for a database dialect"""
+    return dialect_name in ("sqlite", "postgresql")
+
+def setup_search(connection: Connection):
+    """Create the full-text index for the stories table (idempotent)"""
+    dialect = connection.dialect.name
+    try:
+        if dialect == "sqlite":
+            for statement in SQLITE_SETUP:
+                connection.execute(text(statement))
+            stories = connection.execute(text("SELECT COUNT(*) FROM stories")).scalar()
+            indexed = connection.execute(text("SELECT COUNT(*) FROM stories_fts_map")).scalar()
+            if stories != indexed:
+                for statement in SQLITE_BACKFILL:
+                    connection.execute(text(statement))
+        elif dialect == "postgresql":
+            for statement in POSTGRES_SETUP:
+                connection.execute(text(statement))
+    except OperationalError as e:
+        # e.g. SQLite built without FTS5
+        print(f"Warning: Could not create full-text search index: {e}")
+
+def teardown_search(connection: Connection):
+    """Drop the SQLite full-text tables and triggers"""
+    if connection.dialect.name == "sqlite":
+        for statement in SQLITE_TEARDOWN:
+            connection.execute(text(statement))
+
+def attach_search_index(table):
+    """Create and drop the full-text index together with the stories table"""
+    event.listen(table, "after_create", lambda target, connection, **kw: setup_search(connection))
+    event.listen(table, "before_drop", lambda target, connection, **kw: teardown_search(connection))
+
+def ensure_search_index(engine: Engine):
+    """Create the full-text index for a stories table that already exists"""
+    with engine.begin() as connection:
+        setup_search(connection)
+
+def _sqlite_match_query(query: str) -> str:
+    """Turn free text into an FTS5 query matching all terms, ignoring FTS syntax"""
+    terms = re.findall(r"\w+", query, flags=re.UNICODE)
+    return " ".join(f'"{term}"' for term in terms)
+
+def search_story_ids(db: Session, query: str, limit: int, offset: int) -> List[Tuple[str, float]]:
+    """Return (story_id, score) pairs for a query, best match first
+
+    Raises SearchUnsupported on dialects other than SQLite and PostgreSQL.
+    """
+    dialect = db.get_bind().dialect.name
+    if not search_supported(dialect):
+        raise SearchUnsupported(dialect)
+
+    if dialect == "sqlite":
+        match = _sqlite_match_query(query)
+        if not match:
+            return []
+        rows = db.execute(
+            text(
+                "SELECT m.story_id, bm25(stories_fts) AS rank FROM stories_fts "
+                "JOIN stories_fts_map m ON m.rowid = stories_fts.rowid "
+                "WHERE stories_fts MATCH :match ORDER BY rank LIMIT :limit OFFSET :offset"
+            ),
+            {"match": match, "limit": limit, "offset": offset}
+        ).all()
+        # bm25() is lower-is-better; flip it so higher scores rank first
+        return [(row[0], -row[1]) for row in rows]
+
+    if dialect == "postgresql":
+        rows = db.execute(
+            text(
+                f"SELECT id, ts_rank(to_tsvector('{PG_TS_CONFIG}', story_text), query) AS rank "
+                f"FROM stories, websearch_to_tsquery('{PG_TS_CONFIG}', :query) query "
+                f"WHERE to_tsvector('{PG_TS_CONFIG}', story_text) @@ query "
+                f"ORDER BY rank DESC, id LIMIT :limit OFFSET :offset"
+            ),
+            {"query": query, "limit": limit, "offset": offset}
+        ).all()
+        return [(row[0], float(row[1])) for row in rows]
@@ -0,0 +1,297 @@
+"""
+Media storage: hash-sharded local files, optionally backed by an S3-compatible bucket
+"""
+import os
+import uuid
+import shutil
+import hashlib
+import asyncio
+import importlib.util
+from email.utils import formatdate
+from typing import Any, Optional, Tuple
+from urllib.parse import quote
+
+import anyio
+from fastapi.responses import FileResponse, Response
+from starlette.datastructures import Headers
+
+from .config import settings
+
+# Checked without importing: boto3 is only needed for STORAGE_BACKEND=s3
+BOTO3_AVAILABLE = importlib.util.find_spec("boto3") is not None
+
+class MediaFileResponse(FileResponse):
+    """FileResponse with strong ETags, conditional GETs, single byte ranges and sendfile
+
+    Stored files are never rewritten in place (saves are atomic renames), so
+    size and mtime identify the bytes exactly and the ETag can be strong.
+    """
+
+    def set_stat_headers(self, stat_result: os.stat_result):
+        self.headers.setdefault("content-length", str(stat_result.st_size))
+        self.headers.setdefault("last-modified", formatdate(stat_result.st_mtime, usegmt=True))
+        self.headers.setdefault("etag", f'"{stat_result.st_size:x}-{stat_result.st_mtime_ns:x}"')
+        self.headers.setdefault("accept-ranges", "bytes")
+
+    async def __call__(self, scope, receive, send):
+        request_headers = Headers(scope=scope)
+        with open(self.path, "rb") as file:
+            stat_result = os.fstat(file.fileno())
+            self.set_stat_headers(stat_result)
+            size = stat_result.st_size
+            etag = self.headers["etag"]
+            status = self.status_code
+            start, end = 0, size
+
+            if etag_matches(request_headers.get("if-none-match"), etag):
+                status = 304
+                start = end = 0
+                del self.headers["content-length"]
+                del self.headers["content-type"]
+            elif request_headers.get("if-range", etag) == etag:
+                try:
+                    byte_range = parse_range(request_headers.get("range"), size)
+                except RangeNotSatisfiable:
+                    status = 416
+                    self.headers["content-range"] = f"bytes */{size}"
+                    self.headers["content-length"] = "0"
+                    start = end = 0
+                else:
+                    if byte_range is not None:
+                        status = 206
+                        start, end = byte_range
+                        self.headers["content-range"] = f"bytes {start}-{end - 1}/{size}"
+                        self.headers["content-length"] = str(end - start)
+
+            await send({"type": "http.response.start", "status": status, "headers": self.raw_headers})
+            if self.send_header_only or start == end:
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+            elif "http.response.zerocopysend" in scope.get("extensions", {}):
+                # ASGI zero-copy send extension: the server sendfile()s the range
+                await send({"type": "http.response.zerocopysend", "file": file, "offset": start, "count": end - start})
+            else:
+                file.seek(start)
+                remaining = end - start
+                while remaining:
+                    chunk = await anyio.to_thread.run_sync(file.read, min(self.chunk_size, remaining))
+                    remaining = remaining - len(chunk) if chunk else 0
+                    await send({"type": "http.response.body", "body": chunk, "more_body": bool(remaining)})
+        if self.background is not None:
+            await self.background()
+
+class RangeNotSatisfiable(Exception):
+    """A Range header that selects no bytes of the file"""
+
+def etag_matches(header: Optional[str], etag: str) -> bool:
+    """Whether an If-None-Match header matches an ETag (weak comparison)"""
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in header.split(","))
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """[start, end) of a single "bytes=" range, or None to send the whole file
+
+    Malformed and multi-range headers are ignored, as RFC 9110 allows.
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    first, _, last = header[len("bytes="):].strip().partition("-")
+    try:
+        if first:
+            start = int(first)
+            end = min(int(last) + 1, size) if last else size
+        else:
+            start, end = max(size - int(last), 0), size
+    except ValueError:
+        return None
+    if start < 0 or start >= end:
+        raise RangeNotSatisfiable(header)
+    return start, end
+
+class LocalStorage:
+    """Files under a root directory, spread over hash-named subdirectories
+
+    A name such as "derived/images/x_w256.webp" keeps its directory part and
+    the file lands in <root>/derived/images/ab/cd/x_w256.webp, so no directory
+    grows past a few hundred entries. Files from the older flat layout are
+    still found at <root>/<name>.
+    """
+
+    name = "local"
+
+    def __init__(self, root: Optional[str] = None, shard_depth: Optional[int] = None):
+        self._root = root
+        self.shard_depth = shard_depth if shard_depth is not None else settings.STORAGE_SHARD_DEPTH
+
+    @property
+    def root(self) -> str:
+        return self._root or settings.AUDIO_OUTPUT_DIR
+
+    def _key(self, name: str) -> str:
+        """Relative sharded location of a name"""
+        directory, filename = os.path.split(name)
+        if not filename or name.startswith("/") or ".." in name.split("/"):
+            raise ValueError(f"Invalid storage name: {name}")
+        digest = hashlib.md5(filename.encode()).hexdigest()
+        shards = [digest[2 * level:2 * level + 2] for level in range(self.shard_depth)]
+        return os.path.join(directory, *shards, filename)
+
+    def path(self, name: str) -> str:
+        """Local path where a name is stored"""
+        return os.path.join(self.root, self._key(name))
+
+    def temp_path(self, name: str) -> str:
+        """Unique scratch path on the same filesystem, ending in the name's extension"""
+        path = self.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return os.path.join(os.path.dirname(path), f".{uuid.uuid4().hex}.{os.path.basename(path)}")
+
+    def _local(self, name: str) -> Optional[str]:
+        try:
+            path = self.path(name)
+        except ValueError:
+            return None
+        if os.path.isfile(path):
+            return path
+        legacy = os.path.join(self.root, name)
+        if self._key(name) != name and os.path.isfile(legacy):
+            return legacy
+        return None
+
+    async def fetch(self, name: str) -> Optional[str]:
+        """Local path of a stored file, or None if it doesn't exist"""
+        return self._local(name)
+
+    async def save(self, source_path: str, name: str) -> str:
+        """Move a finished file into place atomically and return its path
+
+        The source must be on the same filesystem, e.g. from temp_path().
+        """
+        path = self.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(source_path, path)
+        await self.commit(name)
+        return path
+
+    async def link(self, source_path: str, name: str) -> str:
+        """Store a copy of an existing file, hardlinked where possible"""
+        partial_path = self.temp_path(name)
+        try:
+            try:
+                os.link(source_path, partial_path)
+            except OSError:
+                shutil.copyfile(source_path, partial_path)
+            return await self.save(partial_path, name)
+        finally:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+
+    async def commit(self, name: str):
+        """Publish a file written directly (and atomically) to path(name)"""
+
+    async def delete(self, name: str) -> bool:
+        """Remove a stored file; returns whether it existed"""
+        path = self._local(name)
+        if path is None:
+            return False
+        os.remove(path)
+        return True
+
+    def response(self, path: str, immutable: bool = False, **kwargs) -> Response:
+        """Serve a stored file with sendfile, by the proxy or the server
+
+        immutable=True lets clients cache the URL for MEDIA_CACHE_MAX_AGE
+        without revalidating; otherwise they revalidate with the ETag.
+        """
+        headers = dict(kwargs.pop("headers", None) or {})
+        headers.setdefault(
+            "Cache-Control",
+            f"public, max-age={settings.MEDIA_CACHE_MAX_AGE}, immutable" if immutable else "no-cache"
+        )
+        if settings.MEDIA_ACCEL_REDIRECT:
+            # nginx serves the file from its internal location, with its own ETag and Range handling
+            relative = os.path.relpath(path, self.root).replace(os.sep, "/")
+            headers["X-Accel-Redirect"] = f"{settings.MEDIA_ACCEL_REDIRECT.rstrip('/')}/{relative}"
+            if kwargs.get("filename"):
+                headers["Content-Disposition"] = f"attachment; filename*=utf-8''{quote(kwargs['filename'])}"
+            return Response(headers=headers, media_type=kwargs.get("media_type"))
+        return MediaFileResponse(path, headers=headers, **kwargs)
+
+class S3Storage(LocalStorage):
+    """An S3-compatible bucket, with the local sharded directory as a write-through cache"""
+
+    name = "s3"
+
+    def __init__(
+        self,
+        client: Any = None,
+        bucket: Optional[str] = None,
+        prefix: Optional[str] = None,
+        root: Optional[str] = None,
+        shard_depth: Optional[int] = None
+    ):
+        super().__init__(root, shard_depth)
+        self.bucket = bucket or settings.S3_BUCKET
+        self.prefix = (prefix if prefix is not None else settings.S3_PREFIX).strip("/")
+        if client is None:
+            if not BOTO3_AVAILABLE:
+                raise RuntimeError("boto3 is required for STORAGE_BACKEND=s3")
+            import boto3
+            client = boto3.client(
+                "s3",
+                endpoint_url=settings.S3_ENDPOINT_URL or None,
+                region_name=settings.S3_REGION or None
+            )
+        self.client = client
+
+    def _object_key(self, name: str) -> str:
+        return f"{self.prefix}/{name}" if self.prefix else name
+
+    @staticmethod
+    def _is_missing(error: Exception) -> bool:
+        code = getattr(error, "response", {}).get("Error", {}).get("Code")
+        return code in ("404", "NoSuchKey", "NotFound")
+
+    async def fetch(self, name: str) -> Optional[str]:
+        path = self._local(name)
+        if path is not None:
+            return path
+
+        # Cache miss: download next to the final path and rename into place
+        try:
+            partial_path = self.temp_path(name)
+        except ValueError:
+            return None
+        try:
+            await asyncio.to_thread(self.client.download_file, self.bucket, self._object_key(name), partial_path)
+            os.replace(partial_path, self.path(name))
+        except Exception as e:
+            if self._is_missing(e):
+                return None
+            raise
+        finally:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+        return self.path(name)
+
+    async def commit(self, name: str):
+        await asyncio.to_thread(self.client.upload_file, self.path(name), self.bucket, self._object_key(name))
+
+    async def delete(self, name: str) -> bool:
+        existed = await super().delete(name)
+        await asyncio.to_thread(self.client.delete_object, Bucket=self.bucket, Key=self._object_key(name))
+        return existed
+
+def create_storage() -> LocalStorage:
+    """Build the media storage configured in settings"""
+    backend_name = settings.STORAGE_BACKEND.lower()
+    if backend_name == "local":
+        return LocalStorage()
+    if backend_name == "s3":
+        return S3Storage()
+    raise ValueError(f"Unknown STORAGE_BACKEND: {settings.STORAGE_BACKEND}")
+
+# Shared storage instance
+storage = create_storage()
@@ -2,5 +2,6 @@
 Database models package
 """
 from .story import Story
+from .job import Job
 
-__all__ = ["Story"] 
\ No newline at end of file
+__all__ = ["Story", "Job"] 
\ No newline at end of file
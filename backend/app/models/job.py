@@ -0,0 +1,50 @@
+"""
+Generation job database model
+"""
+import uuid
+from sqlalchemy import Column, String, Text, DateTime
+from sqlalchemy.sql import func
+
+from ..core.database import Base
+
+# Job lifecycle states
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_COMPLETED = "completed"
+JOB_FAILED = "failed"
+
+class Job(Base):
+    """Job model for tracking background story generation"""
+    
+    __tablename__ = "jobs"
+    
+    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    status = Column(String(20), nullable=False, default=JOB_QUEUED, index=True)
+    stage = Column(String(20), nullable=True)
+    story_id = Column(String, nullable=False)
+    story_type = Column(String(20), nullable=False, default="story")
+    image_filename = Column(String(255), nullable=False)
+    content_hash = Column(String(64), nullable=True)  # SHA-256 of the upload, for the result cache
+    error = Column(Text, nullable=True)
+    # Server process working on the job, and when it stops being trusted to finish it
+    owner = Column(String(255), nullable=True)
+    lease_expires_at = Column(DateTime(timezone=True), nullable=True, index=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+    
+    def __repr__(self):
+        return f"<Job(id={self.id}, status={self.status}, stage={self.stage})>"
+    
+    def to_dict(self):
+        """Convert model to dictionary"""
+        return {
+            "id": self.id,
+            "status": self.status,
+            "stage": self.stage,
+            "story_id": self.story_id,
+            "story_type": self.story_type,
+            "error": self.error,
+            "status_url": f"/api/jobs/{self.id}",
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+            "updated_at": self.updated_at.isoformat() if self.updated_at else None,
+        }
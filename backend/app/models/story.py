@@ -3,16 +3,28 @@ Story database model
 """
 import uuid
 from datetime import datetime
-from sqlalchemy import Column, String, Text, DateTime, Integer
+from typing import Iterable, Optional
+from sqlalchemy import Column, String, Text, DateTime, Integer, Index
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.sql import func
 
 from ..core.database import Base
+from ..core.search import attach_search_index
 
 class Story(Base):
     """Story model for storing generated stories"""
     
     __tablename__ = "stories"
+    __table_args__ = (
+        # Keyset pagination walks stories newest first by (created_at, id)
+        Index("ix_stories_created_at_id", "created_at", "id"),
+    )
+    
+    # Fields computed in to_dict and the columns they are derived from
+    DERIVED_FIELDS = {
+        "audio_url": ("audio_filename",),
+        "audio_stream_url": ("id",),
+    }
     
     id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
     story_text = Column(Text, nullable=False)
@@ -25,15 +37,42 @@ class Story(Base):
     def __repr__(self):
         return f"<Story(id={self.id}, type={self.story_type}, created_at={self.created_at})>"
     
-    def to_dict(self):
-        """Convert model to dictionary"""
-        return {
-            "id": self.id,
-            "story_text": self.story_text,
-            "story_type": self.story_type,
-            "image_filename": self.image_filename,
-            "audio_filename": self.audio_filename,
-            "audio_url": f"/api/audio/{self.audio_filename}" if self.audio_filename else None,
-            "created_at": self.created_at.isoformat() if self.created_at else None,
-            "updated_at": self.updated_at.isoformat() if self.updated_at else None,
-        } 
\ No newline at end of file
+    @classmethod
+    def field_names(cls) -> list:
+        """Names accepted by to_dict(fields=...)"""
+        return [column.name for column in cls.__table__.columns] + list(cls.DERIVED_FIELDS)
+    
+    @classmethod
+    def columns_for(cls, fields: Iterable[str]) -> list:
+        """Columns that must be loaded to render the given fields"""
+        names = {"id"}
+        for field in fields:
+            names.update(cls.DERIVED_FIELDS.get(field, (field,)))
+        return [getattr(cls, name) for name in sorted(names)]
+    
+    def to_dict(self, fields: Optional[Iterable[str]] = None):
+        """Convert model to dictionary, optionally keeping only the given fields"""
+        return self.serialize(self, fields)
+    
+    @staticmethod
+    def serialize(story, fields: Optional[Iterable[str]] = None) -> dict:
+        """Render a Story, or a result row of columns_for(fields), as a dictionary
+        
+        Only the requested attributes are read, so columns left out of a
+        load_only() query are never lazily loaded.
+        """
+        values = {
+            "id": lambda: story.id,
+            "story_text": lambda: story.story_text,
+            "story_type": lambda: story.story_type,
+            "image_filename": lambda: story.image_filename,
+            "audio_filename": lambda: story.audio_filename,
+            "audio_url": lambda: f"/api/audio/{story.audio_filename}" if story.audio_filename else None,
+            "audio_stream_url": lambda: f"/api/stories/{story.id}/audio/stream",
+            "created_at": lambda: story.created_at.isoformat() if story.created_at else None,
+            "updated_at": lambda: story.updated_at.isoformat() if story.updated_at else None,
+        }
+        return {field: values[field]() for field in (fields if fields is not None else values)}
+
+# Keep the full-text index in step with the table's lifecycle
+attach_search_index(Story.__table__)
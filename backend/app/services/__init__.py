@@ -3,5 +3,7 @@ Services package for business logic
 """
 from .story_generator import StoryGeneratorService
 from .audio_service import AudioService
+from .story_pipeline import StoryPipeline
+from .job_queue import JobQueue
 
-__all__ = ["StoryGeneratorService", "AudioService"] 
\ No newline at end of file
+__all__ = ["StoryGeneratorService", "AudioService", "StoryPipeline", "JobQueue"] 
\ No newline at end of file
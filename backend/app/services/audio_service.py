@@ -2,75 +2,288 @@
 Audio service for text-to-speech using Coqui XTTS-v2
 """
 import os
-import uuid
+import re
+import wave
+import struct
 import asyncio
-from typing import Optional
+import hashlib
+import importlib.util
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Awaitable, Callable, Iterable, List, Optional, Set
 
 from ..core.config import settings
+from ..core.admission import admission, LIMIT_TTS
+from ..core.readiness import readiness, DISABLED, FAILED
+from ..core.metrics import STAGE_SECONDS, TTS_FAILURES, NARRATION_CACHE
+from ..core.storage import storage
+from ..utils.locks import KeyedLocks
+from .tts_workers import (
+    TTSWorkerPool, TTS_SPEAKER_WAV, TTS_LANGUAGE, load_tts_model, resolve_model_factory, samples_to_pcm
+)
+from .transcoder import AudioTranscoder, AUDIO_FORMATS, transcoder
 
-try:
-    from TTS.api import TTS
-    TTS_AVAILABLE = True
-except ImportError:
-    TTS_AVAILABLE = False
-    TTS = None
+# Checked without importing: TTS pulls in torch, which takes seconds to load
+TTS_AVAILABLE = importlib.util.find_spec("TTS") is not None
+
+# Sample rate reported when the model doesn't expose one (XTTS-v2 outputs 24kHz)
+DEFAULT_SAMPLE_RATE = 24000
+
+# Storage directory of narrations keyed by text, model and voice
+NARRATION_DIR = "narrations"
+
+def _wav_header(sample_rate: int, data_size: int = 0xFFFFFFFF - 36) -> bytes:
+    """16-bit mono WAV header; the default size marks a stream of unknown length"""
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF", data_size + 36, b"WAVE",
+        b"fmt ", 16, 1, 1, sample_rate, sample_rate * 2, 2, 16,
+        b"data", data_size
+    )
 
 class AudioService:
     """Service for generating audio from text using Coqui TTS"""
     
-    def __init__(self):
+    def __init__(self, audio_transcoder: Optional[AudioTranscoder] = None):
         self.tts = None
-        self._initialize_tts()
+        self.pool: Optional[TTSWorkerPool] = None
+        self.transcoder = audio_transcoder or transcoder
+        # A configured factory replaces Coqui, e.g. with a stand-in model for benchmarks
+        self.model_factory = (
+            resolve_model_factory(settings.TTS_MODEL_FACTORY) if settings.TTS_MODEL_FACTORY else None
+        )
+        self.audio_format = self._resolve_audio_format()
+        # The in-process model is not thread-safe, so calls go through a single thread
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="tts")
+        # The model is loaded lazily, by warm_up() or the first synthesis request
+        self._loaded = False
+        self._load_task: Optional[asyncio.Task] = None
+        # Identical texts share one synthesis; pinned narrations outlive the stories using them
+        self._narration_locks = KeyedLocks()
+        self._pinned_narrations: Set[str] = set()
+        readiness.register("tts")
+    
+    def _resolve_audio_format(self) -> str:
+        """Pick the storage format, falling back to WAV when it can't be produced"""
+        audio_format = settings.AUDIO_FORMAT.lower()
+        if audio_format not in AUDIO_FORMATS:
+            print(f"Warning: Unknown AUDIO_FORMAT '{settings.AUDIO_FORMAT}', storing WAV")
+            return "wav"
+        if audio_format != "wav" and not self.transcoder.available:
+            print(f"Warning: ffmpeg not found, storing WAV instead of {audio_format}")
+            return "wav"
+        return audio_format
+    
+    @property
+    def available(self) -> bool:
+        """Whether narration can be synthesized (optimistic until the model has loaded)"""
+        if self.pool is not None:
+            return not self.pool.failed
+        if self.tts is not None:
+            return True
+        return self._backend_installed and not self._loaded
+    
+    @property
+    def _backend_installed(self) -> bool:
+        return TTS_AVAILABLE or self.model_factory is not None
+    
+    async def warm_up(self):
+        """Load the model, or start the worker processes, ahead of the first request"""
+        await self._ensure_loaded()
+    
+    def preload(self):
+        """Load the in-process model synchronously, before the event loop starts
+        
+        Used by the prefork server so workers forked afterwards share the
+        weights copy-on-write; warm_up() then finds the model loaded.
+        """
+        if self._loaded or self.tts is not None:
+            return
+        try:
+            with readiness.track("tts"):
+                self._initialize_tts()
+                if not self._backend_installed:
+                    readiness.set_state("tts", DISABLED, "TTS package not installed")
+                elif self.tts is None:
+                    readiness.set_state("tts", FAILED, "TTS model could not be loaded")
+        finally:
+            self._loaded = True
+    
+    async def stop(self):
+        """Cancel a pending load and stop the TTS worker processes"""
+        if self._load_task is not None and not self._load_task.done():
+            self._load_task.cancel()
+        if self.pool is not None:
+            await self.pool.stop()
+    
+    async def _ensure_loaded(self):
+        """Load the model once; concurrent callers wait for the same load"""
+        if self._loaded or self.tts is not None:
+            return
+        if self._load_task is None or self._load_task.get_loop() is not asyncio.get_running_loop():
+            self._load_task = asyncio.ensure_future(self._load())
+        await asyncio.shield(self._load_task)
+    
+    async def _load(self):
+        """Load the configured TTS backend, recording readiness"""
+        try:
+            with readiness.track("tts"):
+                if not self._backend_installed:
+                    print("Warning: TTS package not available. Audio generation will be disabled.")
+                    readiness.set_state("tts", DISABLED, "TTS package not installed")
+                elif settings.TTS_WORKERS > 0:
+                    self.pool = TTSWorkerPool(
+                        settings.TTS_WORKERS,
+                        model_factory=self.model_factory or load_tts_model
+                    )
+                    await self.pool.start()
+                    await self.pool.wait_ready()
+                    if self.pool.failed:
+                        readiness.set_state("tts", FAILED, "TTS workers could not load the model")
+                else:
+                    loop = asyncio.get_running_loop()
+                    await loop.run_in_executor(self._executor, self._initialize_tts)
+                    if self.tts is None:
+                        readiness.set_state("tts", FAILED, "TTS model could not be loaded")
+        finally:
+            self._loaded = True
     
     def _initialize_tts(self):
         """Initialize TTS model"""
-        if not TTS_AVAILABLE:
+        if not self._backend_installed:
             print("Warning: TTS package not available. Audio generation will be disabled.")
             self.tts = None
             return
             
         try:
+            if self.model_factory is not None:
+                self.tts = self.model_factory(settings.TTS_MODEL_NAME)
+                return
+            
+            # Deferred import: loading TTS and torch dominates startup time
+            from TTS.api import TTS
+            
             # Initialize TTS with XTTS-v2 model
             self.tts = TTS(model_name=settings.TTS_MODEL_NAME, progress_bar=False)
         except Exception as e:
             print(f"Warning: Could not initialize TTS model: {e}")
             self.tts = None
     
+    def _narration_key(self, clean_text: str) -> str:
+        """Cache key of a narration: the cleaned text, model and voice"""
+        model = settings.TTS_MODEL_FACTORY or settings.TTS_MODEL_NAME
+        raw = f"{model}\0{TTS_SPEAKER_WAV}\0{TTS_LANGUAGE}\0{clean_text}"
+        return hashlib.sha256(raw.encode()).hexdigest()
+    
+    async def _find_narration(self, key: str) -> Optional[str]:
+        """Path of a cached narration, in the storage format or WAV"""
+        extensions = dict.fromkeys([AUDIO_FORMATS[self.audio_format][0], ".wav"])
+        for extension in extensions:
+            path = await storage.fetch(f"{NARRATION_DIR}/{key}{extension}")
+            if path is not None:
+                return path
+        return None
+    
+    async def reuse_narration(self, text: str, story_id: str) -> Optional[str]:
+        """Link a previously synthesized narration of the same text to a story
+        
+        Returns the story's audio filename, or None when nothing is cached.
+        """
+        cached = await self._find_narration(self._narration_key(self._clean_text_for_tts(text)))
+        NARRATION_CACHE.labels("hit" if cached else "miss").inc()
+        if cached is None:
+            return None
+        return await self.reuse_audio_file(cached, story_id)
+    
     async def generate_audio(self, text: str, story_id: str) -> Optional[str]:
         """Generate audio from text and return filename"""
-        if not self.tts:
+        # Identical text (fallback stories in particular) reuses the earlier narration
+        audio_filename = await self.reuse_narration(text, story_id)
+        if audio_filename is not None:
+            return audio_filename
+        
+        await self._ensure_loaded()
+        if not self.available:
             print("TTS model not available, skipping audio generation")
             return None
         
-        try:
-            # Create unique filename
-            audio_filename = f"{story_id}.wav"
-            audio_path = os.path.join(settings.AUDIO_OUTPUT_DIR, audio_filename)
-            
-            # Ensure output directory exists
-            os.makedirs(settings.AUDIO_OUTPUT_DIR, exist_ok=True)
-            
-            # Clean text for TTS
+        narration_path = await self._narrate(self._clean_text_for_tts(text))
+        if narration_path is None:
+            return None
+        return await self.reuse_audio_file(narration_path, story_id)
+    
+    async def prerender(self, texts: Iterable[str]):
+        """Synthesize narrations ahead of time and keep them while the server runs"""
+        await self._ensure_loaded()
+        if not self.available:
+            return
+        for text in texts:
             clean_text = self._clean_text_for_tts(text)
-            
-            # Generate audio in a separate thread to avoid blocking
-            await asyncio.get_event_loop().run_in_executor(
-                None,
-                self._generate_audio_sync,
-                clean_text,
-                audio_path
-            )
+            self._pinned_narrations.add(self._narration_key(clean_text))
+            await self._narrate(clean_text)
+    
+    async def _narrate(self, clean_text: str) -> Optional[str]:
+        """Return the cached narration of a text, synthesizing it once if needed"""
+        key = self._narration_key(clean_text)
+        # Concurrent requests for the same text wait for a single synthesis
+        async with self._narration_locks.hold(key):
+            return await self._find_narration(key) or await self._synthesize(clean_text, key)
+    
+    async def _synthesize(self, clean_text: str, key: str) -> Optional[str]:
+        """Synthesize a narration into the cache and return its path"""
+        wav_filename = f"{NARRATION_DIR}/{key}.wav"
+        # Synthesize next to the final location; it only appears there once complete
+        audio_path = storage.temp_path(wav_filename)
+        try:
+            async with admission.stage(LIMIT_TTS):
+                with STAGE_SECONDS.labels("tts_synthesis").time():
+                    if self.pool is not None:
+                        # Synthesize in a worker process that owns its own model
+                        await self.pool.synthesize_to_file(clean_text, audio_path)
+                    else:
+                        # Generate audio in a separate thread to avoid blocking
+                        await asyncio.get_event_loop().run_in_executor(
+                            self._executor,
+                            self._generate_audio_sync,
+                            clean_text,
+                            audio_path
+                        )
             
             # Verify file was created
             if os.path.exists(audio_path) and os.path.getsize(audio_path) > 0:
-                return audio_filename
+                return await storage.fetch(await self._encode_for_storage(audio_path, wav_filename))
             else:
                 print(f"Audio file was not created or is empty: {audio_path}")
+                TTS_FAILURES.labels("empty_output").inc()
                 return None
                 
         except Exception as e:
             print(f"Error generating audio: {e}")
+            TTS_FAILURES.labels("error").inc()
             return None
+        finally:
+            if os.path.exists(audio_path):
+                os.remove(audio_path)
+    
+    async def _encode_for_storage(self, wav_path: str, wav_filename: str) -> str:
+        """Compress a synthesized WAV into the storage format, store it and return its filename"""
+        if self.audio_format == "wav":
+            await storage.save(wav_path, wav_filename)
+            return wav_filename
+        
+        audio_filename = os.path.splitext(wav_filename)[0] + AUDIO_FORMATS[self.audio_format][0]
+        output_path = storage.temp_path(audio_filename)
+        try:
+            with STAGE_SECONDS.labels("file_write").time():
+                await self.transcoder.transcode(wav_path, output_path, self.audio_format)
+                await storage.save(output_path, audio_filename)
+            return audio_filename
+        except Exception as e:
+            print(f"Warning: Could not encode audio as {self.audio_format}, keeping WAV: {e}")
+            await storage.save(wav_path, wav_filename)
+            return wav_filename
+        finally:
+            if os.path.exists(output_path):
+                os.remove(output_path)
     
     def _generate_audio_sync(self, text: str, output_path: str):
         """Synchronous audio generation"""
@@ -79,13 +292,119 @@ class AudioService:
             self.tts.tts_to_file(
                 text=text,
                 file_path=output_path,
-                speaker_wav=None,  # Use default voice
-                language="en"
+                speaker_wav=TTS_SPEAKER_WAV,
+                language=TTS_LANGUAGE
             )
         except Exception as e:
             print(f"Error in TTS generation: {e}")
             raise
     
+    @property
+    def sample_rate(self) -> int:
+        """Output sample rate of the loaded model"""
+        if self.pool is not None:
+            return self.pool.sample_rate or DEFAULT_SAMPLE_RATE
+        synthesizer = getattr(self.tts, "synthesizer", None)
+        return getattr(synthesizer, "output_sample_rate", None) or DEFAULT_SAMPLE_RATE
+    
+    async def stream_audio(
+        self,
+        text: str,
+        story_id: str,
+        on_complete: Optional[Callable[[Optional[str]], Awaitable[None]]] = None
+    ) -> AsyncIterator[bytes]:
+        """Synthesize text sentence by sentence, yielding WAV bytes as each chunk is ready
+        
+        The chunks are also assembled into the stored narration; on_complete
+        receives its filename once the whole file has been written.
+        """
+        await self._ensure_loaded()
+        if not self.available:
+            raise RuntimeError("TTS model not available")
+        
+        audio_filename = f"{story_id}.wav"
+        partial_path = storage.temp_path(audio_filename)
+        
+        clean_text = self._clean_text_for_tts(text)
+        sentences = self._split_sentences(clean_text)
+        loop = asyncio.get_running_loop()
+        
+        async def synthesize(sentence: str) -> bytes:
+            try:
+                async with admission.stage(LIMIT_TTS):
+                    with STAGE_SECONDS.labels("tts_synthesis").time():
+                        if self.pool is not None:
+                            return await self.pool.synthesize_pcm(sentence)
+                        return await loop.run_in_executor(self._executor, self._synthesize_pcm_sync, sentence)
+            except Exception:
+                TTS_FAILURES.labels("error").inc()
+                raise
+        
+        # Synthesize the first chunk before writing headers so the worker's sample rate is known
+        first_chunk = await synthesize(sentences[0]) if sentences else b""
+        sample_rate = self.sample_rate
+        
+        output = wave.open(partial_path, "wb")
+        try:
+            output.setnchannels(1)
+            output.setsampwidth(2)
+            output.setframerate(sample_rate)
+            
+            # The total length is unknown up front, so advertise an open-ended stream
+            yield _wav_header(sample_rate)
+            
+            output.writeframes(first_chunk)
+            yield first_chunk
+            
+            for sentence in sentences[1:]:
+                pcm = await synthesize(sentence)
+                output.writeframes(pcm)
+                yield pcm
+            
+            output.close()
+            audio_filename = await self._encode_for_storage(partial_path, audio_filename)
+            await self._remember(clean_text, audio_filename)
+        finally:
+            output.close()
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+        
+        if on_complete:
+            await on_complete(audio_filename)
+    
+    async def _remember(self, clean_text: str, audio_filename: str):
+        """Add a story's finished narration to the cache"""
+        key = self._narration_key(clean_text)
+        extension = os.path.splitext(audio_filename)[1]
+        source_path = await storage.fetch(audio_filename)
+        if source_path is None or await self._find_narration(key) is not None:
+            return
+        try:
+            await storage.link(source_path, f"{NARRATION_DIR}/{key}{extension}")
+        except OSError as e:
+            print(f"Warning: Could not cache narration {audio_filename}: {e}")
+    
+    def _synthesize_pcm_sync(self, text: str) -> bytes:
+        """Synthesize one chunk of text to 16-bit mono PCM"""
+        return samples_to_pcm(self.tts.tts(text=text, speaker_wav=TTS_SPEAKER_WAV, language=TTS_LANGUAGE))
+    
+    def _split_sentences(self, text: str, max_chars: int = 250) -> List[str]:
+        """Split text at sentence boundaries, merging short sentences into chunks"""
+        sentences = [s for s in re.split(r"(?<=[.!?])\s+", text) if s.strip()]
+        
+        chunks = []
+        current = ""
+        for sentence in sentences:
+            if current and len(current) + len(sentence) + 1 > max_chars:
+                chunks.append(current)
+                current = sentence
+            else:
+                current = f"{current} {sentence}".strip()
+        if current:
+            chunks.append(current)
+        
+        return chunks
+    
     def _clean_text_for_tts(self, text: str) -> str:
         """Clean text for better TTS output"""
         # Remove excessive newlines and whitespace
@@ -108,14 +427,39 @@ class AudioService:
         
         return text
     
-    def delete_audio_file(self, filename: str) -> bool:
-        """Delete an audio file"""
+    async def reuse_audio_file(self, source_path: str, story_id: str) -> Optional[str]:
+        """Link an existing narration to a new story and return its filename"""
+        try:
+            extension = os.path.splitext(source_path)[1] or ".wav"
+            audio_filename = f"{story_id}{extension}"
+            with STAGE_SECONDS.labels("file_write").time():
+                await storage.link(source_path, audio_filename)
+            return audio_filename
+        except Exception as e:
+            print(f"Error reusing audio file {source_path}: {e}")
+            return None
+    
+    async def _release_narration(self, clean_text: str):
+        """Delete a cached narration that only the cache itself still links to"""
+        key = self._narration_key(clean_text)
+        if key in self._pinned_narrations:
+            return
+        path = await self._find_narration(key)
+        if path is not None and os.stat(path).st_nlink <= 1:
+            await storage.delete(f"{NARRATION_DIR}/{key}{os.path.splitext(path)[1]}")
+    
+    async def delete_audio_file(self, filename: str, text: Optional[str] = None) -> bool:
+        """Delete an audio file
+        
+        With the story text, its cached narration is dropped too once no
+        other story links to it.
+        """
         try:
-            file_path = os.path.join(settings.AUDIO_OUTPUT_DIR, filename)
-            if os.path.exists(file_path):
-                os.remove(file_path)
-                return True
-            return False
+            await self.transcoder.delete_derivatives(filename)
+            deleted = await storage.delete(filename)
+            if text is not None:
+                await self._release_narration(self._clean_text_for_tts(text))
+            return deleted
         except Exception as e:
             print(f"Error deleting audio file {filename}: {e}")
             return False 
\ No newline at end of file
@@ -0,0 +1,156 @@
+"""
+Circuit breaker and adaptive timeout for the inference dependency
+"""
+import time
+import math
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Optional, Tuple
+
+from ..core.config import settings
+
+# Breaker states
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# Latency samples kept for the timeout percentiles
+LATENCY_SAMPLES = 200
+
+def percentile(values, fraction: float) -> Optional[float]:
+    """Nearest-rank percentile of a sequence, or None when it's empty"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+class CircuitBreaker:
+    """Opens on a high error or slow-call rate and lets probes through after a cool-down
+
+    Outcomes of the last `window` calls are tracked while closed. Once at
+    least `min_calls` are in and either rate reaches its threshold, the
+    breaker opens and allow() refuses calls for `open_seconds`. It then
+    goes half-open and lets `half_open_calls` probes through: a success
+    closes it with a clean window, a failure opens it again.
+    """
+
+    def __init__(
+        self,
+        window: Optional[int] = None,
+        min_calls: Optional[int] = None,
+        failure_rate: Optional[float] = None,
+        slow_call_seconds: Optional[float] = None,
+        slow_call_rate: Optional[float] = None,
+        open_seconds: Optional[float] = None,
+        half_open_calls: Optional[int] = None,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        self.window = max(1, window or settings.BREAKER_WINDOW)
+        self.min_calls = max(1, min_calls or settings.BREAKER_MIN_CALLS)
+        self.failure_rate = failure_rate if failure_rate is not None else settings.BREAKER_FAILURE_RATE
+        self.slow_call_seconds = slow_call_seconds if slow_call_seconds is not None else settings.BREAKER_SLOW_CALL_SECONDS
+        self.slow_call_rate = slow_call_rate if slow_call_rate is not None else settings.BREAKER_SLOW_CALL_RATE
+        self.open_seconds = open_seconds if open_seconds is not None else settings.BREAKER_OPEN_SECONDS
+        self.half_open_calls = max(1, half_open_calls or settings.BREAKER_HALF_OPEN_CALLS)
+        self.clock = clock
+        self.state = CLOSED
+        self.opened_at: Optional[float] = None
+        self.probes = 0
+        self.rejected = 0
+        self.transitions: Dict[str, int] = {OPEN: 0, HALF_OPEN: 0, CLOSED: 0}
+        # (failed, slow) of recent calls
+        self._outcomes: Deque[Tuple[bool, bool]] = deque(maxlen=self.window)
+        self._latencies: Deque[float] = deque(maxlen=LATENCY_SAMPLES)
+
+    def _transition(self, state: str):
+        self.state = state
+        self.transitions[state] += 1
+        self.probes = 0
+        if state == OPEN:
+            self.opened_at = self.clock()
+        elif state == CLOSED:
+            self._outcomes.clear()
+
+    def allow(self) -> bool:
+        """Whether a call may go ahead; callers that get True must report it with record()"""
+        if self.state == OPEN and self.clock() - self.opened_at >= self.open_seconds:
+            self._transition(HALF_OPEN)
+        if self.state == CLOSED:
+            return True
+        if self.state == HALF_OPEN and self.probes < self.half_open_calls:
+            self.probes += 1
+            return True
+        self.rejected += 1
+        return False
+
+    def record(self, success: bool, seconds: float):
+        """Report the outcome and duration of an allowed call"""
+        if success:
+            self._latencies.append(seconds)
+
+        if self.state == HALF_OPEN:
+            self._transition(CLOSED if success else OPEN)
+            return
+        if self.state == OPEN:
+            # A call that started before the breaker opened
+            return
+
+        self._outcomes.append((not success, seconds >= self.slow_call_seconds))
+        if len(self._outcomes) < self.min_calls:
+            return
+        failure_rate, slow_rate = self.rates()
+        if failure_rate >= self.failure_rate or slow_rate >= self.slow_call_rate:
+            self._transition(OPEN)
+
+    def abandon(self):
+        """Report an allowed call that was cancelled before it had an outcome"""
+        if self.state == HALF_OPEN and self.probes:
+            self.probes -= 1
+
+    def rates(self) -> Tuple[float, float]:
+        """Failure and slow-call rates over the current window"""
+        if not self._outcomes:
+            return 0.0, 0.0
+        calls = len(self._outcomes)
+        return (
+            sum(failed for failed, _ in self._outcomes) / calls,
+            sum(slow for _, slow in self._outcomes) / calls,
+        )
+
+    def timeout(self) -> float:
+        """Per-call timeout adapted to recent successful latencies
+
+        INFERENCE_TIMEOUT_MULTIPLIER times the INFERENCE_TIMEOUT_PERCENTILE
+        latency, kept between INFERENCE_TIMEOUT_MIN and INFERENCE_TIMEOUT.
+        Probes and calls made before enough samples exist get the full
+        INFERENCE_TIMEOUT, so a slower but healthy service can be relearned.
+        """
+        ceiling = settings.INFERENCE_TIMEOUT
+        if self.state != CLOSED or len(self._latencies) < self.min_calls:
+            return ceiling
+        latency = percentile(self._latencies, settings.INFERENCE_TIMEOUT_PERCENTILE / 100)
+        return max(settings.INFERENCE_TIMEOUT_MIN, min(ceiling, latency * settings.INFERENCE_TIMEOUT_MULTIPLIER))
+
+    def snapshot(self) -> Dict[str, Any]:
+        failure_rate, slow_rate = self.rates()
+        retry_in = None
+        if self.state == OPEN:
+            retry_in = round(max(0.0, self.open_seconds - (self.clock() - self.opened_at)), 3)
+        latencies = list(self._latencies)
+        return {
+            "state": self.state,
+            "failure_rate": round(failure_rate, 3),
+            "slow_call_rate": round(slow_rate, 3),
+            "calls_in_window": len(self._outcomes),
+            "retry_in": retry_in,
+            "rejected": self.rejected,
+            "transitions": dict(self.transitions),
+            "timeout": round(self.timeout(), 3),
+            "latency": {
+                name: round(value, 3) if value is not None else None
+                for name, value in (
+                    ("p50", percentile(latencies, 0.5)),
+                    ("p95", percentile(latencies, 0.95)),
+                    ("p99", percentile(latencies, 0.99)),
+                )
+            },
+        }
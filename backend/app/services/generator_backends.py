@@ -0,0 +1,309 @@
+"""
+Story generation backends: the hosted inference API, or Kosmos-2 running in-process
+"""
+import io
+import base64
+import asyncio
+import importlib.util
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+import httpx
+
+from ..core.config import settings
+from ..core.readiness import readiness
+from ..core.metrics import STAGE_SECONDS
+from .inference_client import InferenceClient, inference_client
+from .circuit_breaker import CircuitBreaker
+
+# Checked without importing: torch and transformers take seconds to load
+LOCAL_BACKEND_AVAILABLE = all(
+    importlib.util.find_spec(name) is not None for name in ("torch", "transformers")
+)
+
+# Sampling parameters shared by every backend
+GENERATION_PARAMETERS = {
+    "max_new_tokens": 500,
+    "temperature": 0.8,
+    "do_sample": True,
+    "top_p": 0.9
+}
+
+class GeneratorUnavailable(Exception):
+    """The backend could not produce text; reason labels the fallback story"""
+
+    def __init__(self, reason: str, detail: str = ""):
+        super().__init__(detail or reason)
+        self.reason = reason
+
+class RemoteGeneratorBackend:
+    """Hugging Face inference API, or any server speaking the same protocol"""
+
+    name = "remote"
+
+    def __init__(
+        self,
+        client: Optional[InferenceClient] = None,
+        api_url: Optional[str] = None,
+        breaker: Optional[CircuitBreaker] = None
+    ):
+        self.client = client or inference_client
+        self.breaker = breaker or (CircuitBreaker() if settings.BREAKER_ENABLED else None)
+        self.api_url = api_url or settings.INFERENCE_API_URL or (
+            f"https://api-inference.huggingface.co/models/{settings.KOSMOS_MODEL_ID}"
+        )
+        self.headers = {
+            "Authorization": f"Bearer {settings.HUGGINGFACE_API_KEY}",
+            "Content-Type": "application/json"
+        }
+
+    @property
+    def depth(self) -> int:
+        return self.client.in_flight
+
+    def preload(self):
+        pass
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        # The pooled client is shared and closed on shutdown
+        pass
+
+    async def generate(self, image_b64: str, prompt: str) -> str:
+        """Return the raw generated text for a base64 JPEG and prompt"""
+        payload = {
+            "inputs": {
+                "image": image_b64,
+                "text": prompt
+            },
+            "parameters": GENERATION_PARAMETERS
+        }
+
+        # While the service is failing or slow, fall back at once instead of waiting on it
+        breaker = self.breaker
+        if breaker is not None and not breaker.allow():
+            raise GeneratorUnavailable("circuit_open")
+
+        # Only the last attempt's own time is recorded; local queueing and backoff
+        # say nothing about how fast the service is
+        attempt_seconds = 0.0
+
+        def on_attempt(seconds: float):
+            nonlocal attempt_seconds
+            attempt_seconds = seconds
+
+        try:
+            # Retries with backoff while the model is loading
+            response = await self.client.post(
+                self.api_url,
+                headers=self.headers,
+                json=payload,
+                timeout=breaker.timeout() if breaker is not None else None,
+                on_attempt=on_attempt
+            )
+        except asyncio.CancelledError:
+            if breaker is not None:
+                breaker.abandon()
+            raise
+        except httpx.HTTPError as e:
+            if breaker is not None:
+                breaker.record(False, attempt_seconds)
+            reason = "timeout" if isinstance(e, httpx.TimeoutException) else "network"
+            raise GeneratorUnavailable(reason, str(e)) from e
+
+        # Client errors are ours to fix, not a sign the service is unhealthy
+        if breaker is not None:
+            breaker.record(response.status_code < 500, attempt_seconds)
+
+        if response.status_code == 503:
+            # Model still loading after all retries
+            raise GeneratorUnavailable("model_loading")
+        if response.status_code != 200:
+            raise Exception(f"API request failed: {response.status_code} - {response.text}")
+
+        result = response.json()
+        if isinstance(result, list) and len(result) > 0:
+            return result[0].get("generated_text", "")
+        if isinstance(result, dict):
+            return result.get("generated_text", "")
+        return str(result)
+
+# (base64 image, prompt, caller's future)
+_BatchItem = Tuple[str, str, asyncio.Future]
+
+class LocalKosmosBackend:
+    """Kosmos-2 loaded with transformers, running concurrent requests as micro-batches on CPU"""
+
+    name = "local"
+
+    def __init__(
+        self,
+        model_id: Optional[str] = None,
+        batch_size: Optional[int] = None,
+        batch_window_ms: Optional[int] = None,
+        quantize: Optional[bool] = None,
+        torch_threads: Optional[int] = None
+    ):
+        self.model_id = model_id or settings.KOSMOS_MODEL_ID
+        self.batch_size = max(1, batch_size or settings.GENERATOR_BATCH_SIZE)
+        window_ms = batch_window_ms if batch_window_ms is not None else settings.GENERATOR_BATCH_WINDOW_MS
+        self.batch_window = window_ms / 1000
+        self.quantize = quantize if quantize is not None else settings.GENERATOR_QUANTIZE
+        self.torch_threads = torch_threads if torch_threads is not None else settings.GENERATOR_TORCH_THREADS
+        self.model = None
+        self.processor = None
+        self.pending = 0
+        self._queue: Optional[asyncio.Queue] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._start_task: Optional[asyncio.Future] = None
+        # One batch at a time: the model isn't thread-safe and a batch already uses every torch thread
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="kosmos")
+        readiness.register("generator")
+
+    @property
+    def depth(self) -> int:
+        return self.pending
+
+    def preload(self):
+        """Load the model synchronously, before the event loop starts
+
+        Used by the prefork server so workers forked afterwards share the
+        weights copy-on-write; start() then only starts the dispatcher.
+        """
+        if self.model is None and LOCAL_BACKEND_AVAILABLE:
+            with readiness.track("generator"):
+                self._load_model()
+
+    async def start(self):
+        """Load the model and start collecting batches"""
+        loop = asyncio.get_running_loop()
+        if self._start_task is None or self._start_task.get_loop() is not loop:
+            # The queue and dispatcher are bound to the loop that created them
+            self._start_task = asyncio.ensure_future(self._start())
+        await asyncio.shield(self._start_task)
+
+    async def _start(self):
+        try:
+            with readiness.track("generator"):
+                if self.model is None:
+                    if not LOCAL_BACKEND_AVAILABLE:
+                        raise RuntimeError("torch and transformers are required for GENERATOR_BACKEND=local")
+                    await asyncio.get_running_loop().run_in_executor(self._executor, self._load_model)
+        except Exception as e:
+            raise GeneratorUnavailable("model_unavailable", str(e)) from e
+        self._queue = asyncio.Queue()
+        self._dispatcher = asyncio.create_task(self._dispatch())
+
+    async def stop(self):
+        """Stop collecting batches; the loaded model is kept"""
+        if self._start_task is not None and not self._start_task.done():
+            self._start_task.cancel()
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            self._dispatcher = None
+        self._start_task = None
+
+    def _load_model(self):
+        """Load the processor and model, runs in the model thread"""
+        import torch
+        from transformers import AutoModelForVision2Seq, AutoProcessor
+
+        if self.torch_threads > 0:
+            torch.set_num_threads(self.torch_threads)
+
+        processor = AutoProcessor.from_pretrained(self.model_id)
+        # Pad prompts on the left so every sequence in a batch continues from its last token
+        processor.tokenizer.padding_side = "left"
+        model = AutoModelForVision2Seq.from_pretrained(self.model_id)
+        model.eval()
+        if self.quantize:
+            # int8 weights for Linear layers, activations quantized on the fly
+            model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+        self.processor = processor
+        self.model = model
+
+    def _generate_batch(self, images_b64: List[str], prompts: List[str]) -> List[str]:
+        """Generate text for a batch of images, runs in the model thread"""
+        import torch
+        from PIL import Image
+
+        images = [Image.open(io.BytesIO(base64.b64decode(data))).convert("RGB") for data in images_b64]
+        inputs = self.processor(text=prompts, images=images, return_tensors="pt", padding=True)
+        with torch.inference_mode():
+            generated = self.model.generate(
+                pixel_values=inputs["pixel_values"],
+                input_ids=inputs["input_ids"],
+                attention_mask=inputs["attention_mask"],
+                image_embeds=None,
+                image_embeds_position_mask=inputs["image_embeds_position_mask"],
+                use_cache=True,
+                **GENERATION_PARAMETERS
+            )
+        texts = self.processor.batch_decode(generated, skip_special_tokens=True)
+        # Drop Kosmos-2 grounding markup, keeping the plain text
+        return [self.processor.post_process_generation(text, cleanup_and_extract=False) for text in texts]
+
+    async def _collect(self) -> List[_BatchItem]:
+        """Wait for a request, then gather more for up to the batch window"""
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.batch_window
+        while len(batch) < self.batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _dispatch(self):
+        """Run collected batches one after another; requests arriving meanwhile form the next"""
+        loop = asyncio.get_running_loop()
+        while True:
+            # Skip callers that gave up while waiting
+            batch = [item for item in await self._collect() if not item[2].done()]
+            if not batch:
+                continue
+
+            try:
+                with STAGE_SECONDS.labels("inference_batch").time():
+                    texts = await loop.run_in_executor(
+                        self._executor,
+                        self._generate_batch,
+                        [item[0] for item in batch],
+                        [item[1] for item in batch]
+                    )
+            except Exception as e:
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            for (_, _, future), text in zip(batch, texts):
+                if not future.done():
+                    future.set_result(text)
+
+    async def generate(self, image_b64: str, prompt: str) -> str:
+        """Return the raw generated text for a base64 JPEG and prompt"""
+        await self.start()
+        future = asyncio.get_running_loop().create_future()
+        self.pending += 1
+        try:
+            self._queue.put_nowait((image_b64, prompt, future))
+            return await future
+        finally:
+            self.pending -= 1
+
+def create_generator_backend():
+    """Build the generator backend configured in settings"""
+    backend_name = settings.GENERATOR_BACKEND.lower()
+    if backend_name == "remote":
+        return RemoteGeneratorBackend()
+    if backend_name == "local":
+        return LocalKosmosBackend()
+    raise ValueError(f"Unknown GENERATOR_BACKEND: {settings.GENERATOR_BACKEND}")
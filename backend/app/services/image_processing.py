@@ -0,0 +1,302 @@
+"""
+Image preprocessing for inference requests, run in a process pool
+"""
+import io
+import os
+import uuid
+import base64
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Set, Tuple, Union
+
+from ..core.config import settings
+from ..core.readiness import readiness
+from ..core.metrics import STAGE_SECONDS
+from ..core.storage import storage
+from ..utils.locks import KeyedLocks
+
+# Longest side sent to the model
+MAX_IMAGE_SIZE = 1024
+
+# Use reduced-size JPEG decoding when the source is at least this many times larger
+DRAFT_FACTOR = 2
+
+# Format name -> (file extension, media type, PIL format, encoder options)
+IMAGE_FORMATS: Dict[str, Tuple[str, str, str, dict]] = {
+    "webp": (".webp", "image/webp", "WEBP", {"quality": 80, "method": 4}),
+    "jpeg": (".jpg", "image/jpeg", "JPEG", {"quality": 82, "optimize": True, "progressive": True}),
+}
+
+# Storage directory holding resized copies of uploads
+IMAGE_DERIVED_DIR = "derived/images"
+
+# (width, format name, output path) of one resized copy
+Derivative = Tuple[int, str, str]
+
+def image_derivative_name(filename: str, width: int, image_format: str) -> str:
+    """Storage name of the cached resized copy of an uploaded image"""
+    stem = os.path.splitext(os.path.basename(filename))[0]
+    extension = IMAGE_FORMATS[image_format][0]
+    return f"{IMAGE_DERIVED_DIR}/{stem}_w{width}{extension}"
+
+def image_derivative_path(filename: str, width: int, image_format: str) -> str:
+    """Local path of the cached resized copy of an uploaded image"""
+    return storage.path(image_derivative_name(filename, width, image_format))
+
+def snap_width(width: int, widths: Optional[List[int]] = None) -> int:
+    """Round a requested width up to the nearest configured derivative width"""
+    widths = widths or settings.image_derivative_widths_list
+    return next((candidate for candidate in widths if candidate >= width), widths[-1])
+
+def _save_derivatives(image, derivatives: List[Derivative]):
+    """Write resized copies of a decoded RGB image, largest first, each scaled from the last"""
+    from PIL import Image
+
+    current = image
+    for width, image_format, output_path in sorted(derivatives, key=lambda item: -item[0]):
+        if current.width > width:
+            current = current.copy()
+            # Only the width is constrained; the height follows the aspect ratio
+            current.thumbnail((width, current.height), Image.Resampling.LANCZOS)
+
+        _, _, pil_format, options = IMAGE_FORMATS[image_format]
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        partial_path = f"{output_path}.{uuid.uuid4().hex}.part"
+        try:
+            current.save(partial_path, format=pil_format, **options)
+            os.replace(partial_path, output_path)
+        finally:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+
+# source path -> decoded RGB image, kept by a worker process for the follow-up render
+_decoded: Dict[str, object] = {}
+
+def prepare_image(
+    source: Union[str, bytes],
+    max_size: int = MAX_IMAGE_SIZE,
+    keep_width: int = 0
+) -> str:
+    """Decode, downscale and base64-encode an image from a file path or raw bytes
+    
+    With keep_width, the decode of a file path, at least that wide where the
+    source allows, stays in this process for render_derivatives to reuse.
+    """
+    from PIL import Image
+
+    keep = bool(keep_width) and isinstance(source, str)
+    try:
+        image = Image.open(source if isinstance(source, str) else io.BytesIO(source))
+
+        # A small RGB JPEG is already in the shape we send, so skip the re-encode
+        passthrough = image.format == "JPEG" and image.mode == "RGB" and max(image.size) <= max_size
+        if passthrough and not keep:
+            return _encode_original(source)
+
+        # Let libjpeg decode at 1/2, 1/4 or 1/8 scale instead of full resolution
+        decode_size = max(max_size, keep_width if keep else 0)
+        if image.format == "JPEG" and max(image.size) >= decode_size * DRAFT_FACTOR:
+            image.draft("RGB", (decode_size, decode_size))
+
+        # Convert to RGB if necessary
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+
+        if keep:
+            # One image per process; an older one was never picked up here
+            _decoded.clear()
+            image.load()
+            _decoded[source] = image
+        if passthrough:
+            return _encode_original(source)
+
+        # Resize if too large (max 1024x1024 for better performance)
+        if max(image.size) > max_size:
+            if keep:
+                # The kept copy stays at full decoded size
+                image = image.copy()
+            image.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
+
+        # Convert to base64
+        buffer = io.BytesIO()
+        image.save(buffer, format="JPEG", quality=85)
+        return base64.b64encode(buffer.getvalue()).decode()
+
+    except Exception as e:
+        if keep:
+            _decoded.pop(source, None)
+        raise ValueError(f"Error processing image: {str(e)}")
+
+def render_derivatives(source_path: str, derivatives: List[Derivative]):
+    """Write the requested resized copies of an image
+    
+    Reuses the decode prepare_image kept when this process prepared the
+    image, and otherwise decodes it once for all the copies.
+    """
+    from PIL import Image
+
+    image = _decoded.pop(source_path, None)
+    if image is not None:
+        _save_derivatives(image, derivatives)
+        return
+
+    with Image.open(source_path) as image:
+        # Draft decoding only needs to cover the largest copy
+        largest = max(width for width, _, _ in derivatives)
+        if image.format == "JPEG" and image.width >= largest * DRAFT_FACTOR:
+            image.draft("RGB", (largest, image.height * largest // image.width))
+        _save_derivatives(image.convert("RGB"), derivatives)
+
+def _encode_original(source: Union[str, bytes]) -> str:
+    """Base64-encode the source bytes unchanged"""
+    if isinstance(source, str):
+        with open(source, "rb") as f:
+            source = f.read()
+    return base64.b64encode(source).decode()
+
+def _warm_worker() -> bool:
+    """Import the imaging stack in a worker process"""
+    from PIL import Image, JpegImagePlugin, PngImagePlugin, WebPImagePlugin  # noqa: F401
+    return True
+
+class ImageProcessor:
+    """Runs image preprocessing off the event loop in a pool of worker processes"""
+
+    def __init__(self, workers: Optional[int] = None, derivatives_on_prepare: Optional[bool] = None):
+        self.workers = workers if workers is not None else settings.IMAGE_WORKERS
+        self.derivatives_on_prepare = (
+            derivatives_on_prepare if derivatives_on_prepare is not None
+            else settings.IMAGE_DERIVATIVES_ON_UPLOAD
+        )
+        self.pending = 0
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._locks = KeyedLocks()
+        self._renders: Set[asyncio.Task] = set()
+        # Workers also start on demand, so a cold pool doesn't block readiness
+        readiness.register("image_workers", required=False)
+
+    def _get_executor(self) -> Optional[ProcessPoolExecutor]:
+        """Create the process pool on first use; None means the default thread pool"""
+        if self.workers <= 0:
+            return None
+        if self._executor is None:
+            # Spawn rather than fork so workers don't inherit server threads and sockets
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._executor
+
+    async def warm_up(self):
+        """Start every worker process and load the imaging stack before the first upload"""
+        with readiness.track("image_workers"):
+            loop = asyncio.get_running_loop()
+            executor = self._get_executor()
+            await asyncio.gather(*(
+                loop.run_in_executor(executor, _warm_worker)
+                for _ in range(max(1, self.workers))
+            ))
+
+    async def prepare(self, source: Union[str, bytes], max_size: int = MAX_IMAGE_SIZE) -> str:
+        """Prepare an image for inference without blocking the event loop
+        
+        For a saved upload the WebP gallery copies are rendered afterwards,
+        off the generation path, from the decode kept by the worker.
+        """
+        derivatives = []
+        if isinstance(source, str) and self.derivatives_on_prepare:
+            derivatives = self._missing_derivatives(source, "webp")
+        keep_width = max((width for width, _, _ in derivatives), default=0)
+
+        loop = asyncio.get_running_loop()
+        self.pending += 1
+        try:
+            with STAGE_SECONDS.labels("image_prepare").time():
+                image_b64 = await loop.run_in_executor(
+                    self._get_executor(), prepare_image, source, max_size, keep_width
+                )
+        finally:
+            self.pending -= 1
+
+        if derivatives:
+            task = asyncio.create_task(self._render_after_prepare(source, "webp"))
+            # Hold a reference so the task isn't collected before it finishes
+            self._renders.add(task)
+            task.add_done_callback(self._renders.discard)
+        return image_b64
+
+    async def _render_after_prepare(self, source_path: str, image_format: str):
+        """Render the copies of a prepared upload that are still missing"""
+        try:
+            async with self._locks.hold(source_path):
+                # A ?w= request may have rendered them in the meantime
+                derivatives = self._missing_derivatives(source_path, image_format)
+                if derivatives:
+                    await self._render(source_path, derivatives)
+        except Exception as e:
+            print(f"Warning: Could not render image derivatives of {source_path}: {e}")
+
+    async def _render(self, source_path: str, derivatives: List[Derivative]):
+        """Write resized copies in a worker and publish them"""
+        loop = asyncio.get_running_loop()
+        self.pending += 1
+        try:
+            with STAGE_SECONDS.labels("image_resize").time():
+                await loop.run_in_executor(
+                    self._get_executor(), render_derivatives, source_path, derivatives
+                )
+        finally:
+            self.pending -= 1
+        await self._commit(source_path, derivatives)
+
+    async def _commit(self, source_path: str, derivatives: List[Derivative]):
+        """Publish rendered copies to storage"""
+        await asyncio.gather(*(
+            storage.commit(image_derivative_name(source_path, width, image_format))
+            for width, image_format, _ in derivatives
+        ))
+
+    def _missing_derivatives(self, source_path: str, image_format: str) -> List[Derivative]:
+        """Every configured width of a format that hasn't been rendered yet"""
+        derivatives = []
+        for width in settings.image_derivative_widths_list:
+            output_path = image_derivative_path(source_path, width, image_format)
+            if not os.path.exists(output_path):
+                derivatives.append((width, image_format, output_path))
+        return derivatives
+
+    async def get_derivative(self, source_path: str, width: int, image_format: str) -> str:
+        """Return a resized copy of an image, rendering it on first request"""
+        name = image_derivative_name(source_path, width, image_format)
+        output_path = await storage.fetch(name)
+        if output_path is not None:
+            return output_path
+        output_path = storage.path(name)
+
+        # Concurrent requests share one render, which fills in every missing width
+        async with self._locks.hold(source_path):
+            if await storage.fetch(name) is None:
+                derivatives = self._missing_derivatives(source_path, image_format)
+                if not any(path == output_path for _, _, path in derivatives):
+                    derivatives.append((width, image_format, output_path))
+                await self._render(source_path, derivatives)
+
+        return output_path
+
+    async def delete_derivatives(self, filename: str):
+        """Remove every resized copy of an image"""
+        await asyncio.gather(*(
+            storage.delete(image_derivative_name(filename, width, image_format))
+            for width in settings.image_derivative_widths_list
+            for image_format in IMAGE_FORMATS
+        ))
+
+    def shutdown(self):
+        """Stop the worker processes"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+# Shared processor instance
+image_processor = ImageProcessor()
@@ -0,0 +1,121 @@
+"""
+Pooled async HTTP client for Hugging Face inference calls
+"""
+import time
+import asyncio
+import random
+from contextlib import nullcontext
+from typing import Any, Callable, Dict, Optional
+
+import httpx
+
+from ..core.config import settings
+from ..core.metrics import STAGE_SECONDS, INFERENCE_RESPONSES
+
+class InferenceClient:
+    """Shared keep-alive HTTP client with a cap on in-flight requests (0 for no cap)"""
+
+    def __init__(
+        self,
+        max_in_flight: Optional[int] = None,
+        max_retries: Optional[int] = None,
+        backoff_base: Optional[float] = None,
+        backoff_max: Optional[float] = None
+    ):
+        self.max_in_flight = max(0, max_in_flight if max_in_flight is not None else settings.INFERENCE_MAX_IN_FLIGHT)
+        self.max_retries = max_retries if max_retries is not None else settings.INFERENCE_MAX_RETRIES
+        self.backoff_base = backoff_base if backoff_base is not None else settings.INFERENCE_BACKOFF_BASE
+        self.backoff_max = backoff_max if backoff_max is not None else settings.INFERENCE_BACKOFF_MAX
+        self.in_flight = 0
+        self._client: Optional[httpx.AsyncClient] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    async def _get_client(self) -> httpx.AsyncClient:
+        """Return the pooled client, creating it for the running event loop"""
+        loop = asyncio.get_running_loop()
+        if self._client is not None and self._loop is not loop:
+            # Connections and semaphores are bound to the loop that created them
+            await self.aclose()
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=settings.INFERENCE_MAX_CONNECTIONS,
+                    max_keepalive_connections=settings.INFERENCE_MAX_CONNECTIONS,
+                    keepalive_expiry=60.0
+                ),
+                timeout=httpx.Timeout(settings.INFERENCE_TIMEOUT, connect=10.0)
+            )
+            self._semaphore = asyncio.Semaphore(self.max_in_flight) if self.max_in_flight else None
+            self._loop = loop
+        return self._client
+
+    def _backoff_delay(self, attempt: int, response: httpx.Response) -> float:
+        """Jittered exponential backoff, stretched to the model's estimated load time"""
+        ceiling = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+        delay = random.uniform(ceiling / 2, ceiling)
+
+        try:
+            estimated_time = float(response.json().get("estimated_time", 0))
+        except (ValueError, AttributeError):
+            estimated_time = 0.0
+
+        if estimated_time > delay:
+            delay = min(self.backoff_max, estimated_time) * random.uniform(0.8, 1.0)
+        return delay
+
+    async def post(
+        self,
+        url: str,
+        headers: Dict[str, str],
+        json: Any,
+        timeout: Optional[float] = None,
+        on_attempt: Optional[Callable[[float], None]] = None
+    ) -> httpx.Response:
+        """POST a JSON payload, retrying while the model is loading (503)
+        
+        timeout overrides INFERENCE_TIMEOUT for each attempt. on_attempt is
+        called with the seconds each attempt took once it had a slot, so
+        neither waiting for the in-flight cap nor backing off is counted.
+        """
+        client = await self._get_client()
+        request_timeout = httpx.Timeout(timeout, connect=min(10.0, timeout)) if timeout else httpx.USE_CLIENT_DEFAULT
+
+        attempt = 0
+        while True:
+            async with self._semaphore or nullcontext():
+                self.in_flight += 1
+                started = time.perf_counter()
+                try:
+                    response = await client.post(url, headers=headers, json=json, timeout=request_timeout)
+                except httpx.HTTPError:
+                    INFERENCE_RESPONSES.labels("error").inc()
+                    raise
+                finally:
+                    self.in_flight -= 1
+                    elapsed = time.perf_counter() - started
+                    STAGE_SECONDS.labels("inference_request").observe(elapsed)
+                    if on_attempt is not None:
+                        on_attempt(elapsed)
+            INFERENCE_RESPONSES.labels(response.status_code).inc()
+
+            if response.status_code != 503 or attempt >= self.max_retries:
+                return response
+
+            # Release the slot while waiting so other requests can proceed
+            await asyncio.sleep(self._backoff_delay(attempt, response))
+            attempt += 1
+
+    async def aclose(self):
+        """Close pooled connections"""
+        # Detached before awaiting, so a client created meanwhile is left alone
+        client, self._client, self._loop = self._client, None, None
+        if client is not None:
+            try:
+                await client.aclose()
+            except RuntimeError:
+                # The loop that owned the connections is already gone
+                pass
+
+# Shared client instance
+inference_client = InferenceClient()
@@ -0,0 +1,226 @@
+"""
+Background job queue for asynchronous story generation
+"""
+import os
+import socket
+import asyncio
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+from sqlalchemy import select, update, or_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..core.config import settings
+from ..core.storage import storage
+from ..models.job import Job, JOB_QUEUED, JOB_RUNNING, JOB_COMPLETED, JOB_FAILED
+from .story_pipeline import StoryPipeline
+from .progress import ProgressBroker, progress_broker, EVENT_COMPLETE, EVENT_ERROR
+
+UNFINISHED = (JOB_QUEUED, JOB_RUNNING)
+
+class JobQueue:
+    """Bounded pool of workers that moves persisted jobs through the story pipeline
+
+    Every unfinished job is leased to the process that will run it. The
+    lease is renewed while the process lives, and a job whose lease runs
+    out, because its process crashed or was replaced, is taken over by
+    whichever process sharing the database notices first.
+    """
+
+    def __init__(
+        self,
+        pipeline: StoryPipeline,
+        session_factory: Callable[[], AsyncSession],
+        workers: Optional[int] = None,
+        progress: Optional[ProgressBroker] = None,
+        lease: Optional[float] = None
+    ):
+        self.pipeline = pipeline
+        self.session_factory = session_factory
+        self.progress = progress or progress_broker
+        self.workers = max(1, workers if workers is not None else settings.JOB_WORKERS)
+        self.lease = lease if lease is not None else settings.JOB_LEASE
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._tasks: List[asyncio.Task] = []
+
+    @property
+    def running(self) -> bool:
+        """Whether the worker pool has been started"""
+        return bool(self._tasks)
+
+    @property
+    def depth(self) -> int:
+        """Number of jobs waiting for a worker"""
+        return self._queue.qsize()
+
+    @property
+    def owner(self) -> str:
+        """Name of this process in job leases; read each time, as workers are forked"""
+        return f"{socket.gethostname()}:{os.getpid()}"
+
+    def _lease_deadline(self) -> datetime:
+        return datetime.now(timezone.utc) + timedelta(seconds=self.lease)
+
+    def lease_job(self, job: Job):
+        """Lease a new job to this process"""
+        job.owner = self.owner
+        job.lease_expires_at = self._lease_deadline()
+
+    async def start(self):
+        """Take over jobs with expired leases and start the worker pool"""
+        if self._tasks:
+            return
+
+        await self._reclaim()
+        self._tasks = [
+            asyncio.create_task(self._worker(), name=f"job-worker-{i}")
+            for i in range(self.workers)
+        ]
+        self._tasks.append(asyncio.create_task(self._heartbeat(), name="job-heartbeat"))
+
+    async def stop(self):
+        """Stop the worker pool and give up the leases of unfinished jobs"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await self._release()
+
+    def submit(self, job_id: str):
+        """Queue a persisted job for processing"""
+        self._queue.put_nowait(job_id)
+
+    async def _heartbeat(self):
+        """Renew this process's leases and take over expired ones until cancelled"""
+        while True:
+            await asyncio.sleep(self.lease / 4)
+            await self._renew()
+            await self._reclaim()
+
+    async def _renew(self):
+        async with self.session_factory() as db:
+            try:
+                await db.execute(
+                    update(Job)
+                    .where(Job.owner == self.owner, Job.status.in_(UNFINISHED))
+                    .values(lease_expires_at=self._lease_deadline())
+                )
+                await db.commit()
+            except Exception as e:
+                print(f"Warning: Could not renew job leases: {e}")
+
+    async def _release(self):
+        """Let other processes take over this one's unfinished jobs straight away"""
+        async with self.session_factory() as db:
+            try:
+                await db.execute(
+                    update(Job)
+                    .where(Job.owner == self.owner, Job.status.in_(UNFINISHED))
+                    .values(lease_expires_at=datetime.now(timezone.utc))
+                )
+                await db.commit()
+            except Exception as e:
+                print(f"Warning: Could not release job leases: {e}")
+
+    async def _reclaim(self):
+        """Queue unfinished jobs whose lease has expired, including those of a previous run"""
+        async with self.session_factory() as db:
+            try:
+                expired = (await db.execute(
+                    select(Job.id, Job.lease_expires_at)
+                    .where(
+                        Job.status.in_(UNFINISHED),
+                        or_(Job.lease_expires_at.is_(None), Job.lease_expires_at <= datetime.now(timezone.utc))
+                    )
+                    .order_by(Job.created_at)
+                )).all()
+                claimed = []
+                for job_id, lease_expires_at in expired:
+                    # Only take the job if no other process renewed or claimed it since the read
+                    unchanged = (
+                        Job.lease_expires_at.is_(None) if lease_expires_at is None
+                        else Job.lease_expires_at == lease_expires_at
+                    )
+                    result = await db.execute(
+                        update(Job)
+                        .where(Job.id == job_id, Job.status.in_(UNFINISHED), unchanged)
+                        .values(
+                            status=JOB_QUEUED,
+                            stage=None,
+                            owner=self.owner,
+                            lease_expires_at=self._lease_deadline()
+                        )
+                    )
+                    if result.rowcount == 1:
+                        claimed.append(job_id)
+                await db.commit()
+                for job_id in claimed:
+                    self.submit(job_id)
+            except Exception as e:
+                print(f"Warning: Could not recover pending jobs: {e}")
+
+    async def _worker(self):
+        """Process jobs until cancelled"""
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._process(job_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Error processing job {job_id}: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def _process(self, job_id: str):
+        """Run a single job through the pipeline and record the outcome"""
+        async with self.session_factory() as db:
+            job = await db.get(Job, job_id)
+            if not job or job.status not in UNFINISHED or job.owner != self.owner:
+                # Finished, or taken over by another process after this one's lease ran out
+                return
+
+            job.status = JOB_RUNNING
+            await db.commit()
+
+            async def on_stage(stage: str):
+                job.stage = stage
+                await db.commit()
+
+            async def on_event(event: str, data: Dict[str, Any]):
+                self.progress.publish(job_id, event, data)
+
+            story = None
+            failed_stage = None
+            try:
+                image_path = await storage.fetch(job.image_filename)
+                if image_path is None:
+                    raise FileNotFoundError(f"Image {job.image_filename} not found")
+                story = await self.pipeline.run(
+                    db,
+                    job.story_id,
+                    image_path,
+                    job.story_type,
+                    job.image_filename,
+                    content_hash=job.content_hash,
+                    on_stage=on_stage,
+                    on_event=on_event
+                )
+                job.status = JOB_COMPLETED
+                job.stage = None
+            except Exception as e:
+                failed_stage = job.stage
+                await db.rollback()
+                job.status = JOB_FAILED
+                job.error = f"Error processing request: {str(e)}"
+
+            await db.commit()
+            if story is None:
+                # As in the synchronous path, a failed upload isn't kept
+                await storage.delete(job.image_filename)
+
+            # Published after the commit so subscribers reacting to it see the final job state
+            if story is not None:
+                self.progress.publish(job_id, EVENT_COMPLETE, {"story": story.to_dict()})
+            else:
+                self.progress.publish(job_id, EVENT_ERROR, {"stage": failed_stage, "error": job.error})
@@ -0,0 +1,165 @@
+"""
+Per-job progress events, published by the pipeline and read over Server-Sent Events
+"""
+import json
+import time
+import asyncio
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from ..core.config import settings
+
+# Pipeline stage names, in the order they run
+STAGE_PREPARE = "prepare"
+STAGE_INFERENCE = "inference"
+STAGE_AUDIO = "audio"
+STAGE_SAVE = "save"
+
+# Event names
+EVENT_STAGE_START = "stage_start"
+EVENT_STAGE_END = "stage_end"
+EVENT_STORY = "story"
+EVENT_COMPLETE = "complete"
+EVENT_ERROR = "error"
+
+TERMINAL_EVENTS = (EVENT_COMPLETE, EVENT_ERROR)
+
+# (event id, event name, payload)
+ProgressEvent = Tuple[int, str, Dict[str, Any]]
+
+def format_sse(event_id: int, event: str, data: Dict[str, Any]) -> bytes:
+    """Encode one Server-Sent Events message"""
+    return f"id: {event_id}\nevent: {event}\ndata: {json.dumps(data)}\n\n".encode()
+
+class StageTimer:
+    """Turns successive stage names into start/end events with timings"""
+
+    def __init__(
+        self,
+        on_stage: Optional[Callable[[str], Awaitable[None]]] = None,
+        on_event: Optional[Callable[[str, Dict[str, Any]], Awaitable[None]]] = None
+    ):
+        self.on_stage = on_stage
+        self.on_event = on_event
+        self.stage: Optional[str] = None
+        self._started = time.perf_counter()
+        self._stage_started = self._started
+
+    def _elapsed_ms(self, since: float) -> float:
+        return round((time.perf_counter() - since) * 1000, 1)
+
+    async def emit(self, event: str, data: Dict[str, Any]):
+        """Send an event, stamped with the time since the run started"""
+        if self.on_event:
+            await self.on_event(event, {**data, "elapsed_ms": self._elapsed_ms(self._started)})
+
+    async def enter(self, stage: str):
+        """End the current stage, if any, and start the next"""
+        if stage == self.stage:
+            return
+        await self.finish()
+        self.stage = stage
+        self._stage_started = time.perf_counter()
+        if self.on_stage:
+            await self.on_stage(stage)
+        await self.emit(EVENT_STAGE_START, {"stage": stage})
+
+    async def finish(self):
+        """End the current stage"""
+        if self.stage is None:
+            return
+        duration_ms = self._elapsed_ms(self._stage_started)
+        stage, self.stage = self.stage, None
+        await self.emit(EVENT_STAGE_END, {"stage": stage, "duration_ms": duration_ms})
+
+class _Channel:
+    """Event history and live subscribers of one job"""
+
+    def __init__(self):
+        self.events: List[ProgressEvent] = []
+        self.subscribers: List[asyncio.Queue] = []
+        self.closed = False
+        self.expired = False
+
+class ProgressBroker:
+    """Fans job events out to subscribers, replaying what they missed"""
+
+    def __init__(self, retention: Optional[float] = None, keepalive: Optional[float] = None):
+        self.retention = retention if retention is not None else settings.PROGRESS_RETENTION
+        self.keepalive = keepalive if keepalive is not None else settings.SSE_KEEPALIVE
+        self._channels: Dict[str, _Channel] = {}
+
+    def has(self, job_id: str) -> bool:
+        """Whether events for a job have been published and are still retained"""
+        channel = self._channels.get(job_id)
+        return bool(channel and channel.events)
+
+    def publish(self, job_id: str, event: str, data: Dict[str, Any]):
+        """Record an event and deliver it to current subscribers"""
+        channel = self._channels.setdefault(job_id, _Channel())
+        if channel.closed:
+            return
+
+        message = (len(channel.events), event, data)
+        channel.events.append(message)
+        for queue in channel.subscribers:
+            queue.put_nowait(message)
+
+        if event in TERMINAL_EVENTS:
+            channel.closed = True
+            # Keep the history for a while so late subscribers still see the outcome
+            asyncio.get_running_loop().call_later(self.retention, self._forget, job_id)
+
+    def _forget(self, job_id: str):
+        channel = self._channels.get(job_id)
+        if channel is None:
+            return
+        channel.expired = True
+        if not channel.subscribers:
+            del self._channels[job_id]
+
+    async def subscribe(
+        self,
+        job_id: str,
+        after: int = -1,
+        keepalive: Optional[float] = None
+    ) -> AsyncIterator[Optional[ProgressEvent]]:
+        """Yield events with an id greater than after until the job finishes
+
+        None is yielded whenever no event arrived within the keep-alive
+        interval, which defaults to the broker's.
+        """
+        idle = keepalive if keepalive is not None else self.keepalive
+        channel = self._channels.setdefault(job_id, _Channel())
+        queue: asyncio.Queue = asyncio.Queue()
+        # Snapshot the history and register in one step so nothing falls in between
+        backlog = [message for message in channel.events if message[0] > after]
+        channel.subscribers.append(queue)
+        try:
+            for message in backlog:
+                yield message
+                if message[1] in TERMINAL_EVENTS:
+                    return
+            if channel.closed:
+                # Resumed after the final event
+                return
+
+            while True:
+                try:
+                    message = await asyncio.wait_for(queue.get(), idle)
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+                if message[0] <= after:
+                    continue
+                yield message
+                if message[1] in TERMINAL_EVENTS:
+                    return
+        finally:
+            channel.subscribers.remove(queue)
+            # Drop channels nobody published to, or whose retention ran out while we were reading
+            if not channel.subscribers and (channel.expired or not channel.events):
+                if self._channels.get(job_id) is channel:
+                    del self._channels[job_id]
+
+# Shared broker instance
+progress_broker = ProgressBroker()
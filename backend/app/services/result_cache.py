@@ -0,0 +1,250 @@
+"""
+Content-addressed cache of generated stories and narrations
+"""
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from ..core.config import settings
+from ..utils.files import link_file
+
+class MemoryCacheBackend:
+    """In-process LRU backend"""
+
+    name = "memory"
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key: str, entry: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Store an entry and return the entries evicted to make room"""
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            evicted = []
+            while len(self._entries) > self.max_entries:
+                _, old = self._entries.popitem(last=False)
+                evicted.append(old)
+            return evicted
+
+    def delete(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            return self._entries.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def close(self):
+        pass
+
+class SQLiteCacheBackend:
+    """Disk backend stored in a SQLite file, shared between processes"""
+
+    name = "sqlite"
+
+    def __init__(self, path: str, max_entries: int):
+        self.path = path
+        self.max_entries = max_entries
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # Connections must not cross a fork, so set the file up on one that is closed
+        # straight away and let each process open its own on first use
+        conn = sqlite3.connect(path, isolation_level=None)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS result_cache ("
+                "key TEXT PRIMARY KEY, story_text TEXT NOT NULL, audio_path TEXT, "
+                "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS ix_result_cache_accessed_at ON result_cache (accessed_at)"
+            )
+        finally:
+            conn.close()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def _connection(self) -> sqlite3.Connection:
+        """This process's connection, opened on first use"""
+        if self._conn is None or self._pid != os.getpid():
+            # A connection inherited from the parent is dropped, never used
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._pid = os.getpid()
+        return self._conn
+
+    @staticmethod
+    def _to_entry(row: Tuple) -> Dict[str, Any]:
+        return {"key": row[0], "story_text": row[1], "audio_path": row[2], "created_at": row[3]}
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            conn = self._connection()
+            row = conn.execute(
+                "SELECT key, story_text, audio_path, created_at FROM result_cache WHERE key = ?",
+                (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE result_cache SET accessed_at = ? WHERE key = ?", (time.time(), key)
+            )
+            return self._to_entry(row)
+
+    def set(self, key: str, entry: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Store an entry and return the entries evicted to make room"""
+        with self._lock:
+            conn = self._connection()
+            now = time.time()
+            conn.execute(
+                "INSERT OR REPLACE INTO result_cache "
+                "(key, story_text, audio_path, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, entry["story_text"], entry.get("audio_path"), entry["created_at"], now)
+            )
+            overflow = len(self) - self.max_entries
+            if overflow <= 0:
+                return []
+            rows = conn.execute(
+                "SELECT key, story_text, audio_path, created_at FROM result_cache "
+                "ORDER BY accessed_at LIMIT ?",
+                (overflow,)
+            ).fetchall()
+            conn.executemany(
+                "DELETE FROM result_cache WHERE key = ?", [(row[0],) for row in rows]
+            )
+            return [self._to_entry(row) for row in rows]
+
+    def delete(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            conn = self._connection()
+            row = conn.execute(
+                "SELECT key, story_text, audio_path, created_at FROM result_cache WHERE key = ?",
+                (key,)
+            ).fetchone()
+            conn.execute("DELETE FROM result_cache WHERE key = ?", (key,))
+            return self._to_entry(row) if row else None
+
+    def __len__(self) -> int:
+        return self._connection().execute("SELECT COUNT(*) FROM result_cache").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None and self._pid == os.getpid():
+                self._conn.close()
+            self._conn = None
+
+class ResultCache:
+    """Cache of story text and narration keyed by image content and prompt version"""
+
+    def __init__(self, backend, ttl: int = 0, directory: Optional[str] = None):
+        self.backend = backend
+        self.ttl = ttl
+        self.directory = directory or settings.RESULT_CACHE_DIR
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def make_key(content_hash: str, story_type: str, prompt_version: str) -> str:
+        """Build a cache key from the image hash, story type and prompt/model version"""
+        raw = f"{content_hash}:{story_type.lower()}:{prompt_version}"
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return the cached story for a key, or None on a miss"""
+        entry = self.backend.get(key)
+
+        if entry is not None and self.ttl and time.time() - entry["created_at"] > self.ttl:
+            self._discard(self.backend.delete(key))
+            entry = None
+
+        if entry is None:
+            self.misses += 1
+            return None
+
+        # The narration may have been removed from disk; the text is still usable
+        if entry.get("audio_path") and not os.path.exists(entry["audio_path"]):
+            entry = dict(entry, audio_path=None)
+
+        self.hits += 1
+        return entry
+
+    def put(self, key: str, story_text: str, audio_path: Optional[str] = None):
+        """Store a story, keeping a cache-owned link to its narration"""
+        cached_audio = None
+        if audio_path and os.path.exists(audio_path):
+            extension = os.path.splitext(audio_path)[1]
+            cached_audio = os.path.join(self.directory, f"{key}{extension}")
+            try:
+                link_file(audio_path, cached_audio)
+            except OSError as e:
+                print(f"Warning: Could not cache audio file {audio_path}: {e}")
+                cached_audio = None
+
+        evicted = self.backend.set(key, {
+            "key": key,
+            "story_text": story_text,
+            "audio_path": cached_audio,
+            "created_at": time.time(),
+        })
+        for entry in evicted:
+            self._discard(entry)
+        self.evictions += len(evicted)
+
+    def _discard(self, entry: Optional[Dict[str, Any]]):
+        """Remove the cache-owned narration of a dropped entry"""
+        if entry and entry.get("audio_path") and os.path.exists(entry["audio_path"]):
+            try:
+                os.remove(entry["audio_path"])
+            except OSError as e:
+                print(f"Warning: Could not remove cached audio {entry['audio_path']}: {e}")
+
+    def close(self):
+        """Release the backend's resources"""
+        self.backend.close()
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit/miss counters and current size"""
+        lookups = self.hits + self.misses
+        return {
+            "backend": self.backend.name,
+            "entries": len(self.backend),
+            "max_entries": self.backend.max_entries,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+def create_result_cache() -> Optional[ResultCache]:
+    """Build the result cache configured in settings, or None when disabled"""
+    backend_name = settings.RESULT_CACHE_BACKEND.lower()
+    if backend_name == "none":
+        return None
+
+    if backend_name == "sqlite":
+        backend = SQLiteCacheBackend(
+            os.path.join(settings.RESULT_CACHE_DIR, "results.db"),
+            settings.RESULT_CACHE_MAX_ENTRIES
+        )
+    elif backend_name == "memory":
+        backend = MemoryCacheBackend(settings.RESULT_CACHE_MAX_ENTRIES)
+    else:
+        raise ValueError(f"Unknown RESULT_CACHE_BACKEND: {settings.RESULT_CACHE_BACKEND}")
+
+    return ResultCache(backend, ttl=settings.RESULT_CACHE_TTL)
@@ -1,48 +1,45 @@
 """
 Story generation service using Microsoft Kosmos-2 model
 """
-import base64
-import io
-import requests
-from PIL import Image
-from typing import Optional
+import hashlib
+from typing import Awaitable, Callable, List, Optional, Union
 
 from ..core.config import settings
+from ..core.admission import admission, LIMIT_PREPROCESS, LIMIT_INFERENCE
+from ..core.metrics import FALLBACK_STORIES
+from .inference_client import InferenceClient
+from .image_processing import ImageProcessor, image_processor, prepare_image
+from .generator_backends import GeneratorUnavailable, RemoteGeneratorBackend, create_generator_backend
+from .progress import STAGE_INFERENCE
 
 class StoryGeneratorService:
     """Service for generating stories from images using Kosmos-2"""
     
-    def __init__(self):
-        self.api_url = f"https://api-inference.huggingface.co/models/{settings.KOSMOS_MODEL_ID}"
-        self.headers = {
-            "Authorization": f"Bearer {settings.HUGGINGFACE_API_KEY}",
-            "Content-Type": "application/json"
-        }
+    def __init__(
+        self,
+        client: Optional[InferenceClient] = None,
+        processor: Optional[ImageProcessor] = None,
+        backend=None
+    ):
+        self.processor = processor or image_processor
+        # GENERATOR_BACKEND picks the hosted API or a local model; a given client implies the API
+        self.backend = backend or (RemoteGeneratorBackend(client) if client else create_generator_backend())
     
-    def _prepare_image(self, image_bytes: bytes) -> str:
-        """Prepare image for API request"""
-        try:
-            # Open and process image
-            image = Image.open(io.BytesIO(image_bytes))
-            
-            # Convert to RGB if necessary
-            if image.mode != 'RGB':
-                image = image.convert('RGB')
-            
-            # Resize if too large (max 1024x1024 for better performance)
-            max_size = 1024
-            if max(image.size) > max_size:
-                image.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
-            
-            # Convert to base64
-            buffer = io.BytesIO()
-            image.save(buffer, format='JPEG', quality=85)
-            image_b64 = base64.b64encode(buffer.getvalue()).decode()
-            
-            return image_b64
-            
-        except Exception as e:
-            raise ValueError(f"Error processing image: {str(e)}")
+    async def warm_up(self):
+        """Load the backend's model ahead of the first request"""
+        await self.backend.start()
+    
+    def preload(self):
+        """Load an in-process model ahead of forking server workers"""
+        self.backend.preload()
+    
+    async def stop(self):
+        """Stop the backend"""
+        await self.backend.stop()
+    
+    def _prepare_image(self, image: Union[str, bytes]) -> str:
+        """Prepare image for API request from a file path or raw bytes"""
+        return prepare_image(image)
     
     def _create_story_prompt(self, story_type: str = "story") -> str:
         """Create appropriate prompt based on story type"""
@@ -51,65 +48,54 @@ class StoryGeneratorService:
         else:
             return "Write a creative and engaging short story inspired by this image. The story should be imaginative, descriptive, and capture the mood and details you observe. Make it 3-5 paragraphs long."
     
-    async def generate_story(self, image_bytes: bytes, story_type: str = "story") -> str:
-        """Generate a story from an image"""
+    def prompt_version(self, story_type: str = "story") -> str:
+        """Fingerprint of the prompt and model used, for caching generated stories"""
+        raw = f"{settings.KOSMOS_MODEL_ID}:{self._create_story_prompt(story_type)}"
+        return hashlib.sha256(raw.encode()).hexdigest()[:16]
+    
+    def fallback_stories(self) -> List[str]:
+        """Every canned fallback text, e.g. to pre-render their narrations"""
+        return [self._get_fallback_story(story_type) for story_type in ("story", "poem")]
+    
+    def is_fallback_story(self, text: str, story_type: str = "story") -> bool:
+        """Whether the text is the canned fallback rather than a generated story"""
+        return text == self._get_fallback_story(story_type)
+    
+    async def generate_story(
+        self,
+        image: Union[str, bytes],
+        story_type: str = "story",
+        on_stage: Optional[Callable[[str], Awaitable[None]]] = None
+    ) -> str:
+        """Generate a story from an image file path or raw bytes
+        
+        on_stage is awaited with STAGE_INFERENCE once the image is prepared.
+        """
         try:
-            # Prepare image
-            image_b64 = self._prepare_image(image_bytes)
+            # Prepare image in the process pool so decoding doesn't stall the event loop
+            async with admission.stage(LIMIT_PREPROCESS):
+                image_b64 = await self.processor.prepare(image)
+            if on_stage:
+                await on_stage(STAGE_INFERENCE)
             
             # Create prompt
             prompt = self._create_story_prompt(story_type)
             
-            # Prepare payload for Kosmos-2
-            payload = {
-                "inputs": {
-                    "image": image_b64,
-                    "text": prompt
-                },
-                "parameters": {
-                    "max_new_tokens": 500,
-                    "temperature": 0.8,
-                    "do_sample": True,
-                    "top_p": 0.9
-                }
-            }
-            
-            # Make API request
-            response = requests.post(
-                self.api_url,
-                headers=self.headers,
-                json=payload,
-                timeout=30
-            )
+            async with admission.stage(LIMIT_INFERENCE):
+                generated_text = await self.backend.generate(image_b64, prompt)
             
-            if response.status_code == 200:
-                result = response.json()
-                
-                # Extract generated text
-                if isinstance(result, list) and len(result) > 0:
-                    generated_text = result[0].get("generated_text", "")
-                elif isinstance(result, dict):
-                    generated_text = result.get("generated_text", "")
-                else:
-                    generated_text = str(result)
-                
-                # Clean up the generated text
-                story = self._clean_generated_text(generated_text, prompt)
-                
-                if not story.strip():
-                    return self._get_fallback_story(story_type)
-                
-                return story
+            # Clean up the generated text
+            story = self._clean_generated_text(generated_text, prompt)
             
-            elif response.status_code == 503:
-                # Model is loading, return fallback
+            if not story.strip():
+                FALLBACK_STORIES.labels("empty_output").inc()
                 return self._get_fallback_story(story_type)
             
-            else:
-                raise Exception(f"API request failed: {response.status_code} - {response.text}")
+            return story
                 
-        except requests.exceptions.RequestException as e:
-            # Network error, return fallback
+        except GeneratorUnavailable as e:
+            # Model loading, unreachable or failed to load, return fallback
+            FALLBACK_STORIES.labels(e.reason).inc()
             return self._get_fallback_story(story_type)
         except Exception as e:
             raise Exception(f"Error generating story: {str(e)}")
@@ -0,0 +1,104 @@
+"""
+Story generation pipeline shared by the synchronous and job upload paths
+"""
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..core.storage import storage
+from ..models.story import Story
+from .story_generator import StoryGeneratorService
+from .audio_service import AudioService
+from .result_cache import ResultCache
+from .progress import StageTimer, STAGE_PREPARE, STAGE_AUDIO, STAGE_SAVE, EVENT_STORY
+from ..utils.uploads import hash_file
+
+class StoryPipeline:
+    """Runs story generation, audio narration and the database write in sequence"""
+
+    def __init__(
+        self,
+        story_service: StoryGeneratorService,
+        audio_service: AudioService,
+        result_cache: Optional[ResultCache] = None
+    ):
+        self.story_service = story_service
+        self.audio_service = audio_service
+        self.result_cache = result_cache
+
+    async def run(
+        self,
+        db: AsyncSession,
+        story_id: str,
+        image_path: str,
+        story_type: str,
+        image_filename: str,
+        on_stage: Optional[Callable[[str], Awaitable[None]]] = None,
+        on_event: Optional[Callable[[str, Dict[str, Any]], Awaitable[None]]] = None,
+        content_hash: Optional[str] = None,
+        synthesize_audio: bool = True
+    ) -> Story:
+        """Generate a story with narration for an already saved image
+        
+        With synthesize_audio=False the narration is left for the streaming
+        audio endpoint, unless a cached one can be reused. on_event receives
+        stage start/end events with timings and the story text as soon as
+        it exists, ahead of the narration.
+        """
+        timer = StageTimer(on_stage, on_event)
+
+        # Look up a previous result for the same image and prompt
+        await timer.enter(STAGE_PREPARE)
+        cache_key = None
+        cached = None
+        if self.result_cache is not None:
+            if content_hash is None:
+                # Re-reads the whole image, so keep it off the event loop
+                content_hash = await asyncio.to_thread(hash_file, image_path)
+            cache_key = self.result_cache.make_key(
+                content_hash,
+                story_type,
+                self.story_service.prompt_version(story_type)
+            )
+            cached = self.result_cache.get(cache_key)
+
+        # Generate story (the service reports when it moves on to inference)
+        if cached:
+            story_text = cached["story_text"]
+        else:
+            story_text = await self.story_service.generate_story(
+                image_path, story_type, on_stage=timer.enter
+            )
+        await timer.finish()
+        await timer.emit(EVENT_STORY, {"story_text": story_text, "cached": bool(cached)})
+
+        # Generate audio
+        await timer.enter(STAGE_AUDIO)
+        audio_filename = None
+        if cached and cached["audio_path"]:
+            audio_filename = await self.audio_service.reuse_audio_file(cached["audio_path"], story_id)
+        if audio_filename is None and synthesize_audio:
+            audio_filename = await self.audio_service.generate_audio(story_text, story_id)
+
+        # Fallback stories are a transient failure, not a result worth keeping
+        if cache_key and not self.story_service.is_fallback_story(story_text, story_type):
+            if not cached or (audio_filename and not cached["audio_path"]):
+                audio_path = await storage.fetch(audio_filename) if audio_filename else None
+                self.result_cache.put(cache_key, story_text, audio_path)
+
+        # Save to database
+        await timer.enter(STAGE_SAVE)
+        db_story = Story(
+            id=story_id,
+            story_text=story_text,
+            story_type=story_type,
+            image_filename=image_filename,
+            audio_filename=audio_filename
+        )
+        db.add(db_story)
+        await db.commit()
+        await db.refresh(db_story)
+        await timer.finish()
+
+        return db_story
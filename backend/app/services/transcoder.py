@@ -0,0 +1,103 @@
+"""
+Audio transcoding with ffmpeg and an on-disk derivative cache
+"""
+import os
+import uuid
+import shutil
+import asyncio
+from typing import Dict, Optional, Tuple
+
+from ..core.config import settings
+from ..core.storage import storage
+from ..utils.locks import KeyedLocks
+
+# Format name -> (file extension, media type, ffmpeg codec arguments)
+AUDIO_FORMATS: Dict[str, Tuple[str, str, list]] = {
+    "wav": (".wav", "audio/wav", ["-c:a", "pcm_s16le"]),
+    "opus": (".opus", "audio/ogg", ["-c:a", "libopus", "-application", "voip"]),
+    "mp3": (".mp3", "audio/mpeg", ["-c:a", "libmp3lame"]),
+}
+
+# Storage directory holding transcoded copies
+DERIVED_DIR = "derived"
+
+def audio_format_for(filename: str) -> Optional[str]:
+    """Return the format name for an audio filename, if known"""
+    extension = os.path.splitext(filename)[1].lower()
+    for name, (format_extension, _, _) in AUDIO_FORMATS.items():
+        if extension == format_extension:
+            return name
+    return None
+
+def audio_media_type(filename: str) -> str:
+    """Return the media type to serve an audio file with"""
+    audio_format = audio_format_for(filename)
+    return AUDIO_FORMATS[audio_format][1] if audio_format else "application/octet-stream"
+
+class AudioTranscoder:
+    """Converts narrations between formats, caching derivatives on disk"""
+
+    def __init__(self, ffmpeg_path: Optional[str] = None):
+        self.ffmpeg_path = ffmpeg_path or settings.FFMPEG_PATH
+        self._locks = KeyedLocks()
+
+    @property
+    def available(self) -> bool:
+        """Whether an ffmpeg binary can be found"""
+        return shutil.which(self.ffmpeg_path) is not None
+
+    async def transcode(self, source_path: str, output_path: str, audio_format: str):
+        """Transcode a file with ffmpeg, writing the output atomically"""
+        extension, _, codec_args = AUDIO_FORMATS[audio_format]
+        partial_path = f"{output_path}.{uuid.uuid4().hex}{extension}"
+
+        bitrate_args = [] if audio_format == "wav" else ["-b:a", settings.AUDIO_BITRATE]
+        process = await asyncio.create_subprocess_exec(
+            self.ffmpeg_path, "-nostdin", "-loglevel", "error", "-y",
+            "-i", source_path, "-vn", *codec_args, *bitrate_args, partial_path,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE
+        )
+        _, stderr = await process.communicate()
+
+        if process.returncode != 0 or not os.path.exists(partial_path):
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+            raise RuntimeError(f"ffmpeg failed: {stderr.decode(errors='replace').strip()}")
+
+        os.replace(partial_path, output_path)
+
+    def derived_name(self, filename: str, audio_format: str) -> str:
+        """Storage name of the cached derivative of a file in another format"""
+        stem = os.path.splitext(os.path.basename(filename))[0]
+        return f"{DERIVED_DIR}/{stem}{AUDIO_FORMATS[audio_format][0]}"
+
+    def derived_path(self, filename: str, audio_format: str) -> str:
+        """Local path of the cached derivative of a file in another format"""
+        return storage.path(self.derived_name(filename, audio_format))
+
+    async def get_derivative(self, source_path: str, audio_format: str) -> str:
+        """Return a cached derivative, transcoding it on first request"""
+        name = self.derived_name(source_path, audio_format)
+        output_path = await storage.fetch(name)
+        if output_path is not None:
+            return output_path
+        output_path = storage.path(name)
+
+        # Concurrent requests for the same derivative share a single transcode
+        async with self._locks.hold(output_path):
+            if await storage.fetch(name) is None:
+                os.makedirs(os.path.dirname(output_path), exist_ok=True)
+                await self.transcode(source_path, output_path, audio_format)
+                await storage.commit(name)
+
+        return output_path
+
+    async def delete_derivatives(self, filename: str):
+        """Remove every cached derivative of a file"""
+        await asyncio.gather(*(
+            storage.delete(self.derived_name(filename, audio_format)) for audio_format in AUDIO_FORMATS
+        ))
+
+# Shared transcoder instance
+transcoder = AudioTranscoder()
@@ -0,0 +1,369 @@
+"""
+Multi-process TTS worker pool with one model per worker
+"""
+import os
+import time
+import array
+import asyncio
+import importlib
+import threading
+import multiprocessing
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from ..core.config import settings
+from ..core.metrics import TTS_FAILURES
+
+# Request kinds understood by the workers
+KIND_FILE = "file"
+KIND_PCM = "pcm"
+
+# Voice used for every narration: the model's default speaker, in English
+TTS_SPEAKER_WAV = None
+TTS_LANGUAGE = "en"
+
+def load_tts_model(model_name: str):
+    """Load the Coqui TTS model inside a worker process"""
+    from TTS.api import TTS
+    return TTS(model_name=model_name, progress_bar=False)
+
+def resolve_model_factory(path: str) -> Callable[[str], Any]:
+    """Import a "module:function" model factory"""
+    module_name, _, attribute = path.partition(":")
+    if not module_name or not attribute:
+        raise ValueError(f"Model factory must look like 'module:function', got '{path}'")
+    return getattr(importlib.import_module(module_name), attribute)
+
+def samples_to_pcm(samples) -> bytes:
+    """Convert float samples in [-1, 1] to 16-bit PCM"""
+    return array.array("h", (int(max(-1.0, min(1.0, float(x))) * 32767) for x in samples)).tobytes()
+
+def _worker_main(worker_id: int, model_name: str, model_factory: Callable, tasks, results):
+    """Worker process: load the model once, then synthesize batches until told to stop"""
+    try:
+        tts = model_factory(model_name)
+        synthesizer = getattr(tts, "synthesizer", None)
+        sample_rate = getattr(synthesizer, "output_sample_rate", None)
+    except Exception as e:
+        results.put(("fatal", worker_id, str(e)))
+        return
+
+    results.put(("ready", worker_id, sample_rate))
+
+    while True:
+        batch = tasks.get()
+        if batch is None:
+            break
+
+        for request_id, kind, text, output_path in batch:
+            try:
+                if kind == KIND_FILE:
+                    tts.tts_to_file(
+                        text=text, file_path=output_path, speaker_wav=TTS_SPEAKER_WAV, language=TTS_LANGUAGE
+                    )
+                    payload = output_path
+                else:
+                    payload = samples_to_pcm(tts.tts(text=text, speaker_wav=TTS_SPEAKER_WAV, language=TTS_LANGUAGE))
+                results.put(("done", request_id, payload))
+            except Exception as e:
+                results.put(("error", request_id, str(e)))
+
+class _Worker:
+    """Book-keeping for one worker process"""
+
+    def __init__(self, worker_id: int):
+        self.worker_id = worker_id
+        self.process = None
+        self.tasks = None
+        self.ready = False
+        self.fatal = False
+        self.batch: List[str] = []
+        self.batch_started = 0.0
+        self.restarts = 0
+
+class TTSWorkerPool:
+    """Feeds synthesis requests to N worker processes, batching short texts together"""
+
+    def __init__(
+        self,
+        workers: Optional[int] = None,
+        model_name: Optional[str] = None,
+        model_factory: Callable[[str], Any] = load_tts_model
+    ):
+        self.size = workers if workers is not None else settings.TTS_WORKERS
+        self.model_name = model_name or settings.TTS_MODEL_NAME
+        self.model_factory = model_factory
+        self.batch_max_chars = settings.TTS_BATCH_MAX_CHARS
+        self.batch_window = settings.TTS_BATCH_WINDOW_MS / 1000
+        self.task_timeout = settings.TTS_TASK_TIMEOUT
+        self.sample_rate: Optional[int] = None
+        self.failed = False
+
+        self._context = multiprocessing.get_context("spawn")
+        self._workers: List[_Worker] = []
+        self._results = None
+        self._pending: Optional[asyncio.Queue] = None
+        self._held: deque = deque()
+        self._futures: Dict[str, asyncio.Future] = {}
+        self._requests: Dict[str, Tuple] = {}
+        self._idle: Optional[asyncio.Queue] = None
+        self._ready: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._tasks: List[asyncio.Task] = []
+        self._reader: Optional[threading.Thread] = None
+        self._counter = 0
+
+    @property
+    def running(self) -> bool:
+        """Whether the pool has been started"""
+        return bool(self._tasks)
+
+    @property
+    def ready_workers(self) -> int:
+        """Number of workers with a loaded model"""
+        return sum(1 for worker in self._workers if worker.ready)
+
+    @property
+    def depth(self) -> int:
+        """Number of requests waiting for a worker"""
+        return (self._pending.qsize() if self._pending else 0) + len(self._held)
+
+    async def start(self):
+        """Spawn the worker processes and the dispatcher"""
+        if self._tasks:
+            return
+
+        self._loop = asyncio.get_running_loop()
+        self._results = self._context.Queue()
+        self._pending = asyncio.Queue()
+        self._idle = asyncio.Queue()
+        self._ready = asyncio.Event()
+        self._workers = [_Worker(i) for i in range(self.size)]
+        for worker in self._workers:
+            self._spawn(worker)
+
+        self._reader = threading.Thread(target=self._read_results, name="tts-results", daemon=True)
+        self._reader.start()
+        self._tasks = [
+            asyncio.create_task(self._dispatch(), name="tts-dispatch"),
+            asyncio.create_task(self._monitor(), name="tts-monitor"),
+        ]
+
+    async def wait_ready(self):
+        """Wait until a worker has loaded the model, or every worker has failed to"""
+        await self._ready.wait()
+
+    async def stop(self):
+        """Stop the dispatcher and the worker processes"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+        for worker in self._workers:
+            if worker.process and worker.process.is_alive():
+                worker.tasks.put(None)
+        for worker in self._workers:
+            if worker.process:
+                worker.process.join(timeout=5)
+                if worker.process.is_alive():
+                    worker.process.terminate()
+
+        if self._results is not None:
+            # Wake the reader thread so it can exit
+            self._results.put(None)
+            self._reader.join(timeout=5)
+
+        for future in self._futures.values():
+            if not future.done():
+                future.set_exception(RuntimeError("TTS worker pool stopped"))
+        self._futures.clear()
+        self._requests.clear()
+
+    async def synthesize_to_file(self, text: str, output_path: str) -> str:
+        """Synthesize text into a WAV file written by a worker"""
+        return await self._submit(KIND_FILE, text, output_path)
+
+    async def synthesize_pcm(self, text: str) -> bytes:
+        """Synthesize text and return 16-bit mono PCM"""
+        return await self._submit(KIND_PCM, text, None)
+
+    async def _submit(self, kind: str, text: str, output_path: Optional[str]):
+        if not self._tasks or self.failed:
+            raise RuntimeError("TTS worker pool is not running")
+
+        self._counter += 1
+        request_id = f"{os.getpid()}-{self._counter}"
+        future = self._loop.create_future()
+        self._futures[request_id] = future
+        self._requests[request_id] = (request_id, kind, text, output_path)
+        self._pending.put_nowait(request_id)
+        return await future
+
+    def _spawn(self, worker: _Worker):
+        """Start (or restart) a worker process"""
+        worker.tasks = self._context.Queue()
+        worker.ready = False
+        worker.batch = []
+        worker.process = self._context.Process(
+            target=_worker_main,
+            args=(worker.worker_id, self.model_name, self.model_factory, worker.tasks, self._results),
+            name=f"tts-worker-{worker.worker_id}",
+            daemon=True
+        )
+        worker.process.start()
+
+    def _read_results(self):
+        """Blocking reader thread that hands worker results to the event loop"""
+        while True:
+            message = self._results.get()
+            if message is None:
+                break
+            try:
+                self._loop.call_soon_threadsafe(self._handle_result, message)
+            except RuntimeError:
+                # The event loop has been closed
+                break
+
+    def _handle_result(self, message: Tuple):
+        kind, key, payload = message
+
+        if kind == "ready":
+            worker = self._workers[key]
+            worker.ready = True
+            self.sample_rate = self.sample_rate or payload
+            self._idle.put_nowait(key)
+            self._ready.set()
+            return
+
+        if kind == "fatal":
+            print(f"Warning: TTS worker {key} could not load the model: {payload}")
+            TTS_FAILURES.labels("model_load").inc()
+            self._workers[key].ready = False
+            self._workers[key].fatal = True
+            if all(worker.fatal for worker in self._workers):
+                self.failed = True
+                self._fail_pending("TTS model could not be loaded")
+                self._ready.set()
+            return
+
+        # Resolve the request and free the worker once its whole batch is done
+        self._requests.pop(key, None)
+        future = self._futures.pop(key, None)
+        if future and not future.done():
+            if kind == "done":
+                future.set_result(payload)
+            else:
+                future.set_exception(RuntimeError(f"TTS synthesis failed: {payload}"))
+
+        for worker in self._workers:
+            if key in worker.batch:
+                worker.batch.remove(key)
+                if not worker.batch:
+                    self._idle.put_nowait(worker.worker_id)
+                break
+
+    def _fail_pending(self, reason: str):
+        """Fail every queued request"""
+        while self._held or not self._pending.empty():
+            request_id = self._held.popleft() if self._held else self._pending.get_nowait()
+            self._requests.pop(request_id, None)
+            future = self._futures.pop(request_id, None)
+            if future and not future.done():
+                future.set_exception(RuntimeError(reason))
+
+    async def _next_request(self, timeout: Optional[float] = None) -> str:
+        """Take the next request, preferring ones held back from a previous batch"""
+        if self._held:
+            return self._held.popleft()
+        if timeout is None:
+            return await self._pending.get()
+        return await asyncio.wait_for(self._pending.get(), timeout)
+
+    async def _dispatch(self):
+        """Assign queued requests to idle workers, grouping short texts into batches"""
+        while True:
+            worker_id = await self._idle.get()
+            worker = self._workers[worker_id]
+            if not worker.ready or worker.batch:
+                continue
+
+            batch = [await self._next_request()]
+            chars = len(self._requests[batch[0]][2]) if batch[0] in self._requests else 0
+
+            # Collect more short texts for a brief window to amortize the round trip
+            deadline = self._loop.time() + self.batch_window
+            while chars < self.batch_max_chars:
+                timeout = deadline - self._loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    request_id = await self._next_request(timeout)
+                except asyncio.TimeoutError:
+                    break
+                text_length = len(self._requests[request_id][2]) if request_id in self._requests else 0
+                if chars + text_length > self.batch_max_chars:
+                    # Too long to join this batch; it goes first in the next one
+                    self._held.appendleft(request_id)
+                    break
+                batch.append(request_id)
+                chars += text_length
+
+            batch = [request_id for request_id in batch if request_id in self._requests]
+            if not batch:
+                self._idle.put_nowait(worker_id)
+                continue
+
+            if not worker.ready or not worker.process.is_alive():
+                # The worker died while we were batching; requeue and try another
+                self._held.extendleft(reversed(batch))
+                continue
+
+            worker.batch = list(batch)
+            worker.batch_started = time.monotonic()
+            worker.tasks.put([self._requests[request_id] for request_id in batch])
+
+    async def _monitor(self):
+        """Restart crashed or stuck workers and fail the requests they held"""
+        while True:
+            await asyncio.sleep(settings.TTS_HEALTH_INTERVAL)
+            for worker in self._workers:
+                alive = worker.process.is_alive()
+                stuck = (
+                    alive and worker.batch and self.task_timeout
+                    and time.monotonic() - worker.batch_started > self.task_timeout
+                )
+                if (alive and not stuck) or worker.fatal:
+                    continue
+
+                print(f"Warning: TTS worker {worker.worker_id} {'is stuck' if stuck else 'died'}, restarting")
+                TTS_FAILURES.labels("worker_stuck" if stuck else "worker_crash").inc()
+                if stuck:
+                    worker.process.terminate()
+                    worker.process.join(timeout=5)
+
+                for request_id in worker.batch:
+                    self._requests.pop(request_id, None)
+                    future = self._futures.pop(request_id, None)
+                    if future and not future.done():
+                        future.set_exception(RuntimeError("TTS worker crashed during synthesis"))
+
+                worker.restarts += 1
+                self._spawn(worker)
+
+    def health(self) -> Dict[str, Any]:
+        """Per-worker liveness for diagnostics"""
+        return {
+            "workers": [
+                {
+                    "id": worker.worker_id,
+                    "pid": worker.process.pid if worker.process else None,
+                    "alive": bool(worker.process and worker.process.is_alive()),
+                    "ready": worker.ready,
+                    "in_flight": len(worker.batch),
+                    "restarts": worker.restarts,
+                }
+                for worker in self._workers
+            ],
+            "queued": self.depth,
+        }
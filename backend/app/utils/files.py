@@ -0,0 +1,16 @@
+"""
+File system helpers
+"""
+import os
+import shutil
+
+def link_file(source: str, destination: str):
+    """Hardlink a file, falling back to a copy across filesystems"""
+    if os.path.abspath(source) == os.path.abspath(destination):
+        return
+    if os.path.exists(destination):
+        os.remove(destination)
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copyfile(source, destination)
@@ -0,0 +1,37 @@
+"""
+Per-key asyncio locks
+"""
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Hashable, List
+
+class KeyedLocks:
+    """One asyncio lock per key, kept only while a task holds or waits for it
+
+    Each key counts its holders and waiters, and its lock is dropped when
+    the last of them leaves. A lock that is merely unlocked may still have
+    a woken waiter about to take it, so dropping it then would let a new
+    arrival take a fresh lock for the same key at the same time.
+    """
+
+    def __init__(self):
+        # key -> [lock, tasks holding or waiting]
+        self._locks: Dict[Hashable, List] = {}
+
+    def __len__(self) -> int:
+        return len(self._locks)
+
+    @asynccontextmanager
+    async def hold(self, key: Hashable) -> AsyncIterator[None]:
+        """Hold the key's lock for the duration of the block"""
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[key]
@@ -0,0 +1,23 @@
+"""
+Keyset pagination cursors
+"""
+import base64
+from datetime import datetime
+from typing import Optional, Tuple
+
+def encode_cursor(created_at: Optional[datetime], item_id: str) -> str:
+    """Encode the sort key of the last item on a page as an opaque cursor"""
+    timestamp = created_at.isoformat() if created_at else ""
+    return base64.urlsafe_b64encode(f"{timestamp}|{item_id}".encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple[Optional[datetime], str]:
+    """Decode a cursor produced by encode_cursor; raises ValueError if malformed"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        timestamp, item_id = base64.urlsafe_b64decode(padded.encode()).decode().split("|", 1)
+        created_at = datetime.fromisoformat(timestamp) if timestamp else None
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if not item_id:
+        raise ValueError("Invalid cursor")
+    return created_at, item_id
@@ -0,0 +1,138 @@
+"""
+Streaming upload ingestion helpers
+"""
+import os
+import hashlib
+import tempfile
+from typing import Callable, Dict, NamedTuple
+
+from fastapi import HTTPException, UploadFile
+from fastapi.responses import JSONResponse
+
+from ..core.config import settings
+
+# Room for the form fields and part headers around the files of a multipart body
+MULTIPART_ALLOWANCE = 64 * 1024
+
+class UploadTooLargeError(ValueError):
+    """Raised when an upload exceeds the configured size cap"""
+
+def upload_body_limit(files: int) -> int:
+    """Largest request body accepted for a multipart upload of up to `files` images"""
+    return files * settings.MAX_FILE_SIZE + MULTIPART_ALLOWANCE
+
+def _too_large(limit: int) -> HTTPException:
+    return HTTPException(
+        status_code=413,
+        detail=f"Request body too large. Maximum size: {limit / 1024 / 1024:.1f}MB"
+    )
+
+class UploadLimitMiddleware:
+    """ASGI middleware capping upload request bodies before the form is parsed
+
+    limits maps POST paths to a function returning their body limit in
+    bytes. A Content-Length over the limit gets 413 without the body being
+    read; a body sent without one is counted as it arrives and cut off
+    with 413 once it passes the limit, so an oversized upload is never
+    spooled in full.
+    """
+
+    def __init__(self, app, limits: Dict[str, Callable[[], int]]):
+        self.app = app
+        self.limits = limits
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] not in self.limits:
+            await self.app(scope, receive, send)
+            return
+
+        limit = self.limits[scope["path"]]()
+        headers = dict(scope["headers"])
+        content_length = headers.get(b"content-length", b"").decode("latin-1")
+        if content_length.isdigit() and int(content_length) > limit:
+            await self._reject(scope, receive, send, limit)
+            return
+
+        received = 0
+        started = False
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    # Raised into the form parser, so the route answers with 413
+                    raise _too_large(limit)
+            return message
+
+        async def tracking_send(message):
+            nonlocal started
+            if message["type"] == "http.response.start":
+                started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, tracking_send)
+        except HTTPException as e:
+            # Read outside a route's error handling, e.g. by another middleware
+            if e.status_code != 413 or started:
+                raise
+            await self._reject(scope, receive, send, limit)
+
+    async def _reject(self, scope, receive, send, limit: int):
+        error = _too_large(limit)
+        response = JSONResponse(status_code=error.status_code, content={"detail": error.detail})
+        await response(scope, receive, send)
+
+class SpooledUpload(NamedTuple):
+    """An upload written to disk along with its size and content hash"""
+    path: str
+    size: int
+    sha256: str
+
+async def spool_upload(
+    file: UploadFile,
+    directory: str,
+    max_size: int,
+    chunk_size: int = 1024 * 1024
+) -> SpooledUpload:
+    """Copy a parsed upload to a temp file in chunks, hashing it on the way
+
+    By now the multipart parser has already received the whole file (the
+    request body as a whole is capped by UploadLimitMiddleware before
+    parsing), so this enforces the per-file max_size on what it copies.
+    """
+    # Reject without copying when the multipart parser already knows the size
+    if file.size is not None and file.size > max_size:
+        raise UploadTooLargeError(f"Upload of {file.size} bytes exceeds {max_size} bytes")
+
+    os.makedirs(directory, exist_ok=True)
+    fd, path = tempfile.mkstemp(dir=directory, suffix=".upload")
+    digest = hashlib.sha256()
+    size = 0
+
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                chunk = await file.read(chunk_size)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_size:
+                    raise UploadTooLargeError(f"Upload exceeds {max_size} bytes")
+                digest.update(chunk)
+                out.write(chunk)
+    except BaseException:
+        os.remove(path)
+        raise
+
+    return SpooledUpload(path, size, digest.hexdigest())
+
+def hash_file(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """Compute the SHA-256 of a file without loading it into memory"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
@@ -0,0 +1,141 @@
+"""
+Benchmark image preprocessing latency and throughput
+
+Compares the original in-process preprocessing (full decode and re-encode of
+every image) with prepare_image, then measures throughput of the process
+pool at several worker counts. Also reports the cost of keeping the decode
+for the gallery derivatives, of rendering them from it afterwards, and their
+size next to the original.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_image_prep --images 32 --output results.json
+"""
+import io
+import os
+import sys
+import json
+import time
+import base64
+import argparse
+import tempfile
+import statistics
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+
+from PIL import Image
+
+from app.core.config import settings
+from app.services.image_processing import prepare_image, render_derivatives, MAX_IMAGE_SIZE
+
+# Synthetic inputs: (name, size, format)
+SAMPLES = [
+    ("photo_12mp_jpeg", (4000, 3000), "JPEG"),
+    ("photo_2mp_jpeg", (1920, 1080), "JPEG"),
+    ("small_jpeg", (800, 600), "JPEG"),
+    ("screenshot_png", (2560, 1440), "PNG"),
+]
+
+def legacy_prepare_image(path: str) -> str:
+    """The original preprocessing: always full decode, resize and re-encode"""
+    with open(path, "rb") as f:
+        image = Image.open(io.BytesIO(f.read()))
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        if max(image.size) > MAX_IMAGE_SIZE:
+            image.thumbnail((MAX_IMAGE_SIZE, MAX_IMAGE_SIZE), Image.Resampling.LANCZOS)
+        buffer = io.BytesIO()
+        image.save(buffer, format="JPEG", quality=85)
+        return base64.b64encode(buffer.getvalue()).decode()
+
+def make_sample(directory: str, name: str, size, fmt: str) -> str:
+    """Write a noisy gradient image so the encoder has realistic work to do"""
+    gradient = Image.linear_gradient("L").resize(size)
+    noise = Image.effect_noise(size, 64)
+    image = Image.merge("RGB", (gradient, noise, gradient.transpose(Image.Transpose.FLIP_LEFT_RIGHT)))
+    path = os.path.join(directory, f"{name}.{fmt.lower()}")
+    image.save(path, format=fmt, quality=92)
+    return path
+
+def time_calls(func, path: str, repeat: int) -> dict:
+    """Per-call latency statistics in milliseconds"""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(path)
+        samples.append((time.perf_counter() - start) * 1000)
+    return {
+        "mean_ms": round(statistics.mean(samples), 2),
+        "p50_ms": round(statistics.median(samples), 2),
+        "max_ms": round(max(samples), 2),
+    }
+
+def derivative_report(path: str, directory: str, repeat: int) -> dict:
+    """Latency of preparing an upload whose decode is kept for the WebP derivatives,
+    of rendering them afterwards, and their sizes"""
+    derivatives = [
+        (width, "webp", os.path.join(directory, f"derived_w{width}.webp"))
+        for width in settings.image_derivative_widths_list
+    ]
+    keep_width = max(width for width, _, _ in derivatives)
+    report = time_calls(lambda p: prepare_image(p, keep_width=keep_width), path, repeat)
+    # Rendered after each prepare, as the server does, so every render reuses a kept decode
+    render_samples = []
+    for _ in range(repeat):
+        prepare_image(path, keep_width=keep_width)
+        start = time.perf_counter()
+        render_derivatives(path, derivatives)
+        render_samples.append((time.perf_counter() - start) * 1000)
+    report["render_mean_ms"] = round(statistics.mean(render_samples), 2)
+    report["original_bytes"] = os.path.getsize(path)
+    for width, _, output_path in derivatives:
+        report[f"w{width}_bytes"] = os.path.getsize(output_path)
+    return report
+
+def pool_throughput(paths, workers: int, images: int) -> dict:
+    """Images per second for a process pool of the given size"""
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        # Warm the workers so process start-up isn't counted
+        list(pool.map(prepare_image, paths))
+        batch = [paths[i % len(paths)] for i in range(images)]
+        start = time.perf_counter()
+        list(pool.map(prepare_image, batch))
+        elapsed = time.perf_counter() - start
+    return {"workers": workers, "images": images, "images_per_sec": round(images / elapsed, 2)}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5, help="latency samples per image")
+    parser.add_argument("--images", type=int, default=32, help="images per throughput run")
+    parser.add_argument("--workers", type=str, default="", help="comma separated worker counts")
+    parser.add_argument("--output", type=str, default="", help="write JSON results to this file")
+    args = parser.parse_args()
+
+    cpu_count = os.cpu_count() or 1
+    if args.workers:
+        worker_counts = [int(w) for w in args.workers.split(",")]
+    else:
+        worker_counts = sorted({1, 2, 4, 8, cpu_count} & set(range(1, cpu_count + 1)))
+
+    results = {"cpu_count": cpu_count, "latency": {}, "throughput": []}
+    with tempfile.TemporaryDirectory() as directory:
+        paths = [make_sample(directory, name, size, fmt) for name, size, fmt in SAMPLES]
+
+        for (name, _, _), path in zip(SAMPLES, paths):
+            results["latency"][name] = {
+                "legacy": time_calls(legacy_prepare_image, path, args.repeat),
+                "prepare_image": time_calls(prepare_image, path, args.repeat),
+                "with_derivatives": derivative_report(path, directory, args.repeat),
+            }
+
+        for workers in worker_counts:
+            results["throughput"].append(pool_throughput(paths, workers, args.images))
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    print(output)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,293 @@
+"""
+Load test the API against local stand-ins for inference and TTS
+
+Starts a fake Hugging Face inference server (configurable latency and 503
+rate) and launches uvicorn with the fake TTS model, so runs are
+reproducible without network access or GPUs. Then drives these scenarios
+at the given concurrency:
+
+    upload   POST /api/upload with distinct images
+    stories  GET /api/stories
+    media    GET /api/audio/{file} and /api/images/{file}?w=512 for uploaded stories
+
+For each scenario it reports throughput, p50/p95/p99 latency and status
+codes. It also reports the peak RSS of the server process tree (workers
+included) and the git revision, so results from different versions can be
+compared.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_load --concurrency 8 --requests 200 --output results.json
+"""
+import io
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import threading
+import statistics
+import subprocess
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import httpx
+from PIL import Image
+
+from .bench_startup import free_port
+from .fakes import FakeInferenceServer
+
+SCENARIOS = ("upload", "stories", "media")
+
+def make_images(count: int, size=(1600, 1200), seed: int = 0) -> List[bytes]:
+    """Distinct noisy JPEGs, so uploads don't collapse into cache hits"""
+    rng = random.Random(seed)
+    images = []
+    for _ in range(count):
+        base = Image.effect_noise(size, 48).convert("RGB")
+        tint = Image.new("RGB", size, tuple(rng.randrange(256) for _ in range(3)))
+        buffer = io.BytesIO()
+        Image.blend(base, tint, 0.4).save(buffer, format="JPEG", quality=90)
+        images.append(buffer.getvalue())
+    return images
+
+def _process_tree(pid: int) -> List[int]:
+    """A process and all of its descendants (Linux /proc)"""
+    pids = [pid]
+    for current in pids:
+        try:
+            for task in os.listdir(f"/proc/{current}/task"):
+                with open(f"/proc/{current}/task/{task}/children") as f:
+                    pids.extend(int(child) for child in f.read().split())
+        except OSError:
+            continue
+    return pids
+
+def tree_rss(pid: int) -> Optional[int]:
+    """Resident memory of a process tree in bytes, or None where /proc is unavailable"""
+    total = 0
+    found = False
+    for member in _process_tree(pid):
+        try:
+            with open(f"/proc/{member}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1]) * 1024
+                        found = True
+                        break
+        except OSError:
+            continue
+    return total if found else None
+
+class RSSSampler:
+    """Polls the server's memory in the background and keeps the peak"""
+
+    def __init__(self, pid: int, interval: float = 0.1):
+        self.pid = pid
+        self.interval = interval
+        self.peak: Optional[int] = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            rss = tree_rss(self.pid)
+            if rss is not None:
+                self.peak = max(self.peak or 0, rss)
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+def percentile(samples: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of sorted samples"""
+    index = max(0, min(len(samples) - 1, int(round(fraction * len(samples))) - 1))
+    return samples[index]
+
+async def run_scenario(
+    request: Callable[[int], Awaitable[httpx.Response]],
+    total: int,
+    concurrency: int
+) -> Dict:
+    """Issue total requests with at most concurrency in flight"""
+    latencies: List[float] = []
+    statuses: Dict[str, int] = {}
+    counter = iter(range(total))
+
+    async def worker():
+        for index in counter:
+            start = time.perf_counter()
+            try:
+                response = await request(index)
+                status = str(response.status_code)
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            latencies.append((time.perf_counter() - start) * 1000)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "requests": total,
+        "concurrency": concurrency,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(total / elapsed, 2) if elapsed else None,
+        "latency_ms": {
+            "mean": round(statistics.mean(latencies), 2),
+            "p50": round(percentile(latencies, 0.50), 2),
+            "p95": round(percentile(latencies, 0.95), 2),
+            "p99": round(percentile(latencies, 0.99), 2),
+            "max": round(latencies[-1], 2),
+        },
+        "status": statuses,
+    }
+
+async def drive(base_url: str, args, images: List[bytes]) -> Dict:
+    """Run the selected scenarios against a ready server"""
+    results = {}
+    stories: List[Dict] = []
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.request_timeout, limits=limits) as client:
+        async def upload(index: int) -> httpx.Response:
+            response = await client.post(
+                "/api/upload",
+                files={"file": (f"bench_{index}.jpg", images[index % len(images)], "image/jpeg")},
+                data={"story_type": "story", "audio": args.audio}
+            )
+            if response.status_code == 200:
+                stories.append(response.json())
+            return response
+
+        async def list_stories(index: int) -> httpx.Response:
+            return await client.get("/api/stories", params={"limit": 20})
+
+        async def media(index: int) -> httpx.Response:
+            story = stories[index % len(stories)]
+            if index % 2 == 0 and story.get("audio_url"):
+                return await client.get(story["audio_url"])
+            return await client.get(f"/api/images/{story['image_filename']}", params={"w": 512})
+
+        scenarios = {"upload": (upload, args.uploads), "stories": (list_stories, args.requests), "media": (media, args.requests)}
+        for name in args.scenarios:
+            if name == "media" and not stories:
+                results[name] = {"skipped": "no uploaded stories to fetch media for"}
+                continue
+            request, total = scenarios[name]
+            results[name] = await run_scenario(request, total, args.concurrency)
+
+    return results
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def wait_ready(base_url: str, process: subprocess.Popen, timeout: float):
+    deadline = time.monotonic() + timeout
+    with httpx.Client(timeout=1.0) as client:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"Server exited with code {process.returncode}")
+            try:
+                if client.get(f"{base_url}/ready").status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            time.sleep(0.1)
+    raise TimeoutError("Server did not become ready")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", type=str, default=",".join(SCENARIOS), help="comma separated scenarios")
+    parser.add_argument("--concurrency", type=int, default=8, help="requests in flight")
+    parser.add_argument("--uploads", type=int, default=32, help="upload requests")
+    parser.add_argument("--requests", type=int, default=500, help="requests per read scenario")
+    parser.add_argument("--images", type=int, default=16, help="distinct upload images")
+    parser.add_argument("--audio", choices=("inline", "stream"), default="inline", help="upload audio mode")
+    parser.add_argument("--latency", type=float, default=1.0, help="fake inference mean latency (s)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fake inference 503 rate")
+    parser.add_argument("--tts-rtf", type=float, default=0.02, help="fake TTS seconds per second of audio")
+    parser.add_argument("--tts-workers", type=int, default=1)
+    parser.add_argument("--image-workers", type=int, default=2)
+    parser.add_argument("--cache", action="store_true", help="keep the result cache enabled")
+    parser.add_argument("--request-timeout", type=float, default=120.0)
+    parser.add_argument("--ready-timeout", type=float, default=120.0)
+    parser.add_argument("--output", type=str, default="", help="write JSON results to this file")
+    args = parser.parse_args()
+    args.scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    images = make_images(args.images)
+    inference = FakeInferenceServer(latency=args.latency, error_rate=args.error_rate).start()
+
+    with tempfile.TemporaryDirectory() as directory:
+        media = os.path.join(directory, "media")
+        os.makedirs(media)
+        port = free_port()
+        base_url = f"http://127.0.0.1:{port}"
+        env = {
+            **os.environ,
+            "DATABASE_URL": f"sqlite:///{os.path.join(directory, 'bench.db')}",
+            "AUDIO_OUTPUT_DIR": media,
+            "RESULT_CACHE_BACKEND": "memory" if args.cache else "none",
+            "RESULT_CACHE_DIR": os.path.join(directory, "cache"),
+            "INFERENCE_API_URL": inference.url,
+            # An empty key makes an invalid "Bearer " header; the fake server ignores it
+            "HUGGINGFACE_API_KEY": "local-benchmark",
+            "INFERENCE_BACKOFF_BASE": "0.1",
+            "INFERENCE_BACKOFF_MAX": "1.0",
+            "TTS_MODEL_FACTORY": "benchmarks.fakes:fake_tts_model",
+            "TTS_WORKERS": str(args.tts_workers),
+            "IMAGE_WORKERS": str(args.image_workers),
+            "FAKE_TTS_RTF": str(args.tts_rtf),
+        }
+        process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+            env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        try:
+            wait_ready(base_url, process, args.ready_timeout)
+            idle_rss = tree_rss(process.pid)
+            with RSSSampler(process.pid) as sampler:
+                scenarios = asyncio.run(drive(base_url, args, images))
+        finally:
+            process.terminate()
+            process.wait(timeout=30)
+            inference.stop()
+
+    megabytes = lambda value: round(value / 1024 / 1024, 1) if value is not None else None
+    results = {
+        "revision": git_revision(),
+        "config": {
+            key: getattr(args, key)
+            for key in ("concurrency", "uploads", "requests", "audio", "latency", "error_rate",
+                        "tts_rtf", "tts_workers", "image_workers", "cache")
+        },
+        "scenarios": scenarios,
+        "memory": {"idle_rss_mb": megabytes(idle_rss), "peak_rss_mb": megabytes(sampler.peak)},
+        "inference": {"requests": inference.requests, "503s": inference.errors},
+    }
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    print(output)
+
+if __name__ == "__main__":
+    sys.exit(main())
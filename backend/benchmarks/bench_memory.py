@@ -0,0 +1,200 @@
+"""
+Benchmark server memory with several workers: pre-forked vs. independently loaded
+
+Starts the app twice with the same number of workers and a stand-in TTS
+model of a given size:
+
+    naive    uvicorn --workers N; every worker imports the app and loads its own model
+    prefork  serve.py --workers N; the master loads the model once and forks the workers
+
+Once every worker is ready and has served some requests, it reports each
+process's RSS, PSS (shared pages split between the processes sharing them)
+and USS (pages only that process uses), and the total PSS of the whole
+process tree, which is the memory the server actually costs. RSS counts
+shared pages in full for every process, so it overstates prefork workers.
+Needs Linux /proc.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_memory --workers 4 --model-mb 500 --output memory.json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+from typing import Dict, List, Optional
+
+import httpx
+
+from .bench_startup import free_port
+from .bench_load import _process_tree, git_revision
+
+MODES = ("naive", "prefork")
+
+def memory_of(pid: int) -> Optional[Dict[str, int]]:
+    """RSS, PSS and USS of a process in bytes, from /proc/<pid>/smaps_rollup"""
+    fields = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 3 and parts[2] == "kB":
+                    fields[parts[0].rstrip(":")] = int(parts[1]) * 1024
+    except OSError:
+        return None
+    return {
+        "rss": fields.get("Rss", 0),
+        "pss": fields.get("Pss", 0),
+        "uss": fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0),
+    }
+
+def command_of(pid: int) -> str:
+    try:
+        with open(f"/proc/{pid}/cmdline", "rb") as f:
+            return f.read().replace(b"\0", b" ").decode(errors="replace")
+    except OSError:
+        return ""
+
+def parent_of(pid: int) -> Optional[int]:
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            # The command may contain spaces; the fields after its closing parenthesis don't
+            return int(f.read().rsplit(")", 1)[1].split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+
+def worker_pids(master: int) -> List[int]:
+    """Serving processes: the master's children other than multiprocessing's resource tracker"""
+    return [
+        pid for pid in _process_tree(master)
+        if parent_of(pid) == master and "resource_tracker" not in command_of(pid)
+    ]
+
+def wait_all_loaded(base_url: str, process: subprocess.Popen, workers: int, model_bytes: int, timeout: float):
+    """Wait until the server is ready and every worker maps the whole model
+
+    /ready only reports the worker that happened to accept the request, so
+    each worker's resident memory is checked for the model instead.
+    """
+    deadline = time.monotonic() + timeout
+    with httpx.Client(timeout=1.0) as client:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"Server exited with code {process.returncode}")
+            try:
+                ready = client.get(f"{base_url}/ready").status_code == 200
+            except httpx.TransportError:
+                ready = False
+            pids = worker_pids(process.pid)
+            if ready and len(pids) == workers and all(
+                (memory_of(pid) or {}).get("rss", 0) >= model_bytes for pid in pids
+            ):
+                return
+            time.sleep(0.1)
+    raise TimeoutError("Server did not become ready")
+
+def measure(mode: str, args) -> Dict:
+    """Launch the server in one mode and report the memory of its process tree"""
+    with tempfile.TemporaryDirectory() as directory:
+        media = os.path.join(directory, "media")
+        os.makedirs(media)
+        port = free_port()
+        base_url = f"http://127.0.0.1:{port}"
+        env = {
+            **os.environ,
+            "DATABASE_URL": f"sqlite:///{os.path.join(directory, 'bench.db')}",
+            "AUDIO_OUTPUT_DIR": media,
+            "RESULT_CACHE_BACKEND": "none",
+            "TTS_MODEL_FACTORY": "benchmarks.fakes:fake_tts_model",
+            "TTS_WORKERS": "0",
+            "TTS_PRERENDER_FALLBACKS": "false",
+            "IMAGE_WORKERS": str(args.image_workers),
+            "FAKE_TTS_MODEL_MB": str(args.model_mb),
+        }
+        if mode == "naive":
+            # Create the schema up front; workers starting together would race to create it
+            subprocess.run(
+                [sys.executable, "-c", "import app.models.story; from app.core.database import create_tables; create_tables()"],
+                env=env, check=True
+            )
+            command = [sys.executable, "-m", "uvicorn", "main:app", "--workers", str(args.workers)]
+        else:
+            command = [sys.executable, "serve.py", "--workers", str(args.workers)]
+        process = subprocess.Popen(
+            command + ["--port", str(port), "--log-level", "warning"],
+            env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        try:
+            started = time.perf_counter()
+            wait_all_loaded(base_url, process, args.workers, int(args.model_mb * 1024 * 1024), args.ready_timeout)
+            ready_s = round(time.perf_counter() - started, 2)
+
+            # Some traffic, so workers touch the pages a serving process uses
+            with httpx.Client(timeout=10.0) as client:
+                for _ in range(args.requests):
+                    client.get(f"{base_url}/api/stories", headers={"Connection": "close"})
+            time.sleep(args.settle)
+
+            workers = worker_pids(process.pid)
+            processes = []
+            for pid in _process_tree(process.pid):
+                memory = memory_of(pid)
+                if memory is None:
+                    continue
+                role = "master" if pid == process.pid else "worker" if pid in workers else "helper"
+                processes.append({"pid": pid, "role": role, **memory})
+        finally:
+            process.terminate()
+            process.wait(timeout=60)
+
+    megabytes = lambda value: round(value / 1024 / 1024, 1)
+    workers = [entry for entry in processes if entry["role"] == "worker"]
+    return {
+        "ready_s": ready_s,
+        "processes": [
+            {**entry, **{key: megabytes(entry[key]) for key in ("rss", "pss", "uss")}}
+            for entry in processes
+        ],
+        "worker_rss_mb": [megabytes(entry["rss"]) for entry in workers],
+        "worker_uss_mb": [megabytes(entry["uss"]) for entry in workers],
+        "total_rss_mb": megabytes(sum(entry["rss"] for entry in processes)),
+        "total_pss_mb": megabytes(sum(entry["pss"] for entry in processes)),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modes", type=str, default=",".join(MODES), help="comma separated modes")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--model-mb", type=float, default=500, help="size of the stand-in TTS weights")
+    parser.add_argument("--image-workers", type=int, default=0, help="image processes per worker")
+    parser.add_argument("--requests", type=int, default=50, help="requests sent before measuring")
+    parser.add_argument("--settle", type=float, default=1.0, help="seconds to wait before measuring")
+    parser.add_argument("--ready-timeout", type=float, default=300.0)
+    parser.add_argument("--output", type=str, default="", help="write JSON results to this file")
+    args = parser.parse_args()
+    modes: List[str] = [mode.strip() for mode in args.modes.split(",") if mode.strip()]
+    unknown = set(modes) - set(MODES)
+    if unknown:
+        parser.error(f"unknown modes: {', '.join(sorted(unknown))}")
+
+    results = {
+        "revision": git_revision(),
+        "config": {key: getattr(args, key) for key in ("workers", "model_mb", "image_workers", "requests")},
+        "modes": {mode: measure(mode, args) for mode in modes},
+    }
+    if "naive" in results["modes"] and "prefork" in results["modes"]:
+        naive = results["modes"]["naive"]["total_pss_mb"]
+        prefork = results["modes"]["prefork"]["total_pss_mb"]
+        results["saved_mb"] = round(naive - prefork, 1)
+        results["prefork_to_naive"] = round(prefork / naive, 3) if naive else None
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    print(output)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,124 @@
+"""
+Benchmark full-text story search on a synthetic corpus
+
+Builds a SQLite database with the stories table and its FTS5 index, fills
+it with generated stories, then compares query latency of the indexed
+search against a LIKE table scan. Index maintenance cost is reported as
+the insert rate with the sync triggers in place.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_search --stories 1000000 --output results.json
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import argparse
+import tempfile
+import statistics
+
+from sqlalchemy import create_engine, insert, text
+from sqlalchemy.orm import sessionmaker
+
+from app.core.database import Base
+from app.core.search import search_story_ids
+from app.models.story import Story
+
+WORDS = (
+    "dragon forest river castle knight moon lantern garden ocean whisper meadow "
+    "storm harbor shadow golden silver ancient journey village mountain quiet "
+    "child mother winter summer bridge tower song dream wolf fox owl ember "
+    "crystal valley sailor market festival letter secret mirror clockwork"
+).split()
+
+# Rare terms appear in about one story in RARE_RATE, like names and places do
+RARE_WORDS = [f"zephyr{i}" for i in range(1000)]
+RARE_RATE = 100
+
+QUERIES = {
+    "common": ["dragon", "golden castle", "quiet winter harbor", "clockwork owl"],
+    "rare": ["zephyr7", "zephyr42 dragon", "zephyr512", "zephyr999 castle"],
+}
+
+def build_corpus(session_factory, count: int, batch_size: int, seed: int) -> float:
+    """Insert synthetic stories and return the insert rate (stories/s)"""
+    rng = random.Random(seed)
+    start = time.perf_counter()
+    with session_factory() as db:
+        for offset in range(0, count, batch_size):
+            rows = []
+            for i in range(min(batch_size, count - offset)):
+                words = rng.choices(WORDS, k=rng.randint(60, 160))
+                if rng.randrange(RARE_RATE) == 0:
+                    words.insert(rng.randrange(len(words)), rng.choice(RARE_WORDS))
+                rows.append({
+                    "id": str(uuid.uuid4()),
+                    "story_text": " ".join(words).capitalize() + ".",
+                    "story_type": "story",
+                    "image_filename": f"{offset + i}.jpg",
+                })
+            db.execute(insert(Story), rows)
+            db.commit()
+    return count / (time.perf_counter() - start)
+
+def time_queries(fn, queries, repeat: int) -> dict:
+    """Latency percentiles (ms) of a search function over a query set"""
+    samples = []
+    for _ in range(repeat):
+        for query in queries:
+            start = time.perf_counter()
+            fn(query)
+            samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return {
+        "p50_ms": round(statistics.median(samples), 2),
+        "p95_ms": round(samples[int(len(samples) * 0.95) - 1], 2),
+        "max_ms": round(samples[-1], 2),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--stories", type=int, default=1_000_000, help="synthetic corpus size")
+    parser.add_argument("--batch-size", type=int, default=5000, help="stories per insert batch")
+    parser.add_argument("--repeat", type=int, default=5, help="passes over the query set")
+    parser.add_argument("--limit", type=int, default=20, help="results per search")
+    parser.add_argument("--skip-scan", action="store_true", help="skip the LIKE scan baseline")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=str, default="", help="write JSON results to this file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_engine(f"sqlite:///{os.path.join(directory, 'bench.db')}")
+        Base.metadata.create_all(bind=engine)
+        session_factory = sessionmaker(bind=engine)
+
+        insert_rate = build_corpus(session_factory, args.stories, args.batch_size, args.seed)
+
+        with session_factory() as db:
+            # Every term must appear, matching the FTS semantics
+            def scan(query):
+                terms = query.split()
+                where = " AND ".join(f"story_text LIKE :t{i}" for i in range(len(terms)))
+                params = {f"t{i}": f"%{term}%" for i, term in enumerate(terms)}
+                db.execute(text(f"SELECT id FROM stories WHERE {where} LIMIT {args.limit}"), params).all()
+
+            results = {"stories": args.stories, "insert_rate_per_s": round(insert_rate)}
+            for name, queries in QUERIES.items():
+                results[name] = {
+                    "fts": time_queries(lambda q: search_story_ids(db, q, args.limit, 0), queries, args.repeat),
+                }
+                if not args.skip_scan:
+                    results[name]["like_scan"] = time_queries(scan, queries, args.repeat)
+
+        engine.dispose()
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    print(output)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,91 @@
+"""
+Benchmark application startup time
+
+Measures how long importing the app takes in a fresh interpreter, then
+launches uvicorn and records the time until /health answers (the server
+accepts traffic) and until /ready reports every component loaded, along
+with the per-component load timings from /ready.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_startup --repeat 5 --output results.json
+"""
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import statistics
+import subprocess
+
+import httpx
+
+IMPORT_SNIPPET = "import time; t = time.perf_counter(); import main; print(time.perf_counter() - t)"
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def time_import(repeat: int) -> dict:
+    """Seconds to import the application module"""
+    samples = []
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, "-c", IMPORT_SNIPPET],
+            capture_output=True, text=True, check=True
+        ).stdout.strip().splitlines()[-1]
+        samples.append(float(output))
+    return {"mean_s": round(statistics.mean(samples), 3), "min_s": round(min(samples), 3)}
+
+def time_server(timeout: float) -> dict:
+    """Seconds from launching uvicorn until /health and /ready succeed"""
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    result = {"healthy_s": None, "ready_s": None, "components": None}
+    try:
+        with httpx.Client(timeout=1.0) as client:
+            while time.perf_counter() - start < timeout:
+                try:
+                    if result["healthy_s"] is None and client.get(f"{base_url}/health").status_code == 200:
+                        result["healthy_s"] = round(time.perf_counter() - start, 3)
+                    if result["healthy_s"] is not None:
+                        response = client.get(f"{base_url}/ready")
+                        if response.status_code == 200:
+                            result["ready_s"] = round(time.perf_counter() - start, 3)
+                            result["components"] = response.json()["components"]
+                            break
+                except httpx.TransportError:
+                    pass
+                time.sleep(0.02)
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5, help="import timing samples")
+    parser.add_argument("--timeout", type=float, default=600, help="seconds to wait for /ready")
+    parser.add_argument("--output", type=str, default="", help="write JSON results to this file")
+    args = parser.parse_args()
+
+    results = {
+        "tts_workers": os.environ.get("TTS_WORKERS"),
+        "import": time_import(args.repeat),
+        "server": time_server(args.timeout),
+    }
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    print(output)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,197 @@
+"""
+Local stand-ins for the Hugging Face inference API and the TTS model
+
+FakeInferenceServer answers Kosmos-2 style requests after a configurable
+latency and fails a configurable share of them with 503 "model loading".
+Faults can be injected while it runs: a status every request fails with,
+extra seconds every request stalls for, or dropped connections.
+fake_tts_model is a TTS_MODEL_FACTORY that writes WAVs of realistic size
+(24kHz 16-bit mono at a normal speaking rate), optionally taking time
+proportional to the audio length. It is configured through environment
+variables so it also works inside spawned TTS worker processes:
+
+    FAKE_TTS_RTF          seconds of work per second of audio (default 0)
+    FAKE_TTS_WORDS_PER_S  speaking rate used to size the audio (default 2.5)
+    FAKE_TTS_MODEL_MB     size of the stand-in weights held in memory (default 0)
+"""
+import os
+import json
+import math
+import socket
+import time
+import array
+import random
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+FAKE_SAMPLE_RATE = 24000
+
+STORY_SENTENCES = [
+    "The old lighthouse keeper climbed the spiral stairs one last time.",
+    "Below, the harbor glittered with the lanterns of returning boats.",
+    "A gull settled on the railing and watched him with a patient eye.",
+    "He remembered the storm that had taught him to trust the light.",
+    "Tonight the sea was calm, and the beam swept slowly over the water.",
+    "Somewhere a child pressed her face to a window and counted the flashes.",
+    "When morning came, the keeper left a note for whoever came next.",
+    "It said only that the light was worth keeping, and that was enough.",
+]
+
+def fake_story(words: int = 150, rng: Optional[random.Random] = None) -> str:
+    """Story text of roughly the given length"""
+    rng = rng or random
+    sentences = []
+    while sum(len(sentence.split()) for sentence in sentences) < words:
+        sentences.append(rng.choice(STORY_SENTENCES))
+    return " ".join(sentences)
+
+class _InferenceHandler(BaseHTTPRequestHandler):
+    server: "FakeInferenceServer"
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        server = self.server
+
+        delay = max(0.0, random.gauss(server.latency, server.latency * server.jitter))
+        time.sleep(delay + server.stall)
+
+        with server.lock:
+            server.requests += 1
+            fail_status, drop = server.fail_status, server.drop
+
+        if drop:
+            # Close without a response, like a reset connection
+            self.close_connection = True
+            self.connection.shutdown(socket.SHUT_RDWR)
+            return
+        if fail_status:
+            self._reply(fail_status, {"error": "Injected fault"})
+            return
+
+        with server.lock:
+            loading = random.random() < server.error_rate
+            if loading:
+                server.errors += 1
+
+        if loading:
+            payload = {"error": "Model is currently loading", "estimated_time": server.estimated_time}
+            self._reply(503, payload)
+            return
+
+        prompt = body.get("inputs", {}).get("text", "")
+        self._reply(200, [{"generated_text": f"{prompt} {fake_story(server.words)}"}])
+
+    def _reply(self, status: int, payload):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+class FakeInferenceServer(ThreadingHTTPServer):
+    """Threaded HTTP server mimicking the hosted Kosmos-2 endpoint"""
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        port: int = 0,
+        latency: float = 1.0,
+        jitter: float = 0.2,
+        error_rate: float = 0.0,
+        estimated_time: float = 0.5,
+        words: int = 150
+    ):
+        super().__init__(("127.0.0.1", port), _InferenceHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.estimated_time = estimated_time
+        self.words = words
+        # Injected faults, changed freely while the server runs
+        self.fail_status = 0
+        self.stall = 0.0
+        self.drop = False
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/models/fake-kosmos"
+
+    def start(self) -> "FakeInferenceServer":
+        self._thread = threading.Thread(target=self.serve_forever, name="fake-inference", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+class _Synthesizer:
+    output_sample_rate = FAKE_SAMPLE_RATE
+
+class FakeTTSModel:
+    """Mimics the parts of the Coqui TTS API the app uses"""
+
+    def __init__(self):
+        self.synthesizer = _Synthesizer()
+        self.real_time_factor = float(os.environ.get("FAKE_TTS_RTF", "0"))
+        self.words_per_second = float(os.environ.get("FAKE_TTS_WORDS_PER_S", "2.5"))
+        # Stand-in weights, so memory benchmarks see a model-sized allocation
+        self.weights = b"\x01" * int(float(os.environ.get("FAKE_TTS_MODEL_MB", "0")) * 1024 * 1024)
+
+    def _frames(self, text: str) -> int:
+        seconds = max(0.5, len(text.split()) / self.words_per_second)
+        time.sleep(seconds * self.real_time_factor)
+        return int(seconds * FAKE_SAMPLE_RATE)
+
+    def _pcm(self, frames: int) -> bytes:
+        # A quiet 220Hz tone; one period repeated to keep generation cheap
+        period = array.array("h", (
+            int(3000 * math.sin(2 * math.pi * 220 * i / FAKE_SAMPLE_RATE))
+            for i in range(FAKE_SAMPLE_RATE // 220)
+        )).tobytes()
+        data = period * (frames * 2 // len(period) + 1)
+        return data[:frames * 2]
+
+    def tts_to_file(self, text: str, file_path: str, **kwargs):
+        import wave
+
+        pcm = self._pcm(self._frames(text))
+        with wave.open(file_path, "wb") as output:
+            output.setnchannels(1)
+            output.setsampwidth(2)
+            output.setframerate(FAKE_SAMPLE_RATE)
+            output.writeframes(pcm)
+        return file_path
+
+    def tts(self, text: str, **kwargs):
+        pcm = array.array("h")
+        pcm.frombytes(self._pcm(self._frames(text)))
+        return [sample / 32767 for sample in pcm]
+
+def fake_tts_model(model_name: str) -> FakeTTSModel:
+    """TTS_MODEL_FACTORY entry point: benchmarks.fakes:fake_tts_model"""
+    return FakeTTSModel()
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run the fake inference server on its own")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=1.0, help="mean seconds per request")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered with 503")
+    args = parser.parse_args()
+
+    server = FakeInferenceServer(args.port, latency=args.latency, error_rate=args.error_rate)
+    print(f"Fake inference server at {server.url}")
+    server.serve_forever()
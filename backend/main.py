@@ -2,41 +2,104 @@
 StoryLens Backend - Main FastAPI Application
 """
 import os
+import asyncio
 from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from fastapi.responses import JSONResponse, ORJSONResponse, RedirectResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
 from dotenv import load_dotenv
 
 from app.core.config import settings
-from app.core.database import create_tables
-from app.api.routes import router
+from app.core.database import create_tables, create_async_tables, async_engine
+from app.core.readiness import readiness
+from app.core.admission import AdmissionMiddleware, admission
+from app.core.metrics import (
+    CONTENT_TYPE, QUEUE_DEPTH, INFERENCE_BREAKER_STATE, InFlightMiddleware,
+    render as render_metrics, refresh_gauges, set_gauge_function
+)
+from app.api.routes import router, job_queue, audio_service, story_service, pipeline
+from app.services.inference_client import inference_client
+from app.services.result_cache import create_result_cache
+from app.services.circuit_breaker import CLOSED, HALF_OPEN, OPEN
+from app.services.image_processing import image_processor
+from app.utils.uploads import UploadLimitMiddleware, upload_body_limit
 
 # Load environment variables
 load_dotenv()
 
+async def warm_up_audio():
+    """Load TTS, then narrate the fallback stories so outages don't keep the workers busy"""
+    await audio_service.warm_up()
+    if settings.TTS_PRERENDER_FALLBACKS:
+        await audio_service.prerender(story_service.fallback_stories())
+
+async def warm_up_models():
+    """Load models in the background so startup isn't blocked on them"""
+    results = await asyncio.gather(
+        warm_up_audio(),
+        image_processor.warm_up(),
+        story_service.warm_up(),
+        return_exceptions=True
+    )
+    for result in results:
+        if isinstance(result, Exception):
+            print(f"Warning: Model warm-up failed: {result}")
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Application lifespan events"""
     # Startup
-    create_tables()
+    readiness.register("database")
+    with readiness.track("database"):
+        if settings.DB_CREATE_SCHEMA:
+            create_tables()
+            await create_async_tables()
     
     # Ensure audio directory exists
     os.makedirs(settings.AUDIO_OUTPUT_DIR, exist_ok=True)
     
+    # Open the result cache in the serving process
+    pipeline.result_cache = create_result_cache()
+    
+    # Start background job workers and warm models without blocking startup
+    await job_queue.start()
+    warm_up = asyncio.create_task(warm_up_models())
+    gauges = asyncio.create_task(refresh_gauges())
+    
     yield
     
     # Shutdown
-    pass
+    warm_up.cancel()
+    gauges.cancel()
+    await job_queue.stop()
+    if pipeline.result_cache is not None:
+        pipeline.result_cache.close()
+        pipeline.result_cache = None
+    await audio_service.stop()
+    await story_service.stop()
+    await inference_client.aclose()
+    image_processor.shutdown()
+    await async_engine.dispose()
 
 # Create FastAPI application
 app = FastAPI(
     title="StoryLens API",
     description="Multi-modal Photo Story Generator API",
     version="1.0.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
+# Queue story generation requests before their uploads are read, rejecting with 429
+# when the queue is full (added first so CORS headers still reach rejected clients)
+app.add_middleware(AdmissionMiddleware, paths=("/api/upload", "/api/upload/batch"))
+
+# Refuse oversized upload bodies with 413 before they are queued or parsed
+app.add_middleware(UploadLimitMiddleware, limits={
+    "/api/upload": lambda: upload_body_limit(1),
+    "/api/upload/batch": lambda: upload_body_limit(settings.BATCH_MAX_FILES),
+})
+
 # Configure CORS
 app.add_middleware(
     CORSMiddleware,
@@ -44,10 +107,28 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "Retry-After"],
 )
 
-# Mount static files for audio
-app.mount("/audio", StaticFiles(directory=settings.AUDIO_OUTPUT_DIR), name="audio")
+# Count requests in flight for /metrics
+app.add_middleware(InFlightMiddleware)
+
+# Queue gauges are read when /metrics is scraped, so they cost nothing in between
+set_gauge_function(QUEUE_DEPTH.labels("image_workers"), lambda: image_processor.pending)
+set_gauge_function(
+    QUEUE_DEPTH.labels("tts_workers"),
+    lambda: audio_service.pool.depth if audio_service.pool is not None else 0
+)
+set_gauge_function(QUEUE_DEPTH.labels("jobs"), lambda: job_queue.depth)
+set_gauge_function(QUEUE_DEPTH.labels("inference"), lambda: story_service.backend.depth)
+set_gauge_function(QUEUE_DEPTH.labels("admission"), lambda: admission.requests.waiting)
+for stage_name, stage_limit in admission.stages.items():
+    set_gauge_function(QUEUE_DEPTH.labels(f"stage_{stage_name}"), lambda limit=stage_limit: limit.waiting)
+
+breaker = getattr(story_service.backend, "breaker", None)
+if breaker is not None:
+    for state in (CLOSED, HALF_OPEN, OPEN):
+        set_gauge_function(INFERENCE_BREAKER_STATE.labels(state), lambda state=state: breaker.state == state)
 
 # Include API routes
 app.include_router(router, prefix="/api")
@@ -62,6 +143,22 @@ async def health_check():
     """Health check endpoint"""
     return {"status": "healthy"}
 
+@app.get("/audio/{filename}", include_in_schema=False)
+async def legacy_audio(filename: str):
+    """Old static audio URLs; the API route adds caching headers and Range support"""
+    return RedirectResponse(f"/api/audio/{filename}", status_code=301)
+
+@app.get("/ready")
+async def readiness_check():
+    """Readiness endpoint reporting per-component load state and timings"""
+    snapshot = readiness.snapshot()
+    return JSONResponse(status_code=200 if snapshot["ready"] else 503, content=snapshot)
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics"""
+    return Response(content=render_metrics(), media_type=CONTENT_TYPE)
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(
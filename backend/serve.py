@@ -0,0 +1,225 @@
+"""
+StoryLens Backend - production server with pre-forked workers
+
+The master process imports the app and loads the in-process models once,
+then forks worker processes that all serve the same listening socket. The
+model weights are shared copy-on-write instead of being loaded by every
+worker, and gc.freeze() keeps the garbage collector from writing to (and
+so copying) the pages of everything loaded before the fork. Workers that
+exit, e.g. after SERVER_MAX_REQUESTS requests, are replaced.
+
+Usage (from the backend directory):
+    python serve.py --workers 4 --max-requests 1000 --max-requests-jitter 100
+"""
+import os
+import gc
+import sys
+import time
+import random
+import glob
+import shutil
+import signal
+import socket
+import argparse
+import tempfile
+import traceback
+from typing import Dict, Optional
+
+import uvicorn
+
+from app.core.config import settings
+
+# Workers exiting sooner than this after starting are restarted with a delay
+MIN_WORKER_UPTIME = 1.0
+
+def prepare_metrics_dir() -> bool:
+    """Point prometheus_client at a directory shared by the workers, before the app imports it
+
+    Returns whether the directory was created here and should be removed
+    on exit. Files from a previous run in a given directory are cleared.
+    """
+    directory = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+        for path in glob.glob(os.path.join(directory, "*.db")):
+            os.remove(path)
+        return False
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = tempfile.mkdtemp(prefix="storylens-metrics-")
+    return True
+
+def load_app(preload: bool):
+    """Import the app in the master, loading the models when preloading"""
+    if preload and settings.TTS_WORKERS > 0:
+        # A TTS worker pool per served process would load one model copy each
+        print(f"Note: the prefork server shares one in-process TTS model; ignoring TTS_WORKERS={settings.TTS_WORKERS}")
+        settings.TTS_WORKERS = 0
+
+    import main
+    from app.core.database import create_tables, engine
+
+    # Create the schema once, rather than racing from every worker, and
+    # close the connections so no worker inherits them
+    create_tables()
+    engine.dispose()
+    settings.DB_CREATE_SCHEMA = False
+
+    if preload:
+        main.audio_service.preload()
+        main.story_service.preload()
+    return main
+
+class Master:
+    """Forks the workers, replaces those that exit and stops them all on SIGTERM or SIGINT"""
+
+    def __init__(
+        self,
+        main_module,
+        sock: socket.socket,
+        workers: int,
+        max_requests: int = 0,
+        max_requests_jitter: int = 0,
+        graceful_timeout: float = 30.0,
+        log_level: str = "info"
+    ):
+        self.main = main_module
+        self.sock = sock
+        self.workers = max(1, workers)
+        self.max_requests = max_requests
+        self.max_requests_jitter = max(0, max_requests_jitter)
+        self.graceful_timeout = graceful_timeout
+        self.log_level = log_level
+        self.children: Dict[int, int] = {}
+        self.started: Dict[int, float] = {}
+        self.stopping = False
+
+    def spawn(self, index: int):
+        """Fork worker number index"""
+        max_requests: Optional[int] = None
+        if self.max_requests > 0:
+            max_requests = self.max_requests + random.randint(0, self.max_requests_jitter)
+
+        pid = os.fork()
+        if pid == 0:
+            try:
+                self.run_worker(max_requests)
+            except Exception:
+                traceback.print_exc()
+                os._exit(1)
+            # A normal interpreter exit, so the worker's executors are cleaned up at exit
+            sys.exit(0)
+
+        self.children[pid] = index
+        self.started[index] = time.monotonic()
+
+    def run_worker(self, max_requests: Optional[int]):
+        """Serve requests in a forked worker until stopped or max_requests is reached"""
+        for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGALRM):
+            signal.signal(signum, signal.SIG_DFL)
+        random.seed()
+
+        config = uvicorn.Config(
+            self.main.app,
+            log_level=self.log_level,
+            limit_max_requests=max_requests,
+            timeout_graceful_shutdown=int(self.graceful_timeout)
+        )
+        uvicorn.Server(config).run(sockets=[self.sock])
+
+    def stop(self, signum, frame):
+        """Ask every worker to finish its requests and exit, then stop waiting after the timeout"""
+        if self.stopping:
+            return
+        self.stopping = True
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        signal.alarm(max(1, int(self.graceful_timeout) + 5))
+
+    def kill(self, signum, frame):
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+
+    def run(self):
+        # Imported once prepare_metrics_dir() has configured prometheus_client
+        from app.core.metrics import mark_worker_dead
+
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGALRM, self.kill)
+
+        for index in range(self.workers):
+            self.spawn(index)
+
+        while self.children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            index = self.children.pop(pid, None)
+            if index is None:
+                continue
+            mark_worker_dead(pid)
+            if self.stopping:
+                continue
+
+            code = os.waitstatus_to_exitcode(status)
+            print(f"Worker {index} (pid {pid}) exited with code {code}, starting a replacement")
+            if time.monotonic() - self.started[index] < MIN_WORKER_UPTIME:
+                # Don't spin if workers die as soon as they start
+                time.sleep(MIN_WORKER_UPTIME)
+            if not self.stopping:
+                self.spawn(index)
+
+def bind(host: str, port: int) -> socket.socket:
+    """Listening socket shared by every worker"""
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default=settings.SERVER_HOST)
+    parser.add_argument("--port", type=int, default=settings.SERVER_PORT)
+    parser.add_argument("--workers", type=int, default=settings.SERVER_WORKERS)
+    parser.add_argument("--max-requests", type=int, default=settings.SERVER_MAX_REQUESTS,
+                        help="requests before a worker is replaced, 0 never")
+    parser.add_argument("--max-requests-jitter", type=int, default=settings.SERVER_MAX_REQUESTS_JITTER)
+    parser.add_argument("--graceful-timeout", type=float, default=settings.SERVER_GRACEFUL_TIMEOUT)
+    parser.add_argument("--no-preload", dest="preload", action="store_false", default=settings.SERVER_PRELOAD,
+                        help="let each worker load its own models")
+    parser.add_argument("--log-level", default=settings.LOG_LEVEL.lower())
+    args = parser.parse_args()
+
+    sock = bind(args.host, args.port)
+    remove_metrics_dir = prepare_metrics_dir()
+    main_module = load_app(args.preload)
+
+    # Everything allocated so far is never freed; keep the collector off those pages
+    gc.collect()
+    gc.freeze()
+
+    print(f"Serving on {args.host}:{args.port} with {args.workers} workers (master pid {os.getpid()})")
+    Master(
+        main_module,
+        sock,
+        args.workers,
+        args.max_requests,
+        args.max_requests_jitter,
+        args.graceful_timeout,
+        args.log_level
+    ).run()
+    sock.close()
+    if remove_metrics_dir:
+        shutil.rmtree(os.environ["PROMETHEUS_MULTIPROC_DIR"], ignore_errors=True)
+
+if __name__ == "__main__":
+    sys.exit(main())
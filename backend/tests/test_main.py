@@ -2,28 +2,47 @@
 Tests for the main FastAPI application
 """
 import pytest
+from fastapi.responses import StreamingResponse
 from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
 import tempfile
+import time
+import threading
+import io
+import json
+import hashlib
+import uuid
+import asyncio
+import wave
 import os
+from datetime import datetime
+from types import SimpleNamespace
+from PIL import Image
 
-from app.core.database import Base, get_db
+from app.core.database import Base, get_db, get_session_factory
+from app.api import routes
+from app.services import story_pipeline
+from app.core.storage import storage
+from app.core.search import SearchUnsupported
+from app.models.story import Story
+from app.models.job import Job
 from main import app
 
 # Create test database
 SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
 engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+async_engine = create_async_engine("sqlite+aiosqlite:///./test.db")
+TestingAsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
 
-def override_get_db():
-    try:
-        db = TestingSessionLocal()
+async def override_get_db():
+    async with TestingAsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
 app.dependency_overrides[get_db] = override_get_db
+app.dependency_overrides[get_session_factory] = lambda: TestingAsyncSessionLocal
 
 @pytest.fixture(scope="module")
 def client():
@@ -75,4 +94,613 @@ def test_upload_invalid_file_type(client):
         os.unlink(tmp.name)
     
     assert response.status_code == 400
-    assert "File must be an image" in response.json()["detail"] 
\ No newline at end of file
+    assert "File must be an image" in response.json()["detail"] 
+
+
+def _make_image_bytes():
+    """Create a small in-memory JPEG"""
+    buffer = io.BytesIO()
+    Image.new("RGB", (64, 64), color=(120, 80, 200)).save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+def test_upload_invalid_mode(client):
+    """Test upload with an unknown processing mode"""
+    response = client.post(
+        "/api/upload",
+        files={"file": ("photo.jpg", _make_image_bytes(), "image/jpeg")},
+        data={"story_type": "story", "mode": "later"}
+    )
+    assert response.status_code == 400
+    assert "Invalid mode" in response.json()["detail"]
+
+def test_upload_job_mode(client, monkeypatch):
+    """Test that job mode returns 202 and the job completes in the background"""
+    async def fake_generate_story(image, story_type="story", on_stage=None):
+        return "A quiet purple square."
+
+    def rehash(path):
+        raise AssertionError("the hash taken while spooling the upload should be reused")
+
+    monkeypatch.setattr(routes.story_service, "generate_story", fake_generate_story)
+    monkeypatch.setattr(routes.job_queue, "session_factory", TestingAsyncSessionLocal)
+    monkeypatch.setattr(story_pipeline, "hash_file", rehash)
+
+    response = client.post(
+        "/api/upload",
+        files={"file": ("photo.jpg", _make_image_bytes(), "image/jpeg")},
+        data={"story_type": "story", "mode": "job"}
+    )
+    assert response.status_code == 202
+    job = response.json()
+    assert job["status"] == "queued"
+    with TestingSessionLocal() as db:
+        assert db.get(Job, job["id"]).content_hash == hashlib.sha256(_make_image_bytes()).hexdigest()
+    assert response.headers["location"] == f"/api/jobs/{job['id']}"
+
+    for _ in range(50):
+        job = client.get(f"/api/jobs/{job['id']}").json()
+        if job["status"] in ("completed", "failed"):
+            break
+        time.sleep(0.05)
+
+    assert job["status"] == "completed"
+    assert job["story"]["id"] == job["story_id"]
+    assert job["story"]["story_text"] == "A quiet purple square."
+
+def test_failed_job_removes_upload(client, monkeypatch):
+    """Test that a job failing in the background deletes its uploaded image"""
+    async def failing_generate_story(image, story_type="story", on_stage=None):
+        raise RuntimeError("model unavailable")
+
+    monkeypatch.setattr(routes.story_service, "generate_story", failing_generate_story)
+    monkeypatch.setattr(routes.job_queue, "session_factory", TestingAsyncSessionLocal)
+
+    # Different bytes, so no cached story from another test is reused
+    response = client.post(
+        "/api/upload",
+        files={"file": ("photo.jpg", _make_image_bytes() + b"failing-job", "image/jpeg")},
+        data={"story_type": "story", "mode": "job"}
+    )
+    assert response.status_code == 202
+    job = response.json()
+
+    for _ in range(50):
+        job = client.get(f"/api/jobs/{job['id']}").json()
+        if job["status"] in ("completed", "failed"):
+            break
+        time.sleep(0.05)
+
+    assert job["status"] == "failed"
+    with TestingSessionLocal() as db:
+        image_filename = db.get(Job, job["id"]).image_filename
+    # Deleted right after the failure is recorded
+    for _ in range(50):
+        if not os.path.exists(storage.path(image_filename)):
+            break
+        time.sleep(0.05)
+    assert not os.path.exists(storage.path(image_filename))
+
+def test_get_job_not_found(client):
+    """Test getting a job that does not exist"""
+    response = client.get("/api/jobs/does-not-exist")
+    assert response.status_code == 404
+
+def test_upload_repeated_image_uses_cache(client, monkeypatch):
+    """Test that re-uploading the same image skips inference"""
+    calls = []
+
+    async def fake_generate_story(image, story_type="story", on_stage=None):
+        calls.append(story_type)
+        return "A lighthouse keeps its watch."
+
+    monkeypatch.setattr(routes.story_service, "generate_story", fake_generate_story)
+    image_bytes = _make_image_bytes() + b"cache-test"
+
+    stories = []
+    for _ in range(2):
+        response = client.post(
+            "/api/upload",
+            files={"file": ("photo.jpg", image_bytes, "image/jpeg")},
+            data={"story_type": "poem"}
+        )
+        assert response.status_code == 200
+        stories.append(response.json())
+
+    assert len(calls) == 1
+    assert stories[0]["id"] != stories[1]["id"]
+    assert stories[1]["story_text"] == "A lighthouse keeps its watch."
+
+    stats = client.get("/api/cache/stats").json()
+    assert stats["enabled"] is True
+    assert stats["hits"] >= 1
+
+def test_upload_too_large(client, monkeypatch):
+    """Test that oversized uploads are rejected without leaving temp files"""
+    monkeypatch.setattr(routes.settings, "MAX_FILE_SIZE", 100)
+    monkeypatch.setattr(routes.settings, "UPLOAD_CHUNK_SIZE", 32)
+
+    response = client.post(
+        "/api/upload",
+        files={"file": ("photo.jpg", _make_image_bytes(), "image/jpeg")},
+        data={"story_type": "story"}
+    )
+    assert response.status_code == 400
+    assert "File too large" in response.json()["detail"]
+    leftovers = [name for name in os.listdir(routes.settings.AUDIO_OUTPUT_DIR) if name.endswith(".upload")]
+    assert leftovers == []
+
+def test_upload_body_over_limit_rejected_before_parsing(client, monkeypatch):
+    """Test that oversized upload bodies get 413, with or without a Content-Length"""
+    monkeypatch.setattr(routes.settings, "MAX_FILE_SIZE", 1024)
+    boundary = "limit-test"
+    body = (
+        f"--{boundary}\r\n"
+        'Content-Disposition: form-data; name="file"; filename="photo.jpg"\r\n'
+        "Content-Type: image/jpeg\r\n\r\n"
+    ).encode() + b"\0" * (200 * 1024) + f"\r\n--{boundary}--\r\n".encode()
+    headers = {"Content-Type": f"multipart/form-data; boundary={boundary}"}
+
+    response = client.post("/api/upload", content=body, headers=headers)
+    assert response.status_code == 413
+    assert "too large" in response.json()["detail"]
+
+    def chunks():
+        for start in range(0, len(body), 16 * 1024):
+            yield body[start:start + 16 * 1024]
+
+    # Without a Content-Length the body is cut off once it passes the limit
+    response = client.post("/api/upload", content=chunks(), headers=headers)
+    assert response.status_code == 413
+    assert "too large" in response.json()["detail"]
+
+class FakeTTS:
+    """Stand-in for the XTTS model that returns a short tone per call"""
+
+    def __init__(self):
+        self.calls = []
+
+    def tts(self, text, speaker_wav=None, language="en"):
+        self.calls.append(text)
+        return [0.5, -0.5] * 100
+
+def test_stream_story_audio(client, monkeypatch, tmp_path):
+    """Test sentence-chunked audio streaming and final file assembly"""
+    # Narrations are cached in storage, so start from an empty one
+    monkeypatch.setattr(routes.settings, "AUDIO_OUTPUT_DIR", str(tmp_path))
+
+    async def fake_generate_story(image, story_type="story", on_stage=None):
+        return "The sun rose. Birds sang loudly! Was it morning?"
+
+    monkeypatch.setattr(routes.story_service, "generate_story", fake_generate_story)
+    monkeypatch.setattr(routes.pipeline, "result_cache", None)
+
+    response = client.post(
+        "/api/upload",
+        files={"file": ("photo.jpg", _make_image_bytes(), "image/jpeg")},
+        data={"story_type": "story", "audio": "stream"}
+    )
+    assert response.status_code == 200
+    story = response.json()
+    assert story["audio_filename"] is None
+
+    fake_tts = FakeTTS()
+    monkeypatch.setattr(routes.audio_service, "tts", fake_tts)
+    monkeypatch.setattr(routes.audio_service, "audio_format", "wav")
+    monkeypatch.setattr(routes.audio_service, "_split_sentences", lambda text: text.split(". "))
+
+    response = client.get(story["audio_stream_url"])
+    assert response.status_code == 200
+    assert response.content[:4] == b"RIFF"
+    assert len(fake_tts.calls) == 2
+    assert len(response.content) == 44 + 2 * 200 * 2
+
+    story = client.get(f"/api/stories/{story['id']}").json()
+    assert story["audio_filename"] == f"{story['id']}.wav"
+    with wave.open(routes.storage.path(story["audio_filename"])) as audio:
+        assert audio.getnframes() == 400
+
+def test_get_audio_file_transcodes(client):
+    """Test on-demand transcoding of stored WAV narrations"""
+    filename = "transcode-test.wav"
+    with wave.open(os.path.join(routes.settings.AUDIO_OUTPUT_DIR, filename), "wb") as audio:
+        audio.setnchannels(1)
+        audio.setsampwidth(2)
+        audio.setframerate(16000)
+        audio.writeframes(b"\x00\x10" * 16000)
+
+    response = client.get(f"/api/audio/{filename}")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "audio/wav"
+
+    response = client.get(f"/api/audio/{filename}?format=flac")
+    assert response.status_code == 400
+
+    if not routes.audio_service.transcoder.available:
+        pytest.skip("ffmpeg is not installed")
+
+    response = client.get(f"/api/audio/{filename}?format=mp3")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "audio/mpeg"
+    assert 0 < len(response.content) < 32000
+    assert os.path.exists(routes.audio_service.transcoder.derived_path(filename, "mp3"))
+
+def test_media_conditional_and_range_requests(client):
+    """Test ETag revalidation, immutable caching and byte ranges on media routes"""
+    filename = "range-test.wav"
+    body = bytes(range(256)) * 40
+    with open(os.path.join(routes.settings.AUDIO_OUTPUT_DIR, filename), "wb") as audio:
+        audio.write(body)
+
+    response = client.get(f"/api/audio/{filename}")
+    assert response.status_code == 200
+    assert response.content == body
+    assert "immutable" in response.headers["cache-control"]
+    assert response.headers["accept-ranges"] == "bytes"
+    etag = response.headers["etag"]
+    assert etag.startswith('"') and etag.endswith('"')
+
+    response = client.get(f"/api/audio/{filename}", headers={"If-None-Match": f'W/"other", {etag}'})
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response.headers["etag"] == etag
+
+    response = client.get(f"/api/audio/{filename}", headers={"Range": "bytes=100-199"})
+    assert response.status_code == 206
+    assert response.content == body[100:200]
+    assert response.headers["content-range"] == f"bytes 100-199/{len(body)}"
+
+    response = client.get(f"/api/audio/{filename}", headers={"Range": "bytes=-10"})
+    assert response.status_code == 206
+    assert response.content == body[-10:]
+
+    response = client.get(f"/api/audio/{filename}", headers={"Range": f"bytes={len(body)}-"})
+    assert response.status_code == 416
+    assert response.headers["content-range"] == f"bytes */{len(body)}"
+
+    # A stale If-Range gets the whole file rather than a piece of a different one
+    response = client.get(f"/api/audio/{filename}", headers={"Range": "bytes=0-9", "If-Range": '"stale"'})
+    assert response.status_code == 200
+    assert response.content == body
+
+    response = client.get(f"/audio/{filename}", follow_redirects=False)
+    assert response.status_code == 301
+    assert response.headers["location"] == f"/api/audio/{filename}"
+
+def test_readiness_check(client):
+    """Test the readiness endpoint reports each warm-up component"""
+    for _ in range(100):
+        response = client.get("/ready")
+        if response.status_code == 200:
+            break
+        time.sleep(0.05)
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["ready"] is True
+    assert body["components"]["database"]["state"] == "ready"
+    assert body["components"]["tts"]["state"] in ("ready", "disabled")
+
+def test_get_stories_keyset_pagination(client):
+    """Test cursor pagination over stories sharing a timestamp, with field projection"""
+    db = TestingSessionLocal()
+    created_at = datetime(2024, 1, 1, 12, 0, 0)
+    inserted = {f"page-test-{i}" for i in range(5)}
+    for story_id in inserted:
+        db.add(Story(
+            id=story_id,
+            story_text="Once upon a time.",
+            story_type="story",
+            image_filename=f"{story_id}.jpg",
+            created_at=created_at
+        ))
+    db.commit()
+    db.close()
+
+    seen = []
+    cursor = None
+    for _ in range(100):
+        params = {"limit": 2, "fields": "id,audio_url"}
+        if cursor:
+            params["cursor"] = cursor
+        response = client.get("/api/stories", params=params)
+        assert response.status_code == 200
+        page = response.json()
+        assert all(set(story) == {"id", "audio_url"} for story in page)
+        seen.extend(story["id"] for story in page)
+        cursor = response.headers.get("x-next-cursor")
+        if not cursor:
+            break
+
+    assert len(seen) == len(set(seen))
+    assert inserted <= set(seen)
+
+def test_get_stories_cursor_row_deleted_between_pages(client):
+    """Test that a page after a deleted cursor row neither repeats nor skips stories"""
+    inserted = [f"cursor-gone-{i}" for i in range(6)]
+    with TestingSessionLocal() as db:
+        # Whole seconds, as SQLite's CURRENT_TIMESTAMP default writes them, and later
+        # than the stories of other tests so these make up the first pages
+        db.execute(
+            text(
+                "INSERT INTO stories (id, story_text, story_type, image_filename, created_at) "
+                "VALUES (:id, 'Once upon a time.', 'story', :image_filename, '2099-01-01 00:00:00')"
+            ),
+            [{"id": story_id, "image_filename": f"{story_id}.jpg"} for story_id in inserted]
+        )
+        db.commit()
+
+    response = client.get("/api/stories", params={"limit": 2, "fields": "id"})
+    first = [story["id"] for story in response.json()]
+    assert first == ["cursor-gone-5", "cursor-gone-4"]
+    with TestingSessionLocal() as db:
+        db.delete(db.get(Story, "cursor-gone-4"))
+        db.commit()
+
+    response = client.get("/api/stories", params={"limit": 2, "fields": "id", "cursor": response.headers["x-next-cursor"]})
+    assert [story["id"] for story in response.json()] == ["cursor-gone-3", "cursor-gone-2"]
+
+def test_export_stories_ndjson(client, monkeypatch):
+    """Test the NDJSON export streams every story across several fetch chunks"""
+    monkeypatch.setattr(routes.settings, "EXPORT_CHUNK_ROWS", 2)
+    db = TestingSessionLocal()
+    inserted = {f"export-test-{i}" for i in range(5)}
+    for story_id in inserted:
+        db.add(Story(
+            id=story_id,
+            story_text="Once upon a time.",
+            story_type="story",
+            image_filename=f"{story_id}.jpg",
+            audio_filename=f"{story_id}.wav"
+        ))
+    db.commit()
+    total = db.query(Story).count()
+    db.close()
+
+    response = client.get("/api/stories/export", params={"fields": "id,audio_url"})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert len(lines) == total
+    exported = {line["id"]: line for line in lines}
+    assert inserted <= set(exported)
+    assert all(set(line) == {"id", "audio_url"} for line in lines)
+    assert exported["export-test-0"]["audio_url"] == "/api/audio/export-test-0.wav"
+
+    assert client.get("/api/stories/export", params={"fields": "secret"}).status_code == 400
+
+def test_get_stories_invalid_fields(client):
+    """Test that unknown projection fields and cursors are rejected"""
+    assert client.get("/api/stories", params={"fields": "id,secret"}).status_code == 400
+    assert client.get("/api/stories", params={"cursor": "!!"}).status_code == 400
+
+def test_search_stories(client):
+    """Test full-text search ranking and index maintenance on delete"""
+    db = TestingSessionLocal()
+    db.add_all([
+        Story(id="search-1", story_text="A dragon guarded the mountain pass.", story_type="story", image_filename="s1.jpg"),
+        Story(id="search-2", story_text="Dragons and dragons everywhere, a dragon parade.", story_type="story", image_filename="s2.jpg"),
+        Story(id="search-3", story_text="A calm lake at dawn.", story_type="poem", image_filename="s3.jpg"),
+    ])
+    db.commit()
+    db.close()
+
+    response = client.get("/api/stories/search", params={"q": "dragon"})
+    assert response.status_code == 200
+    ids = [story["id"] for story in response.json()["results"]]
+    assert ids == ["search-2", "search-1"]
+
+    assert client.delete("/api/stories/search-2").status_code == 200
+    response = client.get("/api/stories/search", params={"q": "dragon", "fields": "id"})
+    assert response.json()["results"] == [{"id": "search-1", "score": response.json()["results"][0]["score"]}]
+
+def test_search_unsupported_database(client, monkeypatch):
+    """Test that search answers 501 on a database without full-text search"""
+    def unsupported(db, query, limit, offset):
+        raise SearchUnsupported("mssql")
+
+    monkeypatch.setattr(routes, "search_story_ids", unsupported)
+    response = client.get("/api/stories/search", params={"q": "dragon"})
+    assert response.status_code == 501
+
+def test_image_derivatives(client):
+    """Test that ?w= serves a cached, resized copy in a negotiated format"""
+    filename = "derivative-test.png"
+    Image.new("RGB", (800, 400), color=(10, 120, 200)).save(os.path.join(routes.settings.AUDIO_OUTPUT_DIR, filename))
+
+    response = client.get(f"/api/images/{filename}", params={"w": 200}, headers={"Accept": "image/webp,*/*"})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "image/webp"
+    assert Image.open(io.BytesIO(response.content)).size == (256, 128)
+
+    response = client.get(f"/api/images/{filename}", params={"w": 300})
+    assert response.headers["content-type"] == "image/jpeg"
+    assert Image.open(io.BytesIO(response.content)).size == (512, 256)
+
+    # Wider than the original: served at the original size, never upscaled
+    response = client.get(f"/api/images/{filename}", params={"w": 1024, "format": "webp"})
+    assert Image.open(io.BytesIO(response.content)).size == (800, 400)
+
+    assert client.get(f"/api/images/{filename}", params={"w": 256, "format": "gif"}).status_code == 400
+
+def test_upload_batch_streams_ndjson(client, monkeypatch):
+    """Test that batch results stream as NDJSON and failures stay isolated"""
+    async def fake_generate_story(image, story_type="story", on_stage=None):
+        if "broken" in image:
+            raise RuntimeError("inference exploded")
+        return f"A story about {os.path.basename(image).split('_', 1)[1]}."
+
+    monkeypatch.setattr(routes.story_service, "generate_story", fake_generate_story)
+    monkeypatch.setattr(routes.pipeline, "result_cache", None)
+
+    response = client.post(
+        "/api/upload/batch",
+        files=[
+            ("files", ("first.jpg", _make_image_bytes(), "image/jpeg")),
+            ("files", ("notes.txt", b"not an image", "text/plain")),
+            ("files", ("broken.jpg", _make_image_bytes(), "image/jpeg")),
+            ("files", ("second.jpg", _make_image_bytes(), "image/jpeg")),
+        ],
+        data={"story_type": "story", "audio": "stream"}
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+
+    results = sorted((json.loads(line) for line in response.text.splitlines()), key=lambda r: r["index"])
+    assert [r["filename"] for r in results] == ["first.jpg", "notes.txt", "broken.jpg", "second.jpg"]
+    assert results[0]["story"]["story_text"] == "A story about first.jpg."
+    assert results[1]["error"] == "File must be an image"
+    assert "inference exploded" in results[2]["error"]
+    assert results[3]["story"]["story_text"] == "A story about second.jpg."
+
+    stored = client.get(f"/api/stories/{results[3]['story']['id']}")
+    assert stored.status_code == 200
+
+def test_upload_batch_disconnect_discards_unsaved_images(client, monkeypatch, tmp_path):
+    """Test that a batch cut short by the client keeps saved stories' images and deletes the rest"""
+    async def fake_generate_story(image, story_type="story", on_stage=None):
+        if "first" not in os.path.basename(image):
+            # Still generating when the client leaves
+            await asyncio.Event().wait()
+        return "The first story."
+
+    monkeypatch.setattr(routes.story_service, "generate_story", fake_generate_story)
+    monkeypatch.setattr(routes.pipeline, "result_cache", None)
+    # The third item never gets to start
+    monkeypatch.setattr(routes.settings, "BATCH_CONCURRENCY", 1)
+
+    async def scenario():
+        engine = create_async_engine("sqlite+aiosqlite:///./test.db")
+        session_factory = async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
+        items = []
+        for index, name in enumerate(["first.jpg", "second.jpg", "third.jpg"]):
+            source = tmp_path / name
+            source.write_bytes(_make_image_bytes())
+            story_id = str(uuid.uuid4())
+            image_filename = f"{story_id}_{name}"
+            image_path = await storage.save(str(source), image_filename)
+            items.append((index, name, (story_id, image_filename, image_path, SimpleNamespace(sha256=story_id)), None))
+
+        lines = []
+        first_line = asyncio.Event()
+
+        async def receive():
+            await first_line.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            if message["type"] == "http.response.body" and message.get("body"):
+                lines.append(json.loads(message["body"]))
+                first_line.set()
+
+        response = StreamingResponse(
+            routes._generate_batch(items, "story", "stream", session_factory),
+            media_type="application/x-ndjson"
+        )
+        await response({"type": "http"}, receive, send)
+        await engine.dispose()
+        return items, lines
+
+    items, lines = asyncio.run(scenario())
+    assert [line["filename"] for line in lines] == ["first.jpg"]
+    image_filenames = [saved[1] for _, _, saved, _ in items]
+    assert os.path.exists(storage.path(image_filenames[0]))
+    assert not os.path.exists(storage.path(image_filenames[1]))
+    assert not os.path.exists(storage.path(image_filenames[2]))
+
+def test_job_events_stream(client, monkeypatch):
+    """Test that a job's progress is streamed as Server-Sent Events"""
+    async def fake_generate_story(image, story_type="story", on_stage=None):
+        await on_stage("inference")
+        return "The lantern hummed all night."
+
+    monkeypatch.setattr(routes.story_service, "generate_story", fake_generate_story)
+    monkeypatch.setattr(routes.pipeline, "result_cache", None)
+    monkeypatch.setattr(routes.job_queue, "session_factory", TestingAsyncSessionLocal)
+
+    response = client.post(
+        "/api/upload",
+        files={"file": ("lantern.jpg", _make_image_bytes(), "image/jpeg")},
+        data={"mode": "job", "audio": "stream"}
+    )
+    job_id = response.json()["id"]
+
+    events = []
+    with client.stream("GET", f"/api/jobs/{job_id}/events") as stream:
+        assert stream.headers["content-type"].startswith("text/event-stream")
+        event = None
+        for line in stream.iter_lines():
+            if line.startswith("event: "):
+                event = line[len("event: "):]
+            elif line.startswith("data: "):
+                events.append((event, json.loads(line[len("data: "):])))
+
+    names = [(name, data.get("stage")) for name, data in events]
+    assert names == [
+        ("stage_start", "prepare"), ("stage_end", "prepare"),
+        ("stage_start", "inference"), ("stage_end", "inference"),
+        ("story", None),
+        ("stage_start", "audio"), ("stage_end", "audio"),
+        ("stage_start", "save"), ("stage_end", "save"),
+        ("complete", None),
+    ]
+    assert events[4][1]["story_text"] == "The lantern hummed all night."
+    assert all(data["duration_ms"] >= 0 for name, data in events if name == "stage_end")
+    assert events[-1][1]["story"]["id"] == response.json()["story_id"]
+
+    # Resuming after the last event ends the stream straight away
+    with client.stream("GET", f"/api/jobs/{job_id}/events", headers={"Last-Event-ID": "9"}) as stream:
+        assert list(stream.iter_lines()) == []
+
+def test_job_events_for_job_run_elsewhere(client, monkeypatch):
+    """Test that the event stream ends when another server process finishes the job"""
+    monkeypatch.setattr(routes.settings, "SSE_JOB_POLL", 0.05)
+
+    with TestingSessionLocal() as db:
+        job = Job(status="running", stage="inference", story_id="elsewhere", image_filename="elsewhere.jpg")
+        db.add(job)
+        db.commit()
+        job_id = job.id
+
+    def finish_elsewhere():
+        # Written straight to the database, as a different worker would, so this process's broker never hears of it
+        with TestingSessionLocal() as db:
+            job = db.get(Job, job_id)
+            job.status = "failed"
+            job.error = "model unavailable"
+            db.commit()
+
+    timer = threading.Timer(0.2, finish_elsewhere)
+    timer.start()
+    try:
+        with client.stream("GET", f"/api/jobs/{job_id}/events") as stream:
+            lines = [line for line in stream.iter_lines() if line]
+    finally:
+        timer.join()
+
+    assert lines[-2] == "event: error"
+    assert json.loads(lines[-1][len("data: "):]) == {"stage": "inference", "error": "model unavailable"}
+
+def test_metrics_endpoint(client, monkeypatch):
+    """Test that /metrics exposes stage histograms and queue gauges"""
+    async def fake_generate_story(image, story_type="story", on_stage=None):
+        return "A kite over the harbour."
+
+    # An upload of its own, so the stages below were observed whatever ran before
+    monkeypatch.setattr(routes.story_service, "generate_story", fake_generate_story)
+    response = client.post(
+        "/api/upload",
+        files={"file": ("photo.jpg", _make_image_bytes() + b"metrics-test", "image/jpeg")},
+        data={"story_type": "story"}
+    )
+    assert response.status_code == 200
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+
+    body = response.text
+    assert "# TYPE storylens_stage_duration_seconds histogram" in body
+    assert 'storylens_stage_duration_seconds_count{stage="upload_read"}' in body
+    assert 'storylens_stage_duration_seconds_bucket{le="+Inf",stage="db_commit"}' in body
+    assert 'storylens_queue_depth{executor="jobs"} 0.0' in body
+    assert "storylens_http_requests_in_flight 1.0" in body
@@ -0,0 +1,747 @@
+"""
+Tests for backend services
+"""
+import io
+import os
+import wave
+import time
+import sys
+import base64
+import signal
+import asyncio
+import subprocess
+from types import SimpleNamespace
+from datetime import datetime, timedelta, timezone
+
+import httpx
+import pytest
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from fastapi import FastAPI
+from PIL import Image
+
+from app.core.config import settings
+from app.core.database import async_database_url
+from app.core.admission import AdmissionController, AdmissionMiddleware
+from app.services.tts_workers import TTSWorkerPool
+from app.services.generator_backends import LocalKosmosBackend, RemoteGeneratorBackend, GeneratorUnavailable
+from app.services.inference_client import InferenceClient
+from app.services.circuit_breaker import CircuitBreaker, CLOSED, HALF_OPEN, OPEN
+from benchmarks.fakes import FakeInferenceServer
+from app.core.storage import LocalStorage, S3Storage, storage
+
+from app.services.image_processing import ImageProcessor, prepare_image, render_derivatives, image_derivative_path, MAX_IMAGE_SIZE
+from app.services.audio_service import AudioService
+from app.utils.locks import KeyedLocks
+from app.services import result_cache as result_cache_module
+from app.services.result_cache import MemoryCacheBackend, SQLiteCacheBackend, ResultCache
+from app.services import job_queue as job_queue_module
+from app.services.job_queue import JobQueue
+from app.models.job import Job
+import serve
+
+def _encode(size, fmt="JPEG", mode="RGB"):
+    """Create an in-memory image"""
+    buffer = io.BytesIO()
+    Image.new(mode, size, color=0).save(buffer, format=fmt)
+    return buffer.getvalue()
+
+def _decode(image_b64):
+    """Open a base64-encoded image"""
+    return Image.open(io.BytesIO(base64.b64decode(image_b64)))
+
+def test_prepare_image_keeps_small_jpeg(tmp_path):
+    """Test that a small RGB JPEG is sent without re-encoding"""
+    data = _encode((640, 480))
+    path = tmp_path / "small.jpg"
+    path.write_bytes(data)
+
+    assert base64.b64decode(prepare_image(str(path))) == data
+
+def test_prepare_image_downscales_large_jpeg():
+    """Test that large JPEGs are decoded in draft mode and resized"""
+    image = _decode(prepare_image(_encode((4096, 2048))))
+
+    assert image.format == "JPEG"
+    assert max(image.size) == MAX_IMAGE_SIZE
+
+def test_prepare_image_converts_png():
+    """Test that non-JPEG images are converted to RGB JPEG"""
+    image = _decode(prepare_image(_encode((300, 200), fmt="PNG", mode="RGBA")))
+
+    assert image.format == "JPEG"
+    assert image.mode == "RGB"
+    assert image.size == (300, 200)
+
+def test_prepare_image_keeps_decode_for_derivatives(tmp_path):
+    """Test that resized copies are rendered after the model input, from the same decode"""
+    path = tmp_path / "upload.jpg"
+    path.write_bytes(_encode((3000, 1500)))
+    derivatives = [
+        (width, "webp", str(tmp_path / f"copy_w{width}.webp"))
+        for width in (256, 512, 1024)
+    ]
+
+    image = _decode(prepare_image(str(path), keep_width=1024))
+    assert max(image.size) == MAX_IMAGE_SIZE
+    assert not any(os.path.exists(output) for _, _, output in derivatives)
+
+    # Only the kept decode is left to render from
+    path.unlink()
+    render_derivatives(str(path), derivatives)
+    for width, _, output in derivatives:
+        with Image.open(output) as copy:
+            assert copy.format == "WEBP"
+            assert copy.size == (width, width // 2)
+
+def test_image_processor_renders_derivatives_after_prepare(tmp_path):
+    """Test that preparing an upload leaves the WebP copies to a follow-up render"""
+    name = "derived-after-prepare.jpg"
+    source = storage.path(name)
+    os.makedirs(os.path.dirname(source), exist_ok=True)
+    with open(source, "wb") as f:
+        f.write(_encode((1200, 600)))
+    processor = ImageProcessor(workers=0, derivatives_on_prepare=True)
+
+    async def scenario():
+        image_b64 = await processor.prepare(source)
+        pending = set(processor._renders)
+        await asyncio.gather(*pending)
+        return image_b64, pending
+
+    try:
+        image_b64, pending = asyncio.run(scenario())
+        assert max(_decode(image_b64).size) == MAX_IMAGE_SIZE
+        assert len(pending) == 1
+        for width in settings.image_derivative_widths_list:
+            assert os.path.exists(image_derivative_path(source, width, "webp"))
+    finally:
+        asyncio.run(processor.delete_derivatives(source))
+        os.remove(source)
+
+def test_split_sentences_merges_short_sentences():
+    """Test that TTS chunks break at sentence ends and respect the size limit"""
+    service = AudioService()
+    text = "One. Two! Three? " + "A much longer sentence that goes on for a while."
+
+    chunks = service._split_sentences(text, max_chars=20)
+
+    assert chunks == ["One. Two! Three?", "A much longer sentence that goes on for a while."]
+
+class FakeTTSModel:
+    """Picklable stand-in for the TTS model used in worker processes"""
+
+    class synthesizer:
+        output_sample_rate = 16000
+
+    def tts(self, text, speaker_wav=None, language="en"):
+        if text == "crash":
+            os._exit(1)
+        return [0.25] * len(text)
+
+def fake_model_factory(model_name):
+    return FakeTTSModel()
+
+def test_tts_worker_pool_synthesizes_and_restarts(monkeypatch):
+    """Test that the worker pool batches requests and survives a worker crash"""
+    monkeypatch.setattr(settings, "TTS_HEALTH_INTERVAL", 0.1)
+
+    async def scenario():
+        pool = TTSWorkerPool(workers=2, model_name="fake", model_factory=fake_model_factory)
+        await pool.start()
+        try:
+            results = await asyncio.gather(*(pool.synthesize_pcm("x" * n) for n in range(1, 6)))
+            assert [len(pcm) for pcm in results] == [2, 4, 6, 8, 10]
+            assert pool.sample_rate == 16000
+
+            with pytest.raises(RuntimeError):
+                await asyncio.wait_for(pool.synthesize_pcm("crash"), 30)
+
+            assert len(await asyncio.wait_for(pool.synthesize_pcm("ok"), 30)) == 4
+            assert sum(worker["restarts"] for worker in pool.health()["workers"]) == 1
+        finally:
+            await pool.stop()
+
+    asyncio.run(scenario())
+
+class FakeKosmosBackend(LocalKosmosBackend):
+    """Local backend with the model replaced by a function of the batch"""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.model = object()
+        self.batches = []
+
+    def _generate_batch(self, images_b64, prompts):
+        self.batches.append(len(prompts))
+        if "fail" in prompts:
+            raise RuntimeError("generation failed")
+        return [f"{prompt} story" for prompt in prompts]
+
+def test_local_backend_micro_batches_concurrent_requests():
+    """Test that concurrent requests are generated together, up to the batch size"""
+
+    async def scenario():
+        backend = FakeKosmosBackend(batch_size=4, batch_window_ms=50)
+        try:
+            texts = await asyncio.gather(*(backend.generate("image", f"p{n}") for n in range(6)))
+            assert texts == [f"p{n} story" for n in range(6)]
+            assert backend.batches == [4, 2]
+
+            with pytest.raises(RuntimeError):
+                await backend.generate("image", "fail")
+            assert await backend.generate("image", "again") == "again story"
+            assert backend.depth == 0
+        finally:
+            await backend.stop()
+
+    asyncio.run(scenario())
+
+class FakeS3Client:
+    """In-memory stand-in for the boto3 S3 client calls the storage uses"""
+
+    def __init__(self):
+        self.objects = {}
+
+    def upload_file(self, filename, bucket, key):
+        with open(filename, "rb") as f:
+            self.objects[(bucket, key)] = f.read()
+
+    def download_file(self, bucket, key, filename):
+        if (bucket, key) not in self.objects:
+            error = Exception("Not Found")
+            error.response = {"Error": {"Code": "404"}}
+            raise error
+        with open(filename, "wb") as f:
+            f.write(self.objects[(bucket, key)])
+
+    def delete_object(self, Bucket, Key):
+        self.objects.pop((Bucket, Key), None)
+
+def test_local_storage_shards_and_finds_legacy_files(tmp_path):
+    """Test sharded placement, atomic saves and the flat-layout fallback"""
+    storage = LocalStorage(root=str(tmp_path), shard_depth=2)
+
+    async def scenario():
+        partial = storage.temp_path("story.wav")
+        with open(partial, "wb") as f:
+            f.write(b"audio")
+        path = await storage.save(partial, "story.wav")
+        assert os.path.relpath(path, tmp_path).count(os.sep) == 2
+        assert not os.path.exists(partial)
+        assert await storage.fetch("story.wav") == path
+
+        derived = storage.path("derived/images/story_w256.webp")
+        assert os.path.relpath(derived, tmp_path).startswith(os.path.join("derived", "images"))
+
+        (tmp_path / "old.jpg").write_bytes(b"image")
+        assert await storage.fetch("old.jpg") == str(tmp_path / "old.jpg")
+        assert await storage.fetch("../old.jpg") is None
+
+        assert await storage.delete("story.wav") is True
+        assert await storage.fetch("story.wav") is None
+
+    asyncio.run(scenario())
+
+def test_s3_storage_writes_through_and_refills_cache(tmp_path):
+    """Test that stored files reach the bucket and are downloaded again on a cache miss"""
+    client = FakeS3Client()
+    storage = S3Storage(client=client, bucket="media", prefix="app", root=str(tmp_path))
+
+    async def scenario():
+        source = tmp_path / "source.jpg"
+        source.write_bytes(b"image")
+        await storage.link(str(source), "story.jpg")
+        assert client.objects[("media", "app/story.jpg")] == b"image"
+
+        os.remove(storage.path("story.jpg"))
+        path = await storage.fetch("story.jpg")
+        with open(path, "rb") as f:
+            assert f.read() == b"image"
+
+        await storage.delete("story.jpg")
+        assert client.objects == {}
+        assert await storage.fetch("story.jpg") is None
+
+    asyncio.run(scenario())
+
+def test_identical_narrations_are_synthesized_once(monkeypatch, tmp_path):
+    """Test that stories with the same text link one cached narration"""
+    monkeypatch.setattr(settings, "AUDIO_OUTPUT_DIR", str(tmp_path))
+    service = AudioService()
+    calls = []
+
+    def fake_generate_audio_sync(text, output_path):
+        calls.append(text)
+        with wave.open(output_path, "wb") as audio:
+            audio.setnchannels(1)
+            audio.setsampwidth(2)
+            audio.setframerate(16000)
+            audio.writeframes(b"\x00\x10" * 1600)
+
+    service.tts = object()
+    service.audio_format = "wav"
+    monkeypatch.setattr(service, "_generate_audio_sync", fake_generate_audio_sync)
+    text = "The same fallback words."
+
+    async def scenario():
+        filenames = await asyncio.gather(*(service.generate_audio(text, f"narration-{n}") for n in range(3)))
+        assert filenames == [f"narration-{n}.wav" for n in range(3)]
+        assert len(calls) == 1
+        inodes = {os.stat(storage.path(filename)).st_ino for filename in filenames}
+        assert len(inodes) == 1
+
+        for filename in filenames:
+            await service.delete_audio_file(filename, text)
+        assert await service.reuse_narration(text, "narration-4") is None
+
+    asyncio.run(scenario())
+
+def test_keyed_locks_stay_shared_while_tasks_wait():
+    """Test that a key's lock isn't dropped while a woken waiter has yet to take it"""
+    async def scenario():
+        locks = KeyedLocks()
+        inside = 0
+        peak = 0
+        late = []
+
+        async def worker(spawn=False):
+            nonlocal inside, peak
+            async with locks.hold("narration"):
+                inside += 1
+                peak = max(peak, inside)
+                await asyncio.sleep(0.01)
+                inside -= 1
+            if spawn:
+                # Arrives after the release but before the woken waiter runs
+                late.append(asyncio.create_task(worker()))
+
+        await asyncio.gather(worker(spawn=True), worker())
+        await asyncio.gather(*late)
+        assert peak == 1
+        assert len(locks) == 0
+
+    asyncio.run(scenario())
+
+def test_admission_queues_then_rejects_with_retry_after():
+    """Test that generation requests queue up to the limit, then get 429 while reads still pass"""
+    async def scenario():
+        release = asyncio.Event()
+        controller = AdmissionController(max_active=1, max_queue=1, stage_limits={})
+        app = FastAPI()
+        app.add_middleware(AdmissionMiddleware, controller=controller, paths=("/generate",))
+
+        @app.post("/generate")
+        async def generate():
+            await release.wait()
+            return {"ok": True}
+
+        @app.get("/stories")
+        async def stories():
+            return []
+
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            running = asyncio.create_task(client.post("/generate"))
+            queued = asyncio.create_task(client.post("/generate"))
+            while controller.requests.waiting < 1:
+                await asyncio.sleep(0.01)
+
+            rejected = await client.post("/generate")
+            assert rejected.status_code == 429
+            assert int(rejected.headers["retry-after"]) >= 1
+            assert (await client.get("/stories")).status_code == 200
+
+            release.set()
+            assert (await running).status_code == 200
+            assert (await queued).status_code == 200
+
+        stats = controller.stats()["requests"]
+        assert (stats["active"], stats["waiting"], stats["completed"], stats["rejected"]) == (0, 0, 2, 1)
+
+    asyncio.run(scenario())
+
+def test_inference_client_retries_loading_model_with_backoff():
+    """Test that 503s are retried with growing delays, capped by INFERENCE_BACKOFF_MAX"""
+    server = FakeInferenceServer(latency=0.0, jitter=0.0, error_rate=1.0, estimated_time=0.0).start()
+    delays = []
+
+    async def scenario():
+        client = InferenceClient(max_retries=5, backoff_base=0.01, backoff_max=0.05)
+        backoff_delay = client._backoff_delay
+
+        def recording_delay(attempt, response):
+            delays.append(backoff_delay(attempt, response))
+            if len(delays) == 3:
+                # The model finishes loading
+                server.error_rate = 0.0
+            return delays[-1]
+
+        client._backoff_delay = recording_delay
+        try:
+            response = await client.post(server.url, headers={}, json={"inputs": {"text": "p"}})
+            assert response.status_code == 200
+
+            # estimated_time stretches a delay, but never past backoff_max
+            server.error_rate = 1.0
+            server.estimated_time = 10.0
+            client.max_retries = 1
+            response = await client.post(server.url, headers={}, json={"inputs": {"text": "p"}})
+            assert response.status_code == 503
+        finally:
+            await client.aclose()
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        server.stop()
+
+    assert server.requests == 6
+    for attempt, ceiling in enumerate((0.01, 0.02, 0.04)):
+        assert ceiling / 2 <= delays[attempt] <= ceiling
+    assert 0.05 * 0.8 <= delays[3] <= 0.05
+
+def test_inference_client_caps_in_flight_requests():
+    """Test that concurrent posts never exceed max_in_flight, and a new event loop gets a new client"""
+    server = FakeInferenceServer(latency=0.05, jitter=0.0).start()
+    clients = []
+
+    async def scenario(client):
+        peak = 0
+
+        async def watch():
+            nonlocal peak
+            while True:
+                peak = max(peak, client.in_flight)
+                await asyncio.sleep(0.005)
+
+        watcher = asyncio.create_task(watch())
+        await asyncio.gather(*[
+            client.post(server.url, headers={}, json={"inputs": {"text": "p"}})
+            for _ in range(8)
+        ])
+        watcher.cancel()
+        clients.append(client._client)
+        return peak
+
+    client = InferenceClient(max_in_flight=2)
+    try:
+        assert asyncio.run(scenario(client)) == 2
+        # The client bound to the finished loop is closed when replaced
+        assert asyncio.run(scenario(client)) == 2
+        assert clients[0] is not clients[1]
+        assert clients[0].is_closed
+        asyncio.run(client.aclose())
+
+        # 0 means no cap rather than the default
+        unlimited = InferenceClient(max_in_flight=0)
+        assert asyncio.run(scenario(unlimited)) == 8
+        asyncio.run(unlimited.aclose())
+    finally:
+        server.stop()
+
+def test_circuit_breaker_opens_on_faults_and_recovers(monkeypatch):
+    """Test adaptive timeouts, fast fallbacks while open and half-open recovery against a faulty server"""
+    monkeypatch.setattr(settings, "HUGGINGFACE_API_KEY", "test")
+    monkeypatch.setattr(settings, "INFERENCE_TIMEOUT_MIN", 0.3)
+    server = FakeInferenceServer(latency=0.01, jitter=0.0).start()
+
+    async def scenario():
+        client = InferenceClient(max_retries=0)
+        breaker = CircuitBreaker(window=4, min_calls=4, failure_rate=0.5, open_seconds=0.5, half_open_calls=1)
+        backend = RemoteGeneratorBackend(client, server.url, breaker)
+        try:
+            for _ in range(4):
+                await backend.generate("image", "p")
+            assert breaker.state == CLOSED
+            # Fast, healthy calls shrink the timeout well below INFERENCE_TIMEOUT
+            assert 0.3 <= breaker.timeout() < 1.0
+
+            server.stall = 2.0
+            started = time.perf_counter()
+            with pytest.raises(GeneratorUnavailable) as error:
+                await backend.generate("image", "p")
+            assert error.value.reason == "timeout"
+            assert time.perf_counter() - started < 1.5
+
+            server.stall = 0.0
+            server.fail_status = 500
+            with pytest.raises(Exception):
+                await backend.generate("image", "p")
+            assert breaker.state == OPEN
+
+            # Open: fall back without touching the server
+            requests = server.requests
+            with pytest.raises(GeneratorUnavailable) as error:
+                await backend.generate("image", "p")
+            assert error.value.reason == "circuit_open"
+            assert server.requests == requests
+
+            # After the cool-down a failed probe opens it again, a good one closes it
+            await asyncio.sleep(0.5)
+            with pytest.raises(Exception):
+                await backend.generate("image", "p")
+            assert breaker.state == OPEN
+
+            server.fail_status = 0
+            await asyncio.sleep(0.5)
+            await backend.generate("image", "p")
+            assert breaker.state == CLOSED
+            assert breaker.snapshot()["transitions"] == {OPEN: 2, HALF_OPEN: 2, CLOSED: 1}
+        finally:
+            await client.aclose()
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        server.stop()
+
+def test_circuit_breaker_records_attempt_time_without_queueing(monkeypatch):
+    """Test that time waiting for an in-flight slot isn't counted as service latency"""
+    monkeypatch.setattr(settings, "HUGGINGFACE_API_KEY", "test")
+    server = FakeInferenceServer(latency=0.2, jitter=0.0).start()
+    recorded = []
+
+    async def scenario():
+        client = InferenceClient(max_in_flight=1, max_retries=0)
+        breaker = CircuitBreaker()
+        record = breaker.record
+        monkeypatch.setattr(breaker, "record", lambda success, seconds: recorded.append(seconds) or record(success, seconds))
+        backend = RemoteGeneratorBackend(client, server.url, breaker)
+        try:
+            started = time.perf_counter()
+            await asyncio.gather(*(backend.generate("image", "p") for _ in range(3)))
+            return time.perf_counter() - started
+        finally:
+            await client.aclose()
+
+    try:
+        elapsed = asyncio.run(scenario())
+    finally:
+        server.stop()
+
+    # The calls ran one after another, yet each is recorded with its own request time
+    assert elapsed >= 0.6
+    assert len(recorded) == 3
+    assert all(0.2 <= seconds < 0.4 for seconds in recorded)
+
+def test_in_memory_database_url_serves_requests():
+    """Test that the app starts on in-memory SQLite, with one shared connection per engine"""
+    script = (
+        "from fastapi.testclient import TestClient\n"
+        "import main\n"
+        "with TestClient(main.app) as client:\n"
+        "    assert client.get('/api/stories').status_code == 200\n"
+        "    assert client.get('/api/stories/search', params={'q': 'cat'}).status_code == 200\n"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", script],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        env={**os.environ, "DATABASE_URL": "sqlite://"},
+        capture_output=True,
+        text=True,
+        timeout=120
+    )
+    assert result.returncode == 0, result.stderr
+
+def test_async_database_url():
+    """Test the async driver rewrite, and a clear error when none is known"""
+    assert async_database_url("sqlite:///./app.db") == "sqlite+aiosqlite:///./app.db"
+    assert async_database_url("postgresql://u:p@db/app") == "postgresql+asyncpg://u:p@db/app"
+    assert async_database_url("oracle+oracledb_async://u:p@db/app") == "oracle+oracledb_async://u:p@db/app"
+    with pytest.raises(ValueError, match="DATABASE_URL"):
+        async_database_url("mssql://u:p@db/app")
+
+def _check_result_cache_eviction_and_expiry(backend, tmp_path, monkeypatch):
+    """Fill a two-entry cache past capacity and past its TTL on a fake clock"""
+    clock = SimpleNamespace(now=1000.0)
+
+    def tick():
+        clock.now += 1
+        return clock.now
+
+    monkeypatch.setattr(result_cache_module, "time", SimpleNamespace(time=lambda: clock.now))
+    narration = tmp_path / "narration.wav"
+    narration.write_bytes(b"RIFF narration")
+    cache = ResultCache(backend, ttl=60, directory=str(tmp_path / "cache"))
+
+    cache.put("a", "Story A", str(narration))
+    tick()
+    cache.put("b", "Story B")
+    tick()
+    cached_narration = cache.get("a")["audio_path"]
+    assert os.path.dirname(cached_narration) == str(tmp_path / "cache")
+    assert os.path.exists(cached_narration)
+    tick()
+
+    # b is the least recently used, as a was read since
+    cache.put("c", "Story C")
+    tick()
+    assert cache.get("b") is None
+    tick()
+    assert cache.get("c")["story_text"] == "Story C"
+    tick()
+    assert cache.evictions == 1
+
+    # Evicting a drops the cache's own link to the narration, not the original
+    cache.put("d", "Story D")
+    tick()
+    assert cache.get("a") is None
+    assert not os.path.exists(cached_narration)
+    assert narration.exists()
+    assert cache.evictions == 2
+    assert len(backend) == 2
+
+    # Entries older than the TTL are misses and are removed with their narration
+    cache.put("e", "Story E", str(narration))
+    expiring_narration = os.path.join(str(tmp_path / "cache"), "e.wav")
+    assert os.path.exists(expiring_narration)
+    clock.now += 61
+    assert cache.get("e") is None
+    assert not os.path.exists(expiring_narration)
+    assert len(backend) == 1
+    assert cache.stats()["misses"] == 3
+    cache.close()
+
+def test_memory_result_cache_evicts_and_expires(tmp_path, monkeypatch):
+    """Test LRU eviction, TTL expiry and narration cleanup of the in-process cache"""
+    _check_result_cache_eviction_and_expiry(MemoryCacheBackend(max_entries=2), tmp_path, monkeypatch)
+
+def test_sqlite_result_cache_evicts_and_expires(tmp_path, monkeypatch):
+    """Test LRU eviction, TTL expiry and narration cleanup of the shared SQLite cache"""
+    backend = SQLiteCacheBackend(str(tmp_path / "results.db"), max_entries=2)
+    _check_result_cache_eviction_and_expiry(backend, tmp_path, monkeypatch)
+
+def test_sqlite_result_cache_reconnects_after_fork(tmp_path):
+    """Test that a forked process opens its own connection instead of using the parent's"""
+    backend = SQLiteCacheBackend(str(tmp_path / "cache.db"), max_entries=10)
+    backend.set("parent", {"story_text": "Made before the fork.", "created_at": time.time()})
+    parent_connection = backend._conn
+
+    pid = os.fork()
+    if pid == 0:
+        try:
+            ok = (
+                backend.get("parent")["story_text"] == "Made before the fork."
+                and backend._conn is not parent_connection
+            )
+            backend.set("child", {"story_text": "Made after the fork.", "created_at": time.time()})
+        except Exception:
+            ok = False
+        os._exit(0 if ok else 1)
+
+    _, status = os.waitpid(pid, 0)
+    assert os.waitstatus_to_exitcode(status) == 0
+    assert backend._conn is parent_connection
+    assert backend.get("child")["story_text"] == "Made after the fork."
+    backend.close()
+
+def test_master_replaces_exited_worker(monkeypatch, tmp_path):
+    """Test that a worker that exits is replaced by a new process"""
+    log = tmp_path / "workers.log"
+
+    class FakeServer:
+        """Records the worker's pid in place of serving"""
+
+        def __init__(self, config):
+            pass
+
+        def run(self, sockets):
+            replacement = log.exists()
+            with open(log, "a") as f:
+                f.write(f"{os.getpid()}\n")
+            if replacement:
+                # The replacement is up; stop the master
+                os.kill(os.getppid(), signal.SIGTERM)
+            os._exit(0)
+
+    monkeypatch.setattr(serve.uvicorn, "Server", FakeServer)
+    monkeypatch.setattr(serve, "MIN_WORKER_UPTIME", 0.0)
+    handlers = {signum: signal.getsignal(signum) for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGALRM)}
+    sock = serve.bind("127.0.0.1", 0)
+    try:
+        serve.Master(SimpleNamespace(app=object()), sock, workers=1).run()
+    finally:
+        signal.alarm(0)
+        for signum, handler in handlers.items():
+            signal.signal(signum, handler)
+        sock.close()
+
+    pids = log.read_text().split()
+    assert len(pids) == 2 and pids[0] != pids[1]
+
+def test_job_queue_takes_over_expired_leases(monkeypatch, tmp_path):
+    """Test that jobs of a stopped or crashed process are resumed, and live leases left alone"""
+    async def fetch(filename):
+        return str(tmp_path / filename)
+
+    async def delete(filename):
+        pass
+
+    monkeypatch.setattr(job_queue_module, "storage", SimpleNamespace(fetch=fetch, delete=delete))
+
+    class StubPipeline:
+        async def run(self, db, story_id, image_path, story_type, image_filename, **kwargs):
+            if story_id == "blocked":
+                await asyncio.Event().wait()
+            return SimpleNamespace(to_dict=lambda: {"id": story_id})
+
+    async def scenario():
+        engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'jobs.db'}")
+        session_factory = async_sessionmaker(engine, expire_on_commit=False)
+        async with engine.begin() as conn:
+            await conn.run_sync(Job.__table__.create)
+
+        now = datetime.now(timezone.utc)
+        async with session_factory() as db:
+            db.add_all([
+                # Left running by a worker that crashed
+                Job(id="crashed", status="running", stage="inference", story_id="crashed",
+                    image_filename="a.jpg", owner="gone:1", lease_expires_at=now - timedelta(seconds=1)),
+                # Still leased to a live worker, until it stops renewing below
+                Job(id="live", story_id="live", image_filename="b.jpg",
+                    owner="busy:2", lease_expires_at=now + timedelta(seconds=60)),
+            ])
+            await db.commit()
+
+        async def status(job_id):
+            async with session_factory() as db:
+                return await db.get(Job, job_id)
+
+        async def wait_for(job_id, wanted):
+            for _ in range(100):
+                job = await status(job_id)
+                if job.status == wanted:
+                    return job
+                await asyncio.sleep(0.02)
+            return job
+
+        queue = JobQueue(StubPipeline(), session_factory, workers=1, lease=0.2)
+        await queue.start()
+        try:
+            crashed = await wait_for("crashed", "completed")
+            assert crashed.owner == queue.owner
+            assert (await status("live")).status == "queued"
+
+            # The live worker goes away without handing the job back
+            async with session_factory() as db:
+                (await db.get(Job, "live")).lease_expires_at = datetime.now(timezone.utc)
+                await db.commit()
+            assert (await wait_for("live", "completed")).owner == queue.owner
+
+            # A job still running when the queue stops is handed back at once
+            async with session_factory() as db:
+                job = Job(id="blocked", story_id="blocked", image_filename="c.jpg")
+                queue.lease_job(job)
+                db.add(job)
+                await db.commit()
+            queue.submit("blocked")
+            await wait_for("blocked", "running")
+        finally:
+            await queue.stop()
+
+        blocked = await status("blocked")
+        assert blocked.status == "running"
+        assert blocked.lease_expires_at <= datetime.now(timezone.utc).replace(tzinfo=None)
+        await engine.dispose()
+
+    asyncio.run(scenario())
@@ -100,7 +100,11 @@ const StoryCard: React.FC<StoryCardProps> = ({ story, onDelete }) => {
       {story.image_filename && (
         <div className="mt-4">
           <img
-            src={storyApi.getImageUrl(story.image_filename)}
+            src={storyApi.getImageUrl(story.image_filename, 512)}
+            srcSet={[256, 512, 1024]
+              .map((width) => `${storyApi.getImageUrl(story.image_filename, width)} ${width}w`)
+              .join(', ')}
+            sizes="(min-width: 768px) 50vw, 100vw"
             alt="Story inspiration"
             className="w-full h-48 object-cover rounded-lg"
             loading="lazy"
@@ -48,9 +48,10 @@ export const storyApi = {
     return `${API_BASE_URL}/api/audio/${filename}`;
   },
 
-  // Get image file URL
-  getImageUrl: (filename: string): string => {
-    return `${API_BASE_URL}/api/images/${filename}`;
+  // Get image file URL, optionally a resized copy at least `width` pixels wide
+  getImageUrl: (filename: string, width?: number): string => {
+    const url = `${API_BASE_URL}/api/images/${filename}`;
+    return width ? `${url}?w=${width}` : url;
   },
 };
 